@@ -0,0 +1,231 @@
+"""A cache of decoded raster blocks, shared by the worker's pool processes.
+
+The base LULC is a compressed GeoTIFF, possibly read over ``/vsicurl/``,
+and neighboring study areas read the same blocks over and over. GDAL's
+block cache belongs to a single process, so this cache keeps decoded
+blocks in shared memory where every pool process can use them.
+"""
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy
+from osgeo import gdal
+from osgeo import gdal_array
+
+LOGGER = logging.getLogger(__name__)
+
+# The shared memory starts with an int64 header: these counters, then the
+# key of the block in each slot, then the clock tick when each slot was
+# last used. The blocks follow the header.
+_HITS, _MISSES, _EVICTIONS, _CLOCK = range(4)
+_N_COUNTERS = 4
+_EMPTY_SLOT = -1
+
+
+class SharedBlockCache:
+    """A least recently used cache of the blocks of a raster's first band.
+
+    Create the cache in the parent process and hand it to the pool
+    processes through the pool's ``initargs``. It is pickled by the name of
+    its shared memory, so every process uses the same blocks.
+    """
+
+    def __init__(self, raster_path, max_bytes, mp_context=None):
+        """Create the shared memory of the cache.
+
+        Args:
+            raster_path (str): A GDAL-compatible path to the raster.
+            max_bytes (int): The most memory the cached blocks may use.
+            mp_context (multiprocessing.context.BaseContext): The context
+                of the pool processes that will share the cache. If
+                ``None``, the default context is used.
+
+        Raises:
+            ValueError: If ``max_bytes`` is smaller than one block.
+        """
+        raster = gdal.OpenEx(raster_path, gdal.OF_RASTER)
+        band = raster.GetRasterBand(1)
+        self._state = {
+            'raster_path': raster_path,
+            'raster_size': (band.XSize, band.YSize),
+            'block_size': tuple(band.GetBlockSize()),
+            'dtype': numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(
+                band.DataType)).str,
+        }
+        band = None
+        raster = None
+
+        block_xsize, block_ysize = self._state['block_size']
+        block_bytes = (block_xsize * block_ysize
+                       * numpy.dtype(self._state['dtype']).itemsize)
+        n_slots = max_bytes // block_bytes
+        if n_slots < 1:
+            raise ValueError(
+                f'max_bytes must be at least one block ({block_bytes} '
+                f'bytes), not {max_bytes}')
+        self._state['n_slots'] = n_slots
+        self._state['lock'] = (mp_context or multiprocessing).Lock()
+        header_bytes = (
+            (_N_COUNTERS + 2 * n_slots) * numpy.dtype(numpy.int64).itemsize)
+        self._shared_memory = shared_memory.SharedMemory(
+            create=True, size=header_bytes + n_slots * block_bytes)
+        self._state['name'] = self._shared_memory.name
+        self._is_owner = True
+        self._attach()
+        self._header[:] = 0
+        self._keys[:] = _EMPTY_SLOT
+        LOGGER.info(f'Caching up to {n_slots} blocks of {raster_path} '
+                    'in shared memory')
+
+    def __getstate__(self):
+        return self._state
+
+    def __setstate__(self, state):
+        self._state = state
+        self._shared_memory = shared_memory.SharedMemory(name=state['name'])
+        self._is_owner = False
+        self._attach()
+
+    def _attach(self):
+        """Map the header and the blocks onto the shared memory."""
+        n_slots = self._state['n_slots']
+        block_xsize, block_ysize = self._state['block_size']
+        self._lock = self._state['lock']
+        self._header = numpy.ndarray(
+            (_N_COUNTERS + 2 * n_slots,), dtype=numpy.int64,
+            buffer=self._shared_memory.buf)
+        self._counters = self._header[:_N_COUNTERS]
+        self._keys = self._header[_N_COUNTERS:_N_COUNTERS + n_slots]
+        self._last_used = self._header[_N_COUNTERS + n_slots:]
+        self._blocks = numpy.ndarray(
+            (n_slots, block_ysize, block_xsize),
+            dtype=numpy.dtype(self._state['dtype']),
+            buffer=self._shared_memory.buf, offset=self._header.nbytes)
+        # Opened on first use, since GDAL handles can't be shared between
+        # processes.
+        self._raster = None
+        self._band = None
+
+    def close(self):
+        """Detach from the shared memory, freeing it in the parent process.
+
+        Returns:
+            ``None``
+        """
+        self._header = self._counters = self._keys = None
+        self._last_used = self._blocks = None
+        self._band = self._raster = None
+        self._shared_memory.close()
+        if self._is_owner:
+            self._shared_memory.unlink()
+
+    def get_stats(self):
+        """Get the cache's counters, summed over every process.
+
+        Returns:
+            stats (dict): The number of ``hits``, ``misses`` and
+                ``evictions``, the number of ``blocks`` cached, and the
+                ``max_blocks`` that fit in the cache.
+        """
+        with self._lock:
+            return {
+                'hits': int(self._counters[_HITS]),
+                'misses': int(self._counters[_MISSES]),
+                'evictions': int(self._counters[_EVICTIONS]),
+                'blocks': int(numpy.count_nonzero(
+                    self._keys != _EMPTY_SLOT)),
+                'max_blocks': self._state['n_slots'],
+            }
+
+    def _read_block(self, block_row, block_col):
+        """Decode a block from the raster."""
+        if self._band is None:
+            self._raster = gdal.OpenEx(
+                self._state['raster_path'], gdal.OF_RASTER)
+            self._band = self._raster.GetRasterBand(1)
+        raster_xsize, raster_ysize = self._state['raster_size']
+        block_xsize, block_ysize = self._state['block_size']
+        xoff = block_col * block_xsize
+        yoff = block_row * block_ysize
+        return self._band.ReadAsArray(
+            xoff, yoff, min(block_xsize, raster_xsize - xoff),
+            min(block_ysize, raster_ysize - yoff))
+
+    def get_block(self, block_row, block_col):
+        """Get a block of the raster, decoding it on a cache miss.
+
+        Args:
+            block_row (int): The row of the block in the raster's grid of
+                blocks.
+            block_col (int): The column of the block.
+
+        Returns:
+            block (numpy.ndarray): A copy of the block. Blocks on the right
+                and bottom edges of the raster may be smaller than the
+                raster's block size.
+        """
+        raster_xsize, raster_ysize = self._state['raster_size']
+        block_xsize, block_ysize = self._state['block_size']
+        n_block_cols = -(-raster_xsize // block_xsize)
+        key = block_row * n_block_cols + block_col
+        xsize = min(block_xsize, raster_xsize - block_col * block_xsize)
+        ysize = min(block_ysize, raster_ysize - block_row * block_ysize)
+
+        with self._lock:
+            self._counters[_CLOCK] += 1
+            slots = numpy.flatnonzero(self._keys == key)
+            if slots.size:
+                self._counters[_HITS] += 1
+                self._last_used[slots[0]] = self._counters[_CLOCK]
+                return self._blocks[slots[0], :ysize, :xsize].copy()
+
+        # Decode outside the lock so that other processes aren't held up.
+        block = self._read_block(block_row, block_col)
+        with self._lock:
+            self._counters[_MISSES] += 1
+            # Another process may have cached it in the meantime.
+            if not numpy.any(self._keys == key):
+                # Empty slots were never used, so they are evicted first.
+                slot = int(numpy.argmin(self._last_used))
+                if self._keys[slot] != _EMPTY_SLOT:
+                    self._counters[_EVICTIONS] += 1
+                self._keys[slot] = key
+                self._last_used[slot] = self._counters[_CLOCK]
+                self._blocks[slot, :ysize, :xsize] = block
+        return block
+
+    def read_window(self, xoff, yoff, win_xsize, win_ysize):
+        """Read a window of the raster, like ``gdal.Band.ReadAsArray``.
+
+        Args:
+            xoff (int): The column of the window's upper left pixel.
+            yoff (int): The row of the window's upper left pixel.
+            win_xsize (int): The width of the window, in pixels.
+            win_ysize (int): The height of the window, in pixels.
+
+        Returns:
+            array (numpy.ndarray): The pixels of the window. The window must
+                lie within the raster.
+        """
+        block_xsize, block_ysize = self._state['block_size']
+        array = numpy.empty(
+            (win_ysize, win_xsize), dtype=numpy.dtype(self._state['dtype']))
+        for block_row in range(
+                yoff // block_ysize,
+                (yoff + win_ysize - 1) // block_ysize + 1):
+            block_yoff = block_row * block_ysize
+            for block_col in range(
+                    xoff // block_xsize,
+                    (xoff + win_xsize - 1) // block_xsize + 1):
+                block_xoff = block_col * block_xsize
+                block = self.get_block(block_row, block_col)
+                # The part of the window that this block covers.
+                x0 = max(xoff, block_xoff)
+                x1 = min(xoff + win_xsize, block_xoff + block.shape[1])
+                y0 = max(yoff, block_yoff)
+                y1 = min(yoff + win_ysize, block_yoff + block.shape[0])
+                array[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = block[
+                    y0 - block_yoff:y1 - block_yoff,
+                    x0 - block_xoff:x1 - block_xoff]
+        return array
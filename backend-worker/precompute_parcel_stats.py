@@ -0,0 +1,186 @@
+"""Precompute the base LULC stats under every parcel.
+
+The parcels that the frontend offers are the City of San Antonio zoning
+layer (see ``frontend/parcel_data/data_workflow.md``), and neither it nor
+the base LULC change often. This computes the pixel counts under every
+parcel in parallel and stores them on the server, keyed by parcel ID and
+the version of the base LULC, so that ``/add_parcel`` can answer without a
+``stats_under_parcel`` job. Run it again whenever the base LULC changes::
+
+    python precompute_parcel_stats.py api 8000 /opt/appdata/COSA_Zoning.geojson
+"""
+import argparse
+import collections
+import concurrent.futures
+import logging
+import math
+import multiprocessing
+
+import requests
+import shapely.wkt
+from osgeo import gdal
+from osgeo import osr
+
+import worker
+
+logging.basicConfig(level=logging.INFO)
+LOGGER = logging.getLogger(__name__)
+
+# Parcels are grouped by the grid cell their centroid is in, in meters, so
+# that each group's stats are taken from one small window of the LULC.
+GROUP_CELL_SIZE = 2000
+
+# How many parcels' stats are sent to the server in each request.
+POST_BATCH_SIZE = 5000
+
+
+def _read_parcels(parcel_vector_path, id_field):
+    """Read the IDs and geometries of the parcels in a vector.
+
+    Args:
+        parcel_vector_path (str): The path to a vector of parcels, in any
+            projection.
+        id_field (str): The field with the parcel IDs that the frontend
+            uses.
+
+    Returns:
+        parcels (list): ``(parcel_id, parcel_wkt_epsg3857)`` tuples.
+
+    Raises:
+        ValueError: If the vector has no ``id_field``, since stats stored
+            under any other ID would never be found.
+    """
+    vector = gdal.OpenEx(parcel_vector_path, gdal.OF_VECTOR)
+    layer = vector.GetLayer()
+    source_srs = layer.GetSpatialRef()
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(
+        source_srs, worker._WEB_MERCATOR_SRS)
+    if layer.GetLayerDefn().GetFieldIndex(id_field) < 0:
+        raise ValueError(
+            f'{parcel_vector_path} has no field {id_field!r} of parcel IDs')
+
+    parcels = []
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        geometry.Transform(transform)
+        parcels.append(
+            (int(feature.GetField(id_field)), geometry.ExportToWkt()))
+    return parcels
+
+
+def _group_parcels(parcels, cell_size):
+    """Group parcels by the grid cell their centroid is in.
+
+    Args:
+        parcels (list): ``(parcel_id, parcel_wkt_epsg3857)`` tuples.
+        cell_size (float): The width of the grid cells, in meters.
+
+    Returns:
+        groups (list): Lists of ``(parcel_id, parcel_wkt_epsg3857)`` tuples.
+    """
+    groups = collections.defaultdict(list)
+    for parcel_id, parcel_wkt in parcels:
+        centroid = shapely.wkt.loads(parcel_wkt).centroid
+        cell = (math.floor(centroid.x / cell_size),
+                math.floor(centroid.y / cell_size))
+        groups[cell].append((parcel_id, parcel_wkt))
+    return list(groups.values())
+
+
+def _stats_under_parcels(parcels):
+    """Count the base LULC pixels under a group of parcels.
+
+    Args:
+        parcels (list): ``(parcel_id, parcel_wkt_epsg3857)`` tuples.
+
+    Returns:
+        parcel_stats (list): ``{'parcel_id', 'lulc_stats'}`` dicts, as the
+            server's ``/base_parcel_stats`` expects.
+    """
+    parcel_ids, parcel_wkts = zip(*parcels)
+    parcel_counts, _ = worker.pixelcounts_under_parcels(
+        list(parcel_wkts), worker.LULC_RASTER_PATH)
+    return [{'parcel_id': parcel_id, 'lulc_stats': counts}
+            for parcel_id, counts in zip(parcel_ids, parcel_counts)]
+
+
+def precompute_parcel_stats(host, port, parcel_vector_path, id_field='fid',
+                            n_workers=None, cell_size=GROUP_CELL_SIZE):
+    """Compute the base LULC stats under every parcel and send them.
+
+    Args:
+        host (str): The server's host.
+        port (str): The server's port.
+        parcel_vector_path (str): The path to a vector of parcels.
+        id_field (str): The field with the parcel IDs that the frontend
+            uses.
+        n_workers (int): How many processes compute stats. If ``None``,
+            one per CPU.
+        cell_size (float): The width of the grid cells that parcels are
+            grouped by, in meters.
+
+    Returns:
+        ``None``
+    """
+    lulc_version = worker._get_lulc_version(worker.LULC_RASTER_PATH)
+    LOGGER.info(f'Precomputing parcel stats for LULC version {lulc_version}')
+    parcels = _read_parcels(parcel_vector_path, id_field)
+    groups = _group_parcels(parcels, cell_size)
+    LOGGER.info(f'Read {len(parcels)} parcels in {len(groups)} groups')
+
+    stats_url = f'http://{host}:{port}/base_parcel_stats'
+    http_session = requests.Session()
+
+    def _post(parcel_stats):
+        response = http_session.post(stats_url, json={
+            'lulc_version': lulc_version, 'parcels': parcel_stats})
+        response.raise_for_status()
+
+    batch = []
+    n_done = 0
+    executor = concurrent.futures.ProcessPoolExecutor(
+        n_workers, mp_context=multiprocessing.get_context('spawn'))
+    with executor:
+        for group_stats in executor.map(_stats_under_parcels, groups):
+            batch.extend(group_stats)
+            if len(batch) >= POST_BATCH_SIZE:
+                _post(batch)
+                n_done += len(batch)
+                LOGGER.info(f'Stored stats for {n_done} of {len(parcels)} '
+                            'parcels')
+                batch = []
+    if batch:
+        _post(batch)
+        n_done += len(batch)
+    LOGGER.info(f'Stored stats for {n_done} parcels')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        __name__, description=(
+            'Precompute the base LULC stats under every parcel'))
+    parser.add_argument('queue_host')
+    parser.add_argument('queue_port')
+    parser.add_argument('parcel_vector_path')
+    parser.add_argument(
+        '--id-field', default='fid',
+        help='The field of the parcel IDs that the frontend uses.')
+    parser.add_argument(
+        '--workers', type=int,
+        help='How many processes compute stats. Defaults to one per CPU.')
+
+    args = parser.parse_args()
+    precompute_parcel_stats(
+        host=args.queue_host,
+        port=args.queue_port,
+        parcel_vector_path=args.parcel_vector_path,
+        id_field=args.id_field,
+        n_workers=args.workers,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Content-addressed caches for results the worker would otherwise recompute.
+
+Entries are keyed by a hash of everything that determines the result, so an
+entry can be shared by any scenario in any session that asks for the same
+thing.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+
+import shapely.wkt
+
+logging.basicConfig(level=logging.INFO)
+LOGGER = logging.getLogger(__name__)
+
+# Web Mercator coordinates are in meters, so this is centimeter precision.
+WKT_ROUNDING_PRECISION = 2
+
+
+def _normalize_wkt(wkt):
+    """Normalize a WKT geometry so that equal geometries have equal WKT."""
+    geometry = shapely.wkt.loads(wkt).normalize()
+    return shapely.wkt.dumps(
+        geometry, rounding_precision=WKT_ROUNDING_PRECISION)
+
+
+def _hash(*parts):
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(source_path, target_path):
+    """Hard link ``source_path`` to ``target_path``, replacing the target.
+
+    Falls back to a copy if the paths are on different filesystems. The link
+    is made under a temporary name and moved into place, so other processes
+    never see a partially-written file.
+    """
+    temp_path = f'{target_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, target_path)
+
+
+def _write_json(data, target_path):
+    temp_path = f'{target_path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'w') as target_file:
+        json.dump(data, target_file)
+    os.replace(temp_path, target_path)
+
+
+def scenario_lulc_key(parcel_wkt_epsg3857, operation, operation_args,
+                      lulc_version):
+    """Build the cache key of a scenario LULC raster.
+
+    Args:
+        parcel_wkt_epsg3857 (str): The WKT of the study area, projected in
+            EPSG:3857 (Web Mercator).
+        operation (str): The job type that creates the raster.
+        operation_args (dict): The arguments, other than the study area,
+            that determine the raster, such as the fill lulc class. Values
+            whose key ends with ``_wkt`` are normalized before hashing.
+        lulc_version (str): Identifies the contents of the base LULC.
+
+    Returns:
+        key (str): A hex digest.
+    """
+    operation_args = {
+        key: (_normalize_wkt(value) if key.endswith('_wkt') else value)
+        for key, value in operation_args.items()}
+    return _hash(_normalize_wkt(parcel_wkt_epsg3857), operation,
+                 operation_args, lulc_version)
+
+
+def _scenario_lulc_paths(cache_dir, key):
+    entry_dir = os.path.join(cache_dir, key[:2])
+    return (os.path.join(entry_dir, f'{key}.tif'),
+            os.path.join(entry_dir, f'{key}.json'))
+
+
+def get_scenario_lulc(cache_dir, key, target_raster_path):
+    """Fetch a scenario LULC raster from the cache.
+
+    Args:
+        cache_dir (str): The directory of the cache.
+        key (str): The key from ``scenario_lulc_key``.
+        target_raster_path (str): Where to place the cached raster on a hit.
+
+    Returns:
+        lulc_stats (dict): The pixel counts stored with the raster, or
+            ``None`` if the raster is not cached.
+    """
+    raster_path, stats_path = _scenario_lulc_paths(cache_dir, key)
+    # The stats are written last, so if they exist the raster is complete.
+    try:
+        with open(stats_path) as stats_file:
+            lulc_stats = json.load(stats_file)
+        _link_or_copy(raster_path, target_raster_path)
+        # The modified time marks when the entry was last used.
+        os.utime(raster_path)
+    except FileNotFoundError:
+        # Not cached, or evicted by another process while we read it.
+        return None
+    LOGGER.info(f'Scenario LULC cache hit for {key}')
+    # JSON object keys are always strings, but lulc codes are ints.
+    return {int(lucode): count for lucode, count in lulc_stats.items()}
+
+
+def put_scenario_lulc(cache_dir, key, source_raster_path, lulc_stats,
+                      max_bytes):
+    """Add a scenario LULC raster to the cache.
+
+    Args:
+        cache_dir (str): The directory of the cache.
+        key (str): The key from ``scenario_lulc_key``.
+        source_raster_path (str): The raster to cache.
+        lulc_stats (dict): The pixel counts under the study area, which are
+            returned with the raster on a cache hit.
+        max_bytes (int): The least recently used rasters are evicted until
+            the cache is no larger than this.
+
+    Returns:
+        ``None``
+    """
+    raster_path, stats_path = _scenario_lulc_paths(cache_dir, key)
+    os.makedirs(os.path.dirname(raster_path), exist_ok=True)
+    _link_or_copy(source_raster_path, raster_path)
+    _write_json(lulc_stats, stats_path)
+    _evict_scenario_lulcs(cache_dir, max_bytes)
+
+
+def _evict_scenario_lulcs(cache_dir, max_bytes):
+    """Remove the least recently used rasters until under ``max_bytes``."""
+    entries = []
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            if not filename.endswith('.tif'):
+                continue
+            raster_path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(raster_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, raster_path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, raster_path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        LOGGER.info(f'Evicting {raster_path} from the scenario LULC cache')
+        # Remove the stats first so that the entry is never seen as complete
+        # without its raster.
+        for path in (f'{os.path.splitext(raster_path)[0]}.json',
+                     raster_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # another process evicted it first
+        total_bytes -= size
+
+
+def invest_result_key(invest_model, lulc_digest, study_area_wkt, model_args,
+                      lulc_path, workspace_dir):
+    """Build the cache key of an InVEST model result.
+
+    Args:
+        invest_model (str): The name of the InVEST model.
+        lulc_digest (str): A hash of the LULC raster's pixels and
+            georeferencing.
+        study_area_wkt (str): The WKT of the study area, projected in
+            EPSG:3857 (Web Mercator).
+        model_args (dict): The model's args, as built by ``invest_args``.
+        lulc_path (str): The path to the LULC raster in ``model_args``.
+        workspace_dir (str): The model workspace in ``model_args``.
+
+    Returns:
+        key (str): A hex digest.
+    """
+    portable_args = {}
+    input_file_stats = {}
+    for key, value in model_args.items():
+        if isinstance(value, str):
+            # The LULC is identified by its digest and the workspace is
+            # different for every scenario, so neither path is part of the
+            # key.
+            value = value.replace(lulc_path, '<lulc>').replace(
+                workspace_dir, '<workspace>')
+            # Other inputs, like the biophysical tables, are identified by
+            # their size and modified time so that updating one of them
+            # invalidates the cache.
+            if os.path.isfile(value):
+                stat = os.stat(value)
+                input_file_stats[key] = [stat.st_size, stat.st_mtime]
+        portable_args[key] = value
+    return _hash(invest_model, lulc_digest, _normalize_wkt(study_area_wkt),
+                 portable_args, input_file_stats)
+
+
+def get_invest_result(cache_dir, key):
+    """Fetch an InVEST model result from the cache.
+
+    Args:
+        cache_dir (str): The directory of the cache.
+        key (str): The key from ``invest_result_key``.
+
+    Returns:
+        result (dict): The cached result, with the ``invest-result`` and
+            ``serviceshed`` paths, or ``None`` if the result is not cached or
+            its files no longer exist.
+    """
+    try:
+        with open(os.path.join(cache_dir, f'{key}.json')) as result_file:
+            result = json.load(result_file)
+    except FileNotFoundError:
+        return None
+    for path in result.values():
+        if path and not os.path.exists(path):
+            return None
+    LOGGER.info(f'InVEST result cache hit for {key}')
+    return result
+
+
+def put_invest_result(cache_dir, key, result):
+    """Add an InVEST model result to the cache.
+
+    Args:
+        cache_dir (str): The directory of the cache.
+        key (str): The key from ``invest_result_key``.
+        result (dict): The ``invest-result`` and ``serviceshed`` paths. The
+            files are not copied, so they must outlive the job.
+
+    Returns:
+        ``None``
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_json(result, os.path.join(cache_dir, f'{key}.json'))
@@ -1,11 +1,23 @@
 import argparse
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import functools
+import hashlib
+import http.server
 import json
 import logging
 import math
+import multiprocessing
 import os
+import queue
 import random
+import resource
 import shutil
+import socket
 import tempfile
+import threading
 import time
 import unittest
 
@@ -16,6 +28,7 @@ import requests
 import shapely.geometry
 import shapely.wkt
 from osgeo import gdal
+from osgeo import gdal_array
 from osgeo import ogr
 from osgeo import osr
 from PIL import Image
@@ -25,14 +38,31 @@ from natcap.invest import urban_cooling_model
 from natcap.invest import urban_nature_access
 from natcap.invest import utils
 
+import block_cache
 import invest_args
 import invest_results
+import result_cache
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
 
-POLLING_INTERVAL_S = 3
+# How long the API may hold a request for work open before replying that
+# the queue is empty.
+LONG_POLL_S = 30
+# How long to hold a request for work open while other jobs are running.
+BUSY_LONG_POLL_S = 2
+# How often to renew the leases on running jobs. The server re-queues a job
+# whose lease is not renewed for 90 seconds.
+HEARTBEAT_S = 30
+# How long to wait before retrying a result post that failed because the
+# server was unreachable. Results are idempotent, so retrying is safe.
+RESULT_RETRY_S = 5
+# How long to wait before asking for work again after a request for work
+# failed, doubling with each failure in a row up to the maximum, so that a
+# worker neither gives up on nor hammers a server that is down.
+LEASE_RETRY_S = 1
+LEASE_RETRY_MAX_S = 60
 
 DEFAULT_GTIFF_CREATION_TUPLE_OPTIONS = ('GTIFF', (
     'TILED=YES', 'BIGTIFF=YES', 'COMPRESS=LZW',
@@ -76,6 +106,7 @@ assert _LULC_SRS.IsSame(_WEB_MERCATOR_SRS), (
 
 LULC_NODATA = _LULC_RASTER_INFO['nodata'][0]
 LULC_DTYPE = _LULC_RASTER_INFO['datatype']
+LULC_NUMPY_DTYPE = gdal_array.GDALTypeCodeToNumericTypeCode(LULC_DTYPE)
 WEB_MERCATOR_TO_ALBERS_EQ_AREA = osr.CreateCoordinateTransformation(
     _WEB_MERCATOR_SRS, _ALBERS_EQUAL_AREA_SRS)
 ALBERS_EQ_AREA_TO_WEB_MERCATOR = osr.CreateCoordinateTransformation(
@@ -110,6 +141,19 @@ INVEST_MODELS = {
     }
 }
 
+# Bytes read from each end of a raster to identify its contents.
+LULC_VERSION_CHUNK_BYTES = 2**20
+_LULC_VERSIONS = {}  # (path, size, mtime) -> version
+# The default upper bound on the size of the scenario LULC cache.
+SCENARIO_CACHE_MAX_BYTES = 2 * 2**30
+# The default memory for decoded blocks of the base LULC, shared by the
+# pool processes. Set in each pool process by _init_pool_process.
+LULC_BLOCK_CACHE_MAX_BYTES = 256 * 2**20
+_LULC_BLOCK_CACHE = None
+# An uncompressed copy of the base LULC, mapped into memory, if the worker
+# has one. Set in each pool process by _init_pool_process.
+_LULC_SIDECAR = None
+
 # The largest extent LULC needed by invest models is
 # 2x the 800m search radius used by UNA.
 LARGEST_SERVICESHED = 1600
@@ -124,17 +168,40 @@ STATUS_FAILED = 'failed'
 JOBTYPE_FILL = 'lulc_fill'
 JOBTYPE_WALLPAPER = 'wallpaper'
 JOBTYPE_CROP = 'lulc_crop'
+JOBTYPE_CROP_AND_MODIFY = 'lulc_crop_and_modify'
 JOBTYPE_PARCEL_STATS = 'stats_under_parcel'
 JOBTYPE_PATTERN_THUMBNAIL = 'pattern_thumbnail'
 JOBTYPE_INVEST = 'invest'
-ENDPOINTS = {
-    JOBTYPE_FILL: 'scenario',
-    JOBTYPE_WALLPAPER: 'scenario',
-    JOBTYPE_CROP: 'scenario',
-    JOBTYPE_PARCEL_STATS: 'parcel_stats',
-    JOBTYPE_PATTERN_THUMBNAIL: 'pattern',
-    JOBTYPE_INVEST: 'invest',
+# Seconds spent in each stage of the job that is running in this process.
+# Stages are "read" (cache lookups and hashing inputs), "compute" (building
+# the raster or running the model), "post_process" (stats and results
+# derived from the output) and "write" (storing results in the cache).
+_STAGE_TIMINGS = collections.Counter()
+
+# The most jobs of each type that may run at the same time.  InVEST
+# runs are long and memory-hungry; the raster jobs are quick.
+DEFAULT_JOB_SLOTS = {
+    JOBTYPE_FILL: 2,
+    JOBTYPE_WALLPAPER: 2,
+    JOBTYPE_CROP: 2,
+    JOBTYPE_CROP_AND_MODIFY: 2,
+    JOBTYPE_PARCEL_STATS: 4,
+    JOBTYPE_PATTERN_THUMBNAIL: 1,
+    JOBTYPE_INVEST: 1,
+}
+# Interactive jobs take a second or so and someone is waiting on them in the
+# UI; every other job is a batch job. This matches JOB_CLASSES on the server.
+JOBCLASS_INTERACTIVE = 'interactive'
+JOBCLASS_BATCH = 'batch'
+INTERACTIVE_JOB_TYPES = {
+    JOBTYPE_CROP,
+    JOBTYPE_PARCEL_STATS,
+    JOBTYPE_PATTERN_THUMBNAIL,
 }
+# The number of processes that run jobs, and how many of them only run
+# interactive jobs, so that a parcel click never waits behind model runs.
+DEFAULT_POOL_SLOTS = 4
+DEFAULT_INTERACTIVE_SLOTS = 2
 
 
 class Tests(unittest.TestCase):
@@ -165,6 +232,157 @@ class Tests(unittest.TestCase):
         }
         self.assertEqual(pixelcounts, expected_values)
 
+    def test_pixelcounts_under_parcels(self):
+        # University of Texas: San Antonio, selected by hand in QGIS
+        # Coordinates are in EPSG:3857 "Web Mercator"
+        point_over_san_antonio = shapely.geometry.Point(
+            -10965275.57, 3429693.30)
+        point_east_of_san_antonio = shapely.geometry.Point(
+            -10964275.57, 3429693.30)
+        parcels = [point_over_san_antonio.buffer(100),
+                   point_east_of_san_antonio.buffer(100)]
+
+        parcel_counts, total_counts = pixelcounts_under_parcels(
+            [parcel.wkt for parcel in parcels], LULC_RASTER_PATH)
+
+        # The same counts as one parcel at a time.
+        expected_counts = [
+            pixelcounts_under_parcel(parcel.wkt, LULC_RASTER_PATH)
+            for parcel in parcels]
+        self.assertEqual(parcel_counts, expected_counts)
+        self.assertEqual(
+            total_counts,
+            dict(collections.Counter(expected_counts[0])
+                 + collections.Counter(expected_counts[1])))
+
+    def test_pixelcounts_under_touching_parcels(self):
+        # University of Texas: San Antonio, selected by hand in QGIS
+        # Coordinates are in EPSG:3857 "Web Mercator"
+        point_over_san_antonio = shapely.geometry.Point(
+            -10965275.57, 3429693.30)
+        parcel = point_over_san_antonio.buffer(100)
+        minx, miny, maxx, maxy = parcel.bounds
+        parcels = [
+            parcel,
+            # Overlaps the first parcel.
+            shapely.geometry.Point(-10965125.57, 3429693.30).buffer(100),
+            # Shares an edge with the first parcel's bounding box.
+            shapely.geometry.box(minx - 100, miny, minx, maxy),
+            # Smaller than a pixel, inside the first parcel.
+            point_over_san_antonio.buffer(5),
+        ]
+
+        parcel_counts, total_counts = pixelcounts_under_parcels(
+            [parcel.wkt for parcel in parcels], LULC_RASTER_PATH)
+
+        # Each parcel gets every pixel it touches, as if it were alone.
+        expected_counts = [
+            pixelcounts_under_parcel(parcel.wkt, LULC_RASTER_PATH)
+            for parcel in parcels]
+        self.assertEqual(parcel_counts, expected_counts)
+        self.assertTrue(all(parcel_counts))
+        # Pixels under several parcels are in the total once.
+        self.assertLess(
+            sum(total_counts.values()),
+            sum(sum(counts.values()) for counts in parcel_counts))
+
+    def test_lulc_version_of_replaced_raster(self):
+        raster_path = os.path.join(self.workspace_dir, 'lulc.tif')
+        with open(raster_path, 'wb') as raster_file:
+            raster_file.write(b'old contents')
+        os.utime(raster_path, (1000, 1000))
+        old_version = _get_lulc_version(raster_path)
+        self.assertEqual(_get_lulc_version(raster_path), old_version)
+
+        # Same size, so only the modification time shows the change.
+        with open(raster_path, 'wb') as raster_file:
+            raster_file.write(b'new contents')
+        os.utime(raster_path, (2000, 2000))
+        self.assertNotEqual(_get_lulc_version(raster_path), old_version)
+
+    def _create_tiled_raster(self, xsize, ysize, block_size):
+        """Create a tiled raster whose pixels are all different."""
+        raster_path = os.path.join(self.workspace_dir, 'tiled.tif')
+        raster = gdal.GetDriverByName('GTiff').Create(
+            raster_path, xsize, ysize, 1, gdal.GDT_Int16, options=[
+                'TILED=YES', f'BLOCKXSIZE={block_size}',
+                f'BLOCKYSIZE={block_size}'])
+        raster.GetRasterBand(1).WriteArray(
+            numpy.arange(xsize * ysize, dtype=numpy.int16).reshape(
+                ysize, xsize))
+        raster = None
+        return raster_path
+
+    def test_block_cache_read_window(self):
+        # 50 x 40 pixels in 16 x 16 blocks, so the blocks on the right edge
+        # are 2 pixels wide and those on the bottom edge 8 pixels tall.
+        raster_path = self._create_tiled_raster(50, 40, 16)
+        cache = block_cache.SharedBlockCache(raster_path, 2**20)
+        self.addCleanup(cache.close)
+
+        raster = gdal.OpenEx(raster_path, gdal.OF_RASTER)
+        band = raster.GetRasterBand(1)
+        for window in [
+                (10, 5, 40, 35),  # crosses blocks, to the bottom right
+                (0, 0, 50, 40),  # the whole raster
+                (17, 20, 3, 4),  # inside one block
+                (48, 32, 2, 8)]:  # the bottom right edge block
+            numpy.testing.assert_array_equal(
+                cache.read_window(*window), band.ReadAsArray(*window))
+        band = None
+        raster = None
+
+    def test_block_cache_stats(self):
+        raster_path = self._create_tiled_raster(50, 40, 16)
+        block_bytes = 16 * 16 * numpy.dtype(numpy.int16).itemsize
+        cache = block_cache.SharedBlockCache(raster_path, 2 * block_bytes)
+        self.addCleanup(cache.close)
+
+        cache.get_block(0, 0)  # miss
+        cache.get_block(0, 0)  # hit
+        cache.get_block(0, 1)  # miss
+        cache.get_block(1, 0)  # miss, evicts (0, 0)
+        cache.get_block(0, 1)  # hit
+        cache.get_block(0, 0)  # miss, evicts (1, 0)
+        self.assertEqual(cache.get_stats(), {
+            'hits': 2, 'misses': 4, 'evictions': 2, 'blocks': 2,
+            'max_blocks': 2})
+
+        with self.assertRaises(ValueError):
+            block_cache.SharedBlockCache(raster_path, block_bytes - 1)
+
+    def test_evict_scenario_lulcs(self):
+        cache_dir = os.path.join(self.workspace_dir, 'scenario_lulcs')
+        raster_paths = []
+        for i, mtime in enumerate([3000, 1000, 2000]):
+            raster_dir = os.path.join(cache_dir, f'{i:02d}')
+            os.makedirs(raster_dir)
+            raster_path = os.path.join(raster_dir, f'{i}.tif')
+            with open(raster_path, 'wb') as raster_file:
+                raster_file.write(b'x' * 100)
+            with open(os.path.join(raster_dir, f'{i}.json'), 'w') as stats:
+                stats.write('{}')
+            os.utime(raster_path, (mtime, mtime))
+            raster_paths.append(raster_path)
+        other_path = os.path.join(cache_dir, 'notes.txt')
+        with open(other_path, 'w') as other_file:
+            other_file.write('x' * 1000)
+
+        # Under the limit: nothing is evicted.
+        result_cache._evict_scenario_lulcs(cache_dir, 300)
+        self.assertTrue(all(map(os.path.exists, raster_paths)))
+
+        # Only the most recently used raster fits, with its stats.
+        result_cache._evict_scenario_lulcs(cache_dir, 150)
+        self.assertEqual(
+            [os.path.exists(path) for path in raster_paths],
+            [True, False, False])
+        self.assertEqual(
+            [os.path.exists(f'{os.path.splitext(path)[0]}.json')
+             for path in raster_paths],
+            [True, False, False])
+        self.assertTrue(os.path.exists(other_path))
+
     def test_new_lulc(self):
         gtiff_path = os.path.join(self.workspace_dir, 'raster.tif')
 
@@ -202,11 +420,20 @@ class Tests(unittest.TestCase):
         target_raster_path = os.path.join(self.workspace_dir, 'raster.tif')
         fill_parcel(parcel.wkt, 15, target_raster_path)
 
+        # Every pixel the parcel touches is filled.
+        self.assertEqual(
+            pixelcounts_under_parcel(parcel.wkt, target_raster_path),
+            {15: 41})
+
+        # The rest of the study area keeps the base LULC's values.
+        baseline_path = os.path.join(self.workspace_dir, 'baseline.tif')
+        _create_new_lulc(parcel.wkt, baseline_path, include_pixel_values=True)
+        baseline_array = pygeoprocessing.raster_to_numpy_array(baseline_path)
         result_array = pygeoprocessing.raster_to_numpy_array(
                 target_raster_path)
-        self.assertEqual(
-            numpy.sum(result_array[result_array != LULC_NODATA]), 600)
-        self.assertEqual(numpy.sum(result_array == 15), 40)
+        changed = result_array != baseline_array
+        self.assertTrue(numpy.all(result_array[changed] == 15))
+        self.assertLessEqual(numpy.sum(changed), 41)
 
     def test_wallpaper(self):
         # University of Texas: San Antonio, selected by hand in QGIS
@@ -226,7 +453,82 @@ class Tests(unittest.TestCase):
             self.workspace_dir, 'wallpapered_raster.tif')
 
         wallpaper_parcel(parcel.wkt, pattern.wkt, LULC_RASTER_PATH,
-                         target_raster_path, self.workspace_dir)
+                         target_raster_path)
+
+        result_array = pygeoprocessing.raster_to_numpy_array(
+            target_raster_path)
+        baseline_path = os.path.join(self.workspace_dir, 'baseline.tif')
+        _create_new_lulc(parcel.wkt, baseline_path, include_pixel_values=True)
+        baseline_array = pygeoprocessing.raster_to_numpy_array(baseline_path)
+        self.assertEqual(result_array.shape, baseline_array.shape)
+
+        # The pattern repeats from the study area's origin.
+        pattern_array = _read_pattern(pattern.wkt, LULC_RASTER_PATH)
+        n_rows, n_cols = result_array.shape
+        tiled_pattern = numpy.tile(pattern_array, (
+            math.ceil(n_rows / pattern_array.shape[0]),
+            math.ceil(n_cols / pattern_array.shape[1])))[:n_rows, :n_cols]
+
+        xoff, yoff, _, _ = _study_area_window(parcel.wkt)
+        parcel_mask = _rasterize_parcel_mask(
+            parcel.wkt, result_array.shape,
+            _lulc_window_geotransform(xoff, yoff))
+        self.assertEqual(numpy.sum(parcel_mask), 41)
+        # The parcel is wallpapered and the rest of the study area keeps
+        # the base LULC's values.
+        numpy.testing.assert_array_equal(
+            result_array[parcel_mask], tiled_pattern[parcel_mask])
+        numpy.testing.assert_array_equal(
+            result_array[~parcel_mask], baseline_array[~parcel_mask])
+        self.assertEqual(
+            pixelcounts_under_parcel(parcel.wkt, target_raster_path),
+            _count_pixels(tiled_pattern[parcel_mask]))
+
+    def test_wallpaper_array(self):
+        base_array = numpy.zeros((4, 6), dtype=numpy.uint16)
+        parcel_mask = numpy.zeros((4, 6), dtype=bool)
+        parcel_mask[1:3, 3:6] = True
+        pattern_array = numpy.array([[1, 2], [3, 4]], dtype=numpy.uint16)
+
+        target_array = _wallpaper_array(
+            base_array, parcel_mask, pattern_array)
+
+        # The pattern repeats from the window's origin, not the parcel's.
+        numpy.testing.assert_array_equal(target_array, numpy.array([
+            [0, 0, 0, 0, 0, 0],
+            [0, 0, 0, 4, 3, 4],
+            [0, 0, 0, 2, 1, 2],
+            [0, 0, 0, 0, 0, 0]]))
+        self.assertFalse(base_array.any())
+
+    def test_crop_and_modify(self):
+        # University of Texas: San Antonio, selected by hand in QGIS
+        # Coordinates are in EPSG:3857 "Web Mercator"
+        point_over_san_antonio = shapely.geometry.Point(
+            -10965275.57, 3429693.30)
+        parcel = point_over_san_antonio.buffer(100)
+
+        baseline_path = os.path.join(self.workspace_dir, 'baseline.tif')
+        filled_path = os.path.join(self.workspace_dir, 'filled.tif')
+        baseline_counts, filled_counts = crop_and_modify_parcel(
+            parcel.wkt, JOBTYPE_FILL, {'lulc_class': 15}, baseline_path,
+            filled_path)
+
+        # The same rasters and counts as separate crop and fill jobs.
+        expected_baseline_path = os.path.join(
+            self.workspace_dir, 'expected_baseline.tif')
+        _create_new_lulc(
+            parcel.wkt, expected_baseline_path, include_pixel_values=True)
+        expected_filled_path = os.path.join(
+            self.workspace_dir, 'expected_filled.tif')
+        fill_parcel(parcel.wkt, 15, expected_filled_path)
+        for path, expected_path in ((baseline_path, expected_baseline_path),
+                                    (filled_path, expected_filled_path)):
+            numpy.testing.assert_array_equal(
+                pygeoprocessing.raster_to_numpy_array(path),
+                pygeoprocessing.raster_to_numpy_array(expected_path))
+        self.assertEqual(baseline_counts, {262: 40, 321: 1})
+        self.assertEqual(filled_counts, {15: 41})
 
     def test_get_bioregion(self):
         # University of Texas: San Antonio, selected by hand in QGIS
@@ -297,6 +599,57 @@ def _warp_raster_to_web_mercator(source_albers_raster_path,
         target_projection_wkt=WEB_MERCATOR_SRS_WKT)
 
 
+def _get_lulc_version(raster_path):
+    """Identify the contents of a raster without reading all of it.
+
+    The file size is hashed along with the first and last chunks of the
+    file, which hold the GeoTIFF header and the tile index. The version is
+    cached by the file's size and modification time, so a raster that is
+    replaced while the worker runs gets a new version.
+
+    Args:
+        raster_path (str): A GDAL-compatible path, including ``/vsicurl/``.
+
+    Returns:
+        version (str): A short hex digest.
+    """
+    stat = gdal.VSIStatL(raster_path)
+    size = stat.size
+    stat_key = (raster_path, size, stat.mtime)
+    if stat_key in _LULC_VERSIONS:
+        return _LULC_VERSIONS[stat_key]
+    digest = hashlib.sha256(str(size).encode('utf-8'))
+    raster_file = gdal.VSIFOpenL(raster_path, 'rb')
+    try:
+        for offset in (0, max(0, size - LULC_VERSION_CHUNK_BYTES)):
+            gdal.VSIFSeekL(raster_file, offset, 0)
+            digest.update(gdal.VSIFReadL(
+                1, LULC_VERSION_CHUNK_BYTES, raster_file))
+    finally:
+        gdal.VSIFCloseL(raster_file)
+    _LULC_VERSIONS[stat_key] = digest.hexdigest()[:16]
+    return _LULC_VERSIONS[stat_key]
+
+
+def _hash_raster(raster_path):
+    """Hash a raster's pixel values and georeferencing.
+
+    Args:
+        raster_path (str): The path to a single-band raster.
+
+    Returns:
+        digest (str): A hex digest.
+    """
+    raster_info = pygeoprocessing.get_raster_info(raster_path)
+    digest = hashlib.sha256(json.dumps([
+        raster_info['geotransform'], raster_info['raster_size'],
+        raster_info['datatype'], raster_info['projection_wkt'],
+    ]).encode('utf-8'))
+    for _, block in pygeoprocessing.iterblocks((raster_path, 1)):
+        digest.update(block.tobytes())
+    return digest.hexdigest()
+
+
 def _reproject_to_nlud(parcel_wkt_epsg3857):
     """Reproject a WKT polygon to the LULC projection.
 
@@ -319,97 +672,386 @@ def _reproject_to_nlud(parcel_wkt_epsg3857):
     return parcel_geom
 
 
-def _create_new_lulc(parcel_wkt_epsg3857, target_local_gtiff_path,
-                     include_pixel_values=False):
-    """Create an LULC raster in the LULC projection covering the parcel.
+def _is_base_lulc(raster_path):
+    """Whether a path refers to the base LULC, wherever it is stored."""
+    return os.path.basename(raster_path) == LULC_FILENAME
+
+
+def _lulc_window(bbox):
+    """Find the window of base LULC pixels that covers a bounding box.
 
     Args:
-        parcel_wkt_epsg3857 (str): The parcel WKT in EPSG:3857 (Web Mercator)
-        target_local_gtiff_path (str): Where the target raster should be saved
-        include_pixel_values=False (bool): Whether to include the underlying
-            raster's pixel values in the new, cropped LULC.
+        bbox (tuple): The ``(minx, miny, maxx, maxy)`` of the box, in the
+            LULC's projection.
+
+    Returns:
+        window (tuple): The ``(xoff, yoff, win_xsize, win_ysize)`` of the
+            window, in pixels. It may extend beyond the LULC.
+    """
+    def _snap(pixel):
+        # Edges that are on the grid stay there despite rounding error.
+        return round(pixel) if abs(pixel - round(pixel)) < 1e-6 else pixel
+
+    minx, miny, maxx, maxy = bbox
+    x0 = math.floor(_snap((minx - LULC_ORIGIN_X) / PIXELSIZE_X))
+    x1 = math.ceil(_snap((maxx - LULC_ORIGIN_X) / PIXELSIZE_X))
+    # PIXELSIZE_Y is negative, so the top of the box is the first row.
+    y0 = math.floor(_snap((maxy - LULC_ORIGIN_Y) / PIXELSIZE_Y))
+    y1 = math.ceil(_snap((miny - LULC_ORIGIN_Y) / PIXELSIZE_Y))
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _prepare_lulc_sidecar(sidecar_path):
+    """Write an uncompressed copy of the base LULC, unless it is current.
+
+    The sidecar holds the LULC's pixels as a raw, row-major array. A JSON
+    header at ``{sidecar_path}.json`` records the version of the LULC it was
+    copied from, so a sidecar of an older LULC is rewritten.
+
+    Args:
+        sidecar_path (str): Where the copy is, or should be, written.
 
     Returns:
         ``None``
     """
+    header_path = f'{sidecar_path}.json'
+    raster_xsize, raster_ysize = _LULC_RASTER_INFO['raster_size']
+    header = {
+        'lulc_version': _get_lulc_version(LULC_RASTER_PATH),
+        'raster_size': [raster_xsize, raster_ysize],
+        'dtype': numpy.dtype(LULC_NUMPY_DTYPE).str,
+    }
+    try:
+        with open(header_path) as header_file:
+            if (json.load(header_file) == header
+                    and os.path.getsize(sidecar_path) == (
+                        raster_xsize * raster_ysize
+                        * numpy.dtype(LULC_NUMPY_DTYPE).itemsize)):
+                LOGGER.info(f'Using the LULC sidecar at {sidecar_path}')
+                return
+    except (OSError, ValueError):
+        pass  # missing or unreadable, so rewrite it
+
+    LOGGER.info(f'Writing an uncompressed copy of the LULC to {sidecar_path}')
+    # The header is removed first and written last, so a partial copy is
+    # never taken for a current one.
+    if os.path.exists(header_path):
+        os.remove(header_path)
+    temp_path = f'{sidecar_path}.{os.getpid()}.tmp'
+    sidecar = numpy.memmap(temp_path, dtype=LULC_NUMPY_DTYPE, mode='w+',
+                           shape=(raster_ysize, raster_xsize))
+    for offsets, block in pygeoprocessing.iterblocks((LULC_RASTER_PATH, 1)):
+        sidecar[offsets['yoff']:offsets['yoff'] + offsets['win_ysize'],
+                offsets['xoff']:offsets['xoff'] + offsets['win_xsize']] = block
+    sidecar.flush()
+    del sidecar
+    os.replace(temp_path, sidecar_path)
+    with open(f'{header_path}.tmp', 'w') as header_file:
+        json.dump(header, header_file)
+    os.replace(f'{header_path}.tmp', header_path)
+
+
+def _open_lulc_sidecar(sidecar_path):
+    """Map the sidecar written by ``_prepare_lulc_sidecar`` into memory.
+
+    Args:
+        sidecar_path (str): The path to the sidecar.
+
+    Returns:
+        sidecar (numpy.memmap): A read-only array of the base LULC.
+    """
+    raster_xsize, raster_ysize = _LULC_RASTER_INFO['raster_size']
+    return numpy.memmap(sidecar_path, dtype=LULC_NUMPY_DTYPE, mode='r',
+                        shape=(raster_ysize, raster_xsize))
+
+
+def _read_lulc_window(xoff, yoff, win_xsize, win_ysize):
+    """Read a window of the base LULC.
+
+    The window is a slice of the memory-mapped sidecar if the worker has
+    one. Otherwise it is read through the block cache shared by the pool
+    processes, if the worker has one, or else from the raster.
+
+    Args:
+        xoff (int): The column of the window's upper left pixel.
+        yoff (int): The row of the window's upper left pixel.
+        win_xsize (int): The width of the window, in pixels.
+        win_ysize (int): The height of the window, in pixels.
+
+    Returns:
+        array (numpy.ndarray): The pixels of the window. Pixels outside of
+            the LULC are nodata. The array may be a read-only view of the
+            sidecar.
+    """
+    raster_xsize, raster_ysize = _LULC_RASTER_INFO['raster_size']
+    x0, y0 = max(xoff, 0), max(yoff, 0)
+    x1 = min(xoff + win_xsize, raster_xsize)
+    y1 = min(yoff + win_ysize, raster_ysize)
+    array = None
+    if (x0, y0, x1, y1) != (xoff, yoff, xoff + win_xsize, yoff + win_ysize):
+        array = numpy.full(
+            (win_ysize, win_xsize), LULC_NODATA, dtype=LULC_NUMPY_DTYPE)
+        if x0 >= x1 or y0 >= y1:
+            return array
+
+    if _LULC_SIDECAR is not None:
+        # Pages of the file are only read as the view is used, and the OS
+        # page cache is shared by every pool process.
+        window = _LULC_SIDECAR[y0:y1, x0:x1]
+    elif _LULC_BLOCK_CACHE is not None:
+        window = _LULC_BLOCK_CACHE.read_window(x0, y0, x1 - x0, y1 - y0)
+    else:
+        raster = gdal.OpenEx(LULC_RASTER_PATH, gdal.OF_RASTER)
+        window = raster.GetRasterBand(1).ReadAsArray(
+            x0, y0, x1 - x0, y1 - y0)
+        raster = None
+    if array is None:
+        return window
+    array[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = window
+    return array
+
+
+def _study_area_window(parcel_wkt_epsg3857):
+    """Get the window of the base LULC that a scenario of a parcel covers.
+
+    Args:
+        parcel_wkt_epsg3857 (str): The parcel WKT in EPSG:3857 (Web Mercator)
+
+    Returns:
+        window (tuple): The ``(xoff, yoff, win_xsize, win_ysize)`` of the
+            parcel buffered by the largest serviceshed.
+    """
     parcel_geom = shapely.wkt.loads(parcel_wkt_epsg3857)
-    parcel_min_x, parcel_min_y, parcel_max_x, parcel_max_y = parcel_geom.bounds
     buffered_parcel_geom = parcel_geom.buffer(LARGEST_SERVICESHED)
-    buf_minx, buf_miny, buf_maxx, buf_maxy = buffered_parcel_geom.bounds
 
     # Round "up" to the nearest pixel, sort of the pixel-math version of
     # rasterizing the bounding box with "ALL_TOUCHED=TRUE".
-    buf_minx -= abs((buf_minx - LULC_ORIGIN_X) % PIXELSIZE_X)
-    buf_miny -= abs((buf_miny - LULC_ORIGIN_Y) % PIXELSIZE_Y)
-    buf_maxx += PIXELSIZE_X - abs((buf_maxx - LULC_ORIGIN_X) % PIXELSIZE_X)
-    buf_maxy += PIXELSIZE_Y - abs((buf_maxy - LULC_ORIGIN_Y) % PIXELSIZE_Y)
+    return _lulc_window(buffered_parcel_geom.bounds)
 
-    pygeoprocessing.geoprocessing.warp_raster(
-        LULC_RASTER_PATH, (PIXELSIZE_X, PIXELSIZE_Y),
-        target_local_gtiff_path,
-        resample_method='near',
-        target_bb=[buf_minx, buf_miny, buf_maxx, buf_maxy])
 
-    if not include_pixel_values:
-        raster = gdal.OpenEx(target_local_gtiff_path, gdal.GA_Update)
-        band = raster.GetRasterBand(1)
-        nodata = band.GetNoDataValue()
-        if nodata is not None:
-            band.Fill(nodata)
-        else:
-            LOGGER.warning("LULC does not have a defined nodata value; "
-                           "cannot fill with None.")
-        band = None
-        raster = None
+def _lulc_window_geotransform(xoff, yoff):
+    """Get the geotransform of a window of the base LULC.
+
+    Args:
+        xoff (int): The column of the window's upper left pixel.
+        yoff (int): The row of the window's upper left pixel.
+
+    Returns:
+        geotransform (list): The GDAL geotransform of the window.
+    """
+    return [LULC_ORIGIN_X + xoff * PIXELSIZE_X, PIXELSIZE_X, 0.0,
+            LULC_ORIGIN_Y + yoff * PIXELSIZE_Y, 0.0, PIXELSIZE_Y]
+
+
+def _create_lulc_window_raster(target_path, xoff, yoff, win_xsize,
+                               win_ysize):
+    """Create a GeoTIFF on the grid of a window of the base LULC.
+
+    Args:
+        target_path (str): Where the raster should be saved.
+        xoff (int): The column of the window's upper left pixel.
+        yoff (int): The row of the window's upper left pixel.
+        win_xsize (int): The width of the window, in pixels.
+        win_ysize (int): The height of the window, in pixels.
+
+    Returns:
+        raster (gdal.Dataset): The new raster, open for writing.
+    """
+    driver_name, creation_options = DEFAULT_GTIFF_CREATION_TUPLE_OPTIONS
+    raster = gdal.GetDriverByName(driver_name).Create(
+        target_path, win_xsize, win_ysize, 1, LULC_DTYPE,
+        options=creation_options)
+    raster.SetProjection(LULC_SRS_WKT)
+    raster.SetGeoTransform(_lulc_window_geotransform(xoff, yoff))
+    if LULC_NODATA is not None:
+        raster.GetRasterBand(1).SetNoDataValue(LULC_NODATA)
+    return raster
+
+
+def _create_new_lulc(parcel_wkt_epsg3857, target_local_gtiff_path,
+                     include_pixel_values=False):
+    """Create an LULC raster in the LULC projection covering the parcel.
+
+    Args:
+        parcel_wkt_epsg3857 (str): The parcel WKT in EPSG:3857 (Web Mercator)
+        target_local_gtiff_path (str): Where the target raster should be saved
+        include_pixel_values=False (bool): Whether to include the underlying
+            raster's pixel values in the new, cropped LULC.
+
+    Returns:
+        ``None``
+    """
+    xoff, yoff, win_xsize, win_ysize = _study_area_window(
+        parcel_wkt_epsg3857)
+
+    # The target is on the LULC's grid and in its projection, so the pixels
+    # are copied directly rather than warped.
+    raster = _create_lulc_window_raster(
+        target_local_gtiff_path, xoff, yoff, win_xsize, win_ysize)
+    band = raster.GetRasterBand(1)
+
+    if include_pixel_values:
+        # One write of the whole window, so each tile is compressed once.
+        band.WriteArray(
+            _read_lulc_window(xoff, yoff, win_xsize, win_ysize))
+    elif LULC_NODATA is not None:
+        band.Fill(LULC_NODATA)
+    else:
+        LOGGER.warning("LULC does not have a defined nodata value; "
+                       "cannot fill with None.")
+    band = None
+    raster = None
 
 
 def fill_parcel(parcel_wkt_epsg3857, fill_lulc_class,
-                target_lulc_path, working_dir=None):
+                target_lulc_path):
     """Fill (rasterize) a parcel with a landcover code.
 
     This function writes a new raster that:
 
         * Is aligned to the grid of the source lulc
-        * Is filled with nodata except for the parcel
+        * Has the source lulc's values except for the parcel
         * Is filled with ``fill_lulc_class`` where the parcel is present
 
+    The parcel is burned into the window in memory, so no scratch files
+    are written and the raster is written once.
+
     Args:
         parcel_wkt_epsg3857 (str): The WKT of the parcel to fill,
             projected in EPSG:3857 (Web Mercator)
         fill_lulc_class (int): The lulc class to fill the parcel with.
         target_lulc_path (str): Where the target lulc raster should be saved.
-        working_dir (str): The path to where working files should be stored.
-            If ``None``, then the default temp dir will be used.
 
     Returns:
         ``None``
     """
-    parcel_geom = shapely.wkt.loads(parcel_wkt_epsg3857)
-    working_dir = tempfile.mkdtemp(prefix='fill-parcel-', dir=working_dir)
+    xoff, yoff, win_xsize, win_ysize = _study_area_window(
+        parcel_wkt_epsg3857)
+    lulc_array = _read_lulc_window(xoff, yoff, win_xsize, win_ysize)
+    parcel_mask = _rasterize_parcel_mask(
+        parcel_wkt_epsg3857, lulc_array.shape,
+        _lulc_window_geotransform(xoff, yoff))
 
-    parcel_vector_path = os.path.join(working_dir, 'parcel.fgb')
-    pygeoprocessing.geoprocessing.shapely_geometry_to_vector(
-        [parcel_geom], parcel_vector_path, LULC_SRS_WKT, 'FlatGeoBuf',
-        ogr_geom_type=OGR_GEOMETRY_TYPES[parcel_geom.type]
-    )
+    raster = _create_lulc_window_raster(
+        target_lulc_path, xoff, yoff, win_xsize, win_ysize)
+    raster.GetRasterBand(1).WriteArray(
+        numpy.where(parcel_mask, fill_lulc_class, lulc_array))
+    raster = None
+
+
+def _read_source_window(source_raster_path, xoff, yoff, win_xsize,
+                        win_ysize):
+    """Read a window of the base LULC's grid from any LULC raster.
+
+    Args:
+        source_raster_path (str): The GDAL-compatible URI to the raster,
+            projected in Web Mercator.
+        xoff (int): The column of the window's upper left pixel in the base
+            LULC.
+        yoff (int): The row of the window's upper left pixel.
+        win_xsize (int): The width of the window, in pixels.
+        win_ysize (int): The height of the window, in pixels.
+
+    Returns:
+        array (numpy.ndarray): The pixels of the window, with nodata where
+            the raster doesn't cover it.
+    """
+    if _is_base_lulc(source_raster_path):
+        return _read_lulc_window(xoff, yoff, win_xsize, win_ysize)
 
-    _create_new_lulc(
-        parcel_wkt_epsg3857, target_lulc_path, include_pixel_values=True)
-    pygeoprocessing.geoprocessing.rasterize(
-        parcel_vector_path, target_lulc_path, [fill_lulc_class],
-        option_list=['ALL_TOUCHED=TRUE'])
+    # Another raster, like an earlier scenario, is resampled onto the window
+    # in memory.
+    origin_x, _, _, origin_y, _, _ = _lulc_window_geotransform(xoff, yoff)
+    window_raster = gdal.Warp(
+        '', source_raster_path, format='MEM',
+        outputBounds=[origin_x, origin_y + win_ysize * PIXELSIZE_Y,
+                      origin_x + win_xsize * PIXELSIZE_X, origin_y],
+        width=win_xsize, height=win_ysize, dstSRS=LULC_SRS_WKT,
+        outputType=LULC_DTYPE, dstNodata=LULC_NODATA, resampleAlg='near')
+    return window_raster.GetRasterBand(1).ReadAsArray()
 
-    shutil.rmtree(working_dir)
+
+def _read_pattern(pattern_wkt_epsg3857, source_nlud_raster_path):
+    """Read the pixels of a wallpaper pattern.
+
+    Args:
+        pattern_wkt_epsg3857 (str): The WKT of the pattern geometry,
+            projected in EPSG:3857 (Web Mercator)
+        source_nlud_raster_path (str): The GDAL-compatible URI to the LULC
+            raster to take the pattern from.
+
+    Returns:
+        pattern (numpy.ndarray): The pixels under the pattern's bounding box.
+    """
+    return _read_source_window(
+        source_nlud_raster_path,
+        *_lulc_window(shapely.wkt.loads(pattern_wkt_epsg3857).bounds))
+
+
+def _tile_pattern(pattern_array, xoff, yoff, win_xsize, win_ysize):
+    """Tile a wallpaper pattern over a window.
+
+    The pattern repeats from the origin of the grid the window is in, so
+    the tiles of neighboring windows line up.
+
+    Args:
+        pattern_array (numpy.ndarray): The pixels of the pattern.
+        xoff (int): The column of the window's upper left pixel.
+        yoff (int): The row of the window's upper left pixel.
+        win_xsize (int): The width of the window, in pixels.
+        win_ysize (int): The height of the window, in pixels.
+
+    Returns:
+        tiled (numpy.ndarray): The pattern's pixels over the window.
+    """
+    pattern_ysize, pattern_xsize = pattern_array.shape
+    pattern_rows = numpy.arange(yoff, yoff + win_ysize) % pattern_ysize
+    pattern_cols = numpy.arange(xoff, xoff + win_xsize) % pattern_xsize
+    return pattern_array[pattern_rows[:, numpy.newaxis], pattern_cols]
+
+
+def _wallpaper_array(base_array, parcel_mask, pattern_array):
+    """Wallpaper a parcel in a window of an LULC.
+
+    The pattern is tiled from the window's origin, but only over the
+    parcel's bounding box.
+
+    Args:
+        base_array (numpy.ndarray): The pixels of the window.
+        parcel_mask (numpy.ndarray): A boolean array of the window's shape
+            that is ``True`` under the parcel.
+        pattern_array (numpy.ndarray): The pixels of the pattern.
+
+    Returns:
+        target_array (numpy.ndarray): A copy of ``base_array`` with the
+            pattern under the parcel.
+    """
+    target_array = base_array.copy()
+    parcel_rows = numpy.flatnonzero(parcel_mask.any(axis=1))
+    parcel_cols = numpy.flatnonzero(parcel_mask.any(axis=0))
+    if not parcel_rows.size:
+        return target_array
+
+    y0, y1 = parcel_rows[0], parcel_rows[-1] + 1
+    x0, x1 = parcel_cols[0], parcel_cols[-1] + 1
+    numpy.copyto(
+        target_array[y0:y1, x0:x1],
+        _tile_pattern(pattern_array, x0, y0, x1 - x0, y1 - y0),
+        where=parcel_mask[y0:y1, x0:x1])
+    return target_array
 
 
 def wallpaper_parcel(parcel_wkt_epsg3857, pattern_wkt_epsg3857,
-                     source_nlud_raster_path, target_raster_path,
-                     working_dir=None):
+                     source_nlud_raster_path, target_raster_path):
     """Wallpaper a region.
 
     This function is adapted from
     https://github.com/natcap/wallpaper-scenarios/blob/main/wallpaper_raster.py#L100
 
+    The study area and the pattern are each read once, the parcel is
+    rasterized in memory and the target raster is written once, so no
+    scratch files are needed.
+
     Args:
         parcel_wkt_epsg3857 (str): The WKT of the parcel to wallpaper over,
             projected in EPSG:3857 (Web Mercator)
@@ -419,89 +1061,86 @@ def wallpaper_parcel(parcel_wkt_epsg3857, pattern_wkt_epsg3857,
             LULC raster, projected in Web Mercator.
         target_raster_path (str): Where the output raster should be written on
             disk.
-        working_dir (str): Where temporary files should be stored.  If
-            ``None``, then the default temp dir will be used.
 
     Returns:
         ``None``
     """
-    nlud_raster_info = pygeoprocessing.geoprocessing.get_raster_info(
-        source_nlud_raster_path)
+    xoff, yoff, win_xsize, win_ysize = _study_area_window(
+        parcel_wkt_epsg3857)
+    base_array = _read_source_window(
+        source_nlud_raster_path, xoff, yoff, win_xsize, win_ysize)
+    parcel_mask = _rasterize_parcel_mask(
+        parcel_wkt_epsg3857, base_array.shape,
+        _lulc_window_geotransform(xoff, yoff))
+    wallpaper_array = _read_pattern(
+        pattern_wkt_epsg3857, source_nlud_raster_path)
+
+    target_raster = _create_lulc_window_raster(
+        target_raster_path, xoff, yoff, win_xsize, win_ysize)
+    target_raster.GetRasterBand(1).WriteArray(
+        _wallpaper_array(base_array, parcel_mask, wallpaper_array))
+    target_raster.BuildOverviews()  # default settings for overviews
+    target_raster = None
 
-    working_dir = tempfile.mkdtemp(prefix='wallpaper-parcel-', dir=working_dir)
-    parcel_mask_raster_path = os.path.join(working_dir, 'mask.tif')
-    fill_parcel(parcel_wkt_epsg3857, 1, parcel_mask_raster_path)
-    parcel_raster_info = pygeoprocessing.get_raster_info(
-        parcel_mask_raster_path)
 
-    nlud_under_parcel_path = os.path.join(working_dir, 'nlud_under_parcel.tif')
-    pygeoprocessing.geoprocessing.warp_raster(
-        source_nlud_raster_path, nlud_raster_info['pixel_size'],
-        nlud_under_parcel_path, 'near',
-        target_bb=parcel_raster_info['bounding_box'])
-    nlud_under_parcel_raster_info = pygeoprocessing.get_raster_info(
-        nlud_under_parcel_path)
-
-    nlud_under_pattern_path = os.path.join(
-        working_dir, 'nlud_under_pattern.tif')
-    pattern_bbox = shapely.wkt.loads(pattern_wkt_epsg3857).bounds
-    pygeoprocessing.geoprocessing.warp_raster(
-        source_nlud_raster_path, nlud_raster_info['pixel_size'],
-        nlud_under_pattern_path, 'near',
-        target_bb=pattern_bbox)
-    wallpaper_array = pygeoprocessing.raster_to_numpy_array(
-        nlud_under_pattern_path)
-
-    # Sanity check to catch programmer error early
-    for attr in ('raster_size', 'pixel_size', 'bounding_box'):
-        assert nlud_under_parcel_raster_info[attr] == parcel_raster_info[attr]
-
-    pygeoprocessing.new_raster_from_base(
-        parcel_mask_raster_path, target_raster_path,
-        LULC_DTYPE, [LULC_NODATA])
-    target_raster = gdal.OpenEx(
-        target_raster_path, gdal.OF_RASTER | gdal.GA_Update)
-    target_band = target_raster.GetRasterBand(1)
-    parcel_mask_raster = gdal.OpenEx(parcel_mask_raster_path, gdal.OF_RASTER)
-    parcel_mask_band = parcel_mask_raster.GetRasterBand(1)
-
-    for offset_dict, base_array in pygeoprocessing.iterblocks(
-            (nlud_under_parcel_path, 1)):
-        parcel_mask_array = parcel_mask_band.ReadAsArray(**offset_dict)
-        assert parcel_mask_array is not None
-
-        xoff = offset_dict['xoff']
-        yoff = offset_dict['yoff']
-
-        wallpaper_x = xoff % wallpaper_array.shape[1]
-        wallpaper_y = yoff % wallpaper_array.shape[0]
-
-        win_ysize = offset_dict['win_ysize']
-        win_xsize = offset_dict['win_xsize']
-        wallpaper_x_repeats = (
-            1 + ((wallpaper_x+win_xsize) // wallpaper_array.shape[1]))
-        wallpaper_y_repeats = (
-            1 + ((wallpaper_y+win_ysize) // wallpaper_array.shape[0]))
-        wallpaper_tiled = numpy.tile(
-            wallpaper_array,
-            (wallpaper_y_repeats, wallpaper_x_repeats))[
-            wallpaper_y:wallpaper_y+win_ysize,
-            wallpaper_x:wallpaper_x+win_xsize]
-
-        target_array = numpy.where(
-            parcel_mask_array == 1,
-            wallpaper_tiled,
-            base_array)
-
-        target_band.WriteArray(target_array, xoff=xoff, yoff=yoff)
+def crop_and_modify_parcel(parcel_wkt_epsg3857, modify_job_type,
+                           modify_args, target_baseline_path,
+                           target_lulc_path):
+    """Crop the baseline LULC and modify it, reading the LULC once.
 
-    target_raster.BuildOverviews()  # default settings for overviews
+    This writes the same rasters as a crop job and a fill or wallpaper job
+    on the same study area, but the buffered window of the LULC is only
+    read and warped once, and the pixel counts of both rasters are taken
+    from memory.
 
-    # clean up mask raster before rmtree
-    parcel_mask_band = None
-    parcel_mask_raster = None
+    Args:
+        parcel_wkt_epsg3857 (str): The WKT of the parcel to modify,
+            projected in EPSG:3857 (Web Mercator)
+        modify_job_type (str): Either ``JOBTYPE_FILL`` or
+            ``JOBTYPE_WALLPAPER``.
+        modify_args (dict): The arguments of the modification: the
+            ``lulc_class`` to fill with, or the ``pattern_bbox_wkt`` and the
+            ``lulc_source_url`` to take the wallpaper pattern from.
+        target_baseline_path (str): Where the cropped baseline lulc raster
+            should be saved.
+        target_lulc_path (str): Where the modified lulc raster should be
+            saved.
 
-    shutil.rmtree(working_dir)
+    Returns:
+        (baseline_counts, counts): The pixel counts under the parcel of the
+            baseline and of the modified raster, as returned by
+            ``pixelcounts_under_parcel``.
+    """
+    window = _study_area_window(parcel_wkt_epsg3857)
+    xoff, yoff, _, _ = window
+    baseline_array = _read_lulc_window(*window)
+    baseline_raster = _create_lulc_window_raster(
+        target_baseline_path, *window)
+    baseline_raster.GetRasterBand(1).WriteArray(baseline_array)
+    baseline_raster = None
+    parcel_mask = _rasterize_parcel_mask(
+        parcel_wkt_epsg3857, baseline_array.shape,
+        _lulc_window_geotransform(xoff, yoff))
+
+    if modify_job_type == JOBTYPE_FILL:
+        modified_array = numpy.where(
+            parcel_mask, modify_args['lulc_class'], baseline_array)
+    elif modify_job_type == JOBTYPE_WALLPAPER:
+        wallpaper_array = _read_pattern(
+            modify_args['pattern_bbox_wkt'], modify_args['lulc_source_url'])
+        modified_array = _wallpaper_array(
+            baseline_array, parcel_mask, wallpaper_array)
+    else:
+        raise ValueError(f"Invalid modification: {modify_job_type}")
+
+    target_raster = _create_lulc_window_raster(target_lulc_path, *window)
+    target_raster.GetRasterBand(1).WriteArray(modified_array)
+    if modify_job_type == JOBTYPE_WALLPAPER:
+        target_raster.BuildOverviews()  # default settings for overviews
+    target_raster = None
+
+    return (_count_pixels(baseline_array[parcel_mask]),
+            _count_pixels(modified_array[parcel_mask]))
 
 
 def pixelcounts_under_parcel(parcel_wkt_epsg3857, source_raster_path):
@@ -518,46 +1157,94 @@ def pixelcounts_under_parcel(parcel_wkt_epsg3857, source_raster_path):
             covers 4 pixels, 1 of lulc code 5 and 3 of lulc code 6, ``counts``
             would be ``{5: 0.25, 6: 0.75}``.
     """
-    if source_raster_path.startswith(('https', 'http')):
-        source_raster_path = f'/vsicurl/{source_raster_path}'
-    source_raster = gdal.OpenEx(source_raster_path,
-                                gdal.GA_ReadOnly | gdal.OF_RASTER)
-    source_band = source_raster.GetRasterBand(1)
-    geotransform = source_raster.GetGeoTransform()
+    parcel_counts, _ = pixelcounts_under_parcels(
+        [parcel_wkt_epsg3857], source_raster_path)
+    return parcel_counts[0]
+
+
+def pixelcounts_under_parcels(parcel_wkts_epsg3857, source_raster_path):
+    """Get the pixel counts per lulc code under each of many parcels.
+
+    The LULC is read once over the parcels' combined bounding box. Each
+    parcel is then rasterized on its own, over its own bounding box within
+    that window, so a pixel that several parcels touch is counted for each
+    of them, exactly as ``pixelcounts_under_parcel`` would count it.
+
+    Args:
+        parcel_wkts_epsg3857 (list): The parcel WKTs in web mercator.
+        source_raster_path (str): The LULC to get pixel counts from.
+
+    Returns:
+        (parcel_counts, total_counts): A list of dicts mapping int lulc codes
+            to int pixel counts, one for each parcel in order, and a dict of
+            the pixel counts under any of the parcels.
+    """
+    if _is_base_lulc(source_raster_path):
+        geotransform = _LULC_RASTER_INFO['geotransform']
+    else:
+        if source_raster_path.startswith(('https', 'http')):
+            source_raster_path = f'/vsicurl/{source_raster_path}'
+        source_raster = gdal.OpenEx(source_raster_path,
+                                    gdal.GA_ReadOnly | gdal.OF_RASTER)
+        source_band = source_raster.GetRasterBand(1)
+        geotransform = source_raster.GetGeoTransform()
     inv_geotransform = gdal.InvGeoTransform(geotransform)
 
-    parcel = shapely.wkt.loads(parcel_wkt_epsg3857)
-    # Convert lon/lat degrees to x/y pixel for the dataset
-    minx, miny, maxx, maxy = parcel.bounds
-    _x0, _y0 = gdal.ApplyGeoTransform(inv_geotransform, minx, miny)
-    _x1, _y1 = gdal.ApplyGeoTransform(inv_geotransform, maxx, maxy)
-    x0, y0 = min(_x0, _x1), min(_y0, _y1)
-    x1, y1 = max(_x0, _x1), max(_y0, _y1)
-
-    pygeoprocessing.geoprocessing.shapely_geometry_to_vector(
-        [parcel],
-        os.path.join('parcel_loaded.fgb'),
-        WEB_MERCATOR_SRS_WKT, 'FlatGeoBuf',
-        ogr_geom_type=OGR_GEOMETRY_TYPES[parcel.type],
-    )
+    # Convert web mercator coordinates to x/y pixel for the dataset
+    parcel_windows = []
+    for parcel_wkt in parcel_wkts_epsg3857:
+        minx, miny, maxx, maxy = shapely.wkt.loads(parcel_wkt).bounds
+        _x0, _y0 = gdal.ApplyGeoTransform(inv_geotransform, minx, miny)
+        _x1, _y1 = gdal.ApplyGeoTransform(inv_geotransform, maxx, maxy)
+        # "Round up" to the next pixel
+        parcel_windows.append((
+            math.floor(min(_x0, _x1)), math.floor(min(_y0, _y1)),
+            math.ceil(max(_x0, _x1)), math.ceil(max(_y0, _y1))))
+    x0, y0 = numpy.array(parcel_windows)[:, :2].min(axis=0).tolist()
+    x1, y1 = numpy.array(parcel_windows)[:, 2:].max(axis=0).tolist()
+
+    if _is_base_lulc(source_raster_path):
+        array = _read_lulc_window(x0, y0, x1 - x0, y1 - y0)
+    else:
+        array = source_band.ReadAsArray(
+            int(x0), int(y0), int(x1-x0), int(y1-y0))
+
+    parcel_counts = []
+    under_any_parcel = numpy.zeros(array.shape, dtype=bool)
+    for parcel_wkt, (px0, py0, px1, py1) in zip(
+            parcel_wkts_epsg3857, parcel_windows):
+        parcel_slice = (slice(py0 - y0, py1 - y0), slice(px0 - x0, px1 - x0))
+        target_origin_x, target_origin_y = gdal.ApplyGeoTransform(
+            geotransform, px0, py0)
+        parcel_mask = _rasterize_parcel_mask(
+            parcel_wkt, (py1 - py0, px1 - px0),
+            [target_origin_x, PIXELSIZE_X, 0.0,
+             target_origin_y, 0.0, PIXELSIZE_Y])
+        parcel_counts.append(
+            _count_pixels(array[parcel_slice][parcel_mask]))
+        under_any_parcel[parcel_slice] |= parcel_mask
+
+    return parcel_counts, _count_pixels(array[under_any_parcel])
+
+
+def _rasterize_parcel_mask(parcel_wkt_epsg3857, shape, geotransform):
+    """Rasterize a parcel onto an in-memory grid.
 
-    # "Round up" to the next pixel
-    x0 = math.floor(x0)
-    y0 = math.floor(y0)
-    x1 = math.ceil(x1)
-    y1 = math.ceil(y1)
-    array = source_band.ReadAsArray(
-        int(x0), int(y0), int(x1-x0), int(y1-y0))
+    Args:
+        parcel_wkt_epsg3857 (str): The parcel WKT in web mercator.
+        shape (tuple): The (rows, cols) of the grid.
+        geotransform (list): The GDAL geotransform of the grid.
 
+    Returns:
+        mask (numpy.ndarray): A boolean array of ``shape`` that is ``True``
+            for every pixel the parcel touches.
+    """
     # create a new in-memory dataset filled with 0
     gdal_driver = gdal.GetDriverByName('MEM')
     target_raster = gdal_driver.Create(
-        '', array.shape[1], array.shape[0], 1, gdal.GDT_Byte)
+        '', shape[1], shape[0], 1, gdal.GDT_Byte)
     target_raster.SetProjection(LULC_SRS_WKT)
-    target_origin_x, target_origin_y = gdal.ApplyGeoTransform(
-        geotransform, x0, y0)
-    target_raster.SetGeoTransform(
-        [target_origin_x, PIXELSIZE_X, 0.0, target_origin_y, 0.0, PIXELSIZE_Y])
+    target_raster.SetGeoTransform(geotransform)
     target_band = target_raster.GetRasterBand(1)
     target_band.Fill(0)
 
@@ -567,7 +1254,7 @@ def pixelcounts_under_parcel(parcel_wkt_epsg3857, source_raster_path):
         'parcel_layer', _WEB_MERCATOR_SRS, ogr.wkbPolygon)
     parcel_layer.StartTransaction()
     feature = ogr.Feature(parcel_layer.GetLayerDefn())
-    feature.SetGeometry(ogr.CreateGeometryFromWkt(parcel.wkt))
+    feature.SetGeometry(ogr.CreateGeometryFromWkt(parcel_wkt_epsg3857))
     parcel_layer.CreateFeature(feature)
     parcel_layer.CommitTransaction()
 
@@ -576,9 +1263,21 @@ def pixelcounts_under_parcel(parcel_wkt_epsg3857, source_raster_path):
         options=['ALL_TOUCHED=TRUE'], burn_values=[1])
 
     parcel_mask = target_band.ReadAsArray()
-    assert parcel_mask.shape == array.shape
+    assert parcel_mask.shape == tuple(shape)
+    return parcel_mask == 1
+
+
+def _count_pixels(values_under_parcel):
+    """Count the pixels of each lulc code in an array of pixel values.
+
+    Args:
+        values_under_parcel (numpy.ndarray): The pixel values under a parcel.
+
+    Returns:
+        counts (dict): A dict mapping int lulc codes to int pixel counts.
+    """
     values_under_parcel, counts = numpy.unique(
-        array[parcel_mask == 1], return_counts=True)
+        values_under_parcel, return_counts=True)
 
     return_values = {}
     # cast lulc_codes and counts to list for future json dump call
@@ -597,12 +1296,13 @@ def make_thumbnail(pattern_wkt_epsg3857, colors_dict, target_thumbnail_path,
 
     # Buffer the bbox by a half-pixel to make sure we get the whole pattern and
     # just a small bit of the surrounding context.
-    pygeoprocessing.geoprocessing.warp_raster(
-        LULC_RASTER_PATH, _LULC_RASTER_INFO['pixel_size'],
-        thumbnail_gtiff_path, 'near',
-        target_bb=shapely.wkt.loads(pattern_wkt_epsg3857).buffer(
-            PIXELSIZE_X/2).bounds
-    )
+    pattern_array = _read_lulc_window(*_lulc_window(
+        shapely.wkt.loads(pattern_wkt_epsg3857).buffer(PIXELSIZE_X/2).bounds))
+    thumbnail_raster = gdal.GetDriverByName('GTiff').Create(
+        thumbnail_gtiff_path, pattern_array.shape[1], pattern_array.shape[0],
+        1, LULC_DTYPE)
+    thumbnail_raster.GetRasterBand(1).WriteArray(pattern_array)
+    thumbnail_raster = None
 
     raw_image = Image.open(thumbnail_gtiff_path)
     # 'P' mode indicates palletted color
@@ -631,119 +1331,256 @@ def make_thumbnail(pattern_wkt_epsg3857, colors_dict, target_thumbnail_path,
     shutil.rmtree(working_dir, ignore_errors=True)
 
 
-def do_work(host, port, outputs_location):
-    job_queue_url = f'http://{host}:{port}/jobsqueue/'
-    LOGGER.info(f'Starting worker, queueing {job_queue_url}')
-    LOGGER.info(f'Polling the queue every {POLLING_INTERVAL_S}s if no work')
-
-    while True:
-        response = requests.get(job_queue_url)
-        # if there is no work on the queue, expecting response.json()==None
-        if not response.json():
-            time.sleep(POLLING_INTERVAL_S)
-            continue
-        LOGGER.info("Response received; loading job details")
-
-        # response.json() returns a stringified json object, so need to load
-        # it into a python dict
-        response_json = json.loads(response.json())
-        server_args = response_json['server_attrs']
-        job_id = server_args['job_id']
-        job_type = response_json['job_type']
-        job_args = response_json['job_args']
-
-        #TODO: could this be moved outside of while loop?
-        # Make sure the appropriate directory is created
-        scenarios_dir = os.path.join(outputs_location, 'scenarios')
-        model_outputs_dir = os.path.join(outputs_location, 'model_outputs')
-        for path in (scenarios_dir, model_outputs_dir):
-            if not os.path.exists(path):
-                os.makedirs(path)
-
-        LOGGER.info(f"Starting job {job_id}:{job_type}")
-        try:
-            if job_type in {JOBTYPE_FILL, JOBTYPE_WALLPAPER, JOBTYPE_CROP}:
-                scenario_id = server_args['scenario_id']
-                workspace = os.path.join(scenarios_dir, str(scenario_id))
-                result_path = os.path.join(
-                    workspace, f'{scenario_id}_{job_type}.tif')
-                os.makedirs(workspace, exist_ok=True)
-
-                if job_type == JOBTYPE_CROP:
-                    _create_new_lulc(
-                        parcel_wkt_epsg3857=job_args['target_parcel_wkt'],
-                        target_local_gtiff_path=result_path,
-                        include_pixel_values=True
-                    )
-                    LOGGER.info(f"Baseline study area written to {result_path}")
-                if job_type == JOBTYPE_FILL:
-                    fill_parcel(
-                        parcel_wkt_epsg3857=job_args['target_parcel_wkt'],
-                        fill_lulc_class=job_args['lulc_class'],
-                        target_lulc_path=result_path
-                    )
-                    LOGGER.info(f"Filled study area written to {result_path}")
-                elif job_type == JOBTYPE_WALLPAPER:
-                    wallpaper_temp_dir = tempfile.mkdtemp(
-                        dir=workspace, prefix='wallpaper-')
-                    wallpaper_parcel(
-                        parcel_wkt_epsg3857=job_args['target_parcel_wkt'],
-                        pattern_wkt_epsg3857=job_args['pattern_bbox_wkt'],
-                        source_nlud_raster_path=job_args['lulc_source_url'],
-                        target_raster_path=result_path,
-                        working_dir=wallpaper_temp_dir
-                    )
-                    LOGGER.info(f"Wallpapered study area written to {result_path}")
-                    try:
-                        shutil.rmtree(wallpaper_temp_dir)
-                    except OSError as e:
-                        LOGGER.exception(
-                            "Something went wrong removing "
-                            f"{wallpaper_temp_dir}: {e}")
-                data = {
-                    'result': {
-                        'lulc_path': result_path,
-                        'lulc_stats': pixelcounts_under_parcel(
-                            job_args['target_parcel_wkt'],
-                            result_path
-                        ),
-                    },
-                }
-            elif job_type == JOBTYPE_PARCEL_STATS:
-                data = {
-                    'result': {
-                        'lulc_stats': {
-                            'base': pixelcounts_under_parcel(
-                                job_args['target_parcel_wkt'],
-                                job_args['lulc_source_url']
-                            ),
-                        }
-                    }
-                }
-            elif job_type == JOBTYPE_INVEST:
-                invest_model = job_args['invest_model']
-                scenario_id = job_args['scenario_id']
-                LOGGER.info(f"Run InVEST model: {job_args['invest_model']}")
+def _build_scenario_lulc(job_type, job_args, result_path):
+    """Create the LULC raster of a crop, fill or wallpaper job.
+
+    Args:
+        job_type (str): One of ``JOBTYPE_CROP``, ``JOBTYPE_FILL`` or
+            ``JOBTYPE_WALLPAPER``.
+        job_args (dict): The job's arguments, as provided by the server.
+        result_path (str): Where the raster should be written.
 
-                model_meta = INVEST_MODELS[invest_model]
-                lulc_path = job_args['lulc_source_url']
+    Returns:
+        ``None``
+    """
+    if job_type == JOBTYPE_CROP:
+        _create_new_lulc(
+            parcel_wkt_epsg3857=job_args['target_parcel_wkt'],
+            target_local_gtiff_path=result_path,
+            include_pixel_values=True
+        )
+        LOGGER.info(f"Baseline study area written to {result_path}")
+    if job_type == JOBTYPE_FILL:
+        fill_parcel(
+            parcel_wkt_epsg3857=job_args['target_parcel_wkt'],
+            fill_lulc_class=job_args['lulc_class'],
+            target_lulc_path=result_path
+        )
+        LOGGER.info(f"Filled study area written to {result_path}")
+    elif job_type == JOBTYPE_WALLPAPER:
+        wallpaper_parcel(
+            parcel_wkt_epsg3857=job_args['target_parcel_wkt'],
+            pattern_wkt_epsg3857=job_args['pattern_bbox_wkt'],
+            source_nlud_raster_path=job_args['lulc_source_url'],
+            target_raster_path=result_path
+        )
+        LOGGER.info(f"Wallpapered study area written to {result_path}")
+
+
+def _scenario_lulc_key(job_type, job_args):
+    """Build the scenario LULC cache key of a crop, fill or wallpaper.
 
-                workspace_dir = os.path.join(
-                    model_outputs_dir, f'{invest_model}-{scenario_id}')
+    Args:
+        job_type (str): One of ``JOBTYPE_CROP``, ``JOBTYPE_FILL`` or
+            ``JOBTYPE_WALLPAPER``.
+        job_args (dict): The job's arguments, as provided by the server.
 
+    Returns:
+        key (str): A hex digest.
+    """
+    operation_args = {}
+    if job_type == JOBTYPE_FILL:
+        operation_args['lulc_class'] = job_args['lulc_class']
+    elif job_type == JOBTYPE_WALLPAPER:
+        operation_args['pattern_wkt'] = job_args['pattern_bbox_wkt']
+        operation_args['source_lulc_version'] = _get_lulc_version(
+            job_args['lulc_source_url'])
+    return result_cache.scenario_lulc_key(
+        job_args['target_parcel_wkt'], job_type, operation_args,
+        _get_lulc_version(LULC_RASTER_PATH))
+
+
+@contextlib.contextmanager
+def _timed(stage):
+    """Add the time spent in the ``with`` block to ``_STAGE_TIMINGS``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _STAGE_TIMINGS[stage] += time.perf_counter() - start
+
+
+def _reset_peak_rss():
+    """Reset this process's peak resident set size, where Linux allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        # The peak then covers the life of the process, not just this job.
+        pass
+
+
+def _get_peak_rss_bytes():
+    """Get this process's peak resident set size since the last reset."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024  # reported in kB
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _run_job(job_type, job_args, server_args, outputs_location):
+    """Execute a single job from the queue.
+
+    This is run in a worker process from the pool, so it must not raise;
+    failures are reported through the returned status instead.
+
+    Args:
+        job_type (str): One of the ``JOBTYPE_*`` constants.
+        job_args (dict): The job's arguments, as provided by the server.
+        server_args (dict): The job's server attributes, which are echoed
+            back to the server with the result.
+        outputs_location (str): The directory where outputs are written.
+
+    Returns:
+        data (dict): The result to post back to the server, including the
+            job's ``metrics``.
+    """
+    started_at = time.time()
+    _STAGE_TIMINGS.clear()
+    _reset_peak_rss()
+    job_id = server_args['job_id']
+    scenarios_dir = os.path.join(outputs_location, 'scenarios')
+    model_outputs_dir = os.path.join(outputs_location, 'model_outputs')
+    scenario_cache_dir = os.path.join(
+        outputs_location, 'cache', 'scenario_lulc')
+    invest_cache_dir = os.path.join(outputs_location, 'cache', 'invest')
+
+    LOGGER.info(f"Starting job {job_id}:{job_type}")
+    try:
+        if job_type in {JOBTYPE_FILL, JOBTYPE_WALLPAPER, JOBTYPE_CROP}:
+            scenario_id = server_args['scenario_id']
+            workspace = os.path.join(scenarios_dir, str(scenario_id))
+            result_path = os.path.join(
+                workspace, f'{scenario_id}_{job_type}.tif')
+            os.makedirs(workspace, exist_ok=True)
+
+            with _timed('read'):
+                cache_key = _scenario_lulc_key(job_type, job_args)
+                lulc_stats = result_cache.get_scenario_lulc(
+                    scenario_cache_dir, cache_key, result_path)
+            if lulc_stats is None:
+                # The previous result may be hard linked into the cache, so
+                # never overwrite it in place.
+                if os.path.exists(result_path):
+                    os.remove(result_path)
+                with _timed('compute'):
+                    _build_scenario_lulc(job_type, job_args, result_path)
+                with _timed('post_process'):
+                    lulc_stats = pixelcounts_under_parcel(
+                        job_args['target_parcel_wkt'], result_path)
+                with _timed('write'):
+                    result_cache.put_scenario_lulc(
+                        scenario_cache_dir, cache_key, result_path,
+                        lulc_stats, SCENARIO_CACHE_MAX_BYTES)
+            data = {
+                'result': {
+                    'lulc_path': result_path,
+                    'lulc_stats': lulc_stats,
+                },
+            }
+        elif job_type == JOBTYPE_CROP_AND_MODIFY:
+            modify_job_type = job_args['modify_job_type']
+            baseline_id = server_args['baseline_scenario_id']
+            scenario_id = server_args['scenario_id']
+            baseline_path = os.path.join(
+                scenarios_dir, str(baseline_id),
+                f'{baseline_id}_{JOBTYPE_CROP}.tif')
+            result_path = os.path.join(
+                scenarios_dir, str(scenario_id),
+                f'{scenario_id}_{modify_job_type}.tif')
+            for path in (baseline_path, result_path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with _timed('read'):
+                baseline_cache_key = _scenario_lulc_key(JOBTYPE_CROP, job_args)
+                cache_key = _scenario_lulc_key(modify_job_type, job_args)
+                baseline_stats = result_cache.get_scenario_lulc(
+                    scenario_cache_dir, baseline_cache_key, baseline_path)
+                lulc_stats = result_cache.get_scenario_lulc(
+                    scenario_cache_dir, cache_key, result_path)
+            if baseline_stats is None or lulc_stats is None:
+                for path in (baseline_path, result_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                with _timed('compute'):
+                    baseline_stats, lulc_stats = crop_and_modify_parcel(
+                        job_args['target_parcel_wkt'], modify_job_type,
+                        job_args, baseline_path, result_path)
+                with _timed('write'):
+                    result_cache.put_scenario_lulc(
+                        scenario_cache_dir, baseline_cache_key, baseline_path,
+                        baseline_stats, SCENARIO_CACHE_MAX_BYTES)
+                    result_cache.put_scenario_lulc(
+                        scenario_cache_dir, cache_key, result_path,
+                        lulc_stats, SCENARIO_CACHE_MAX_BYTES)
+            data = {
+                'result': {
+                    'lulc_path': result_path,
+                    'lulc_stats': lulc_stats,
+                    'baseline_lulc_path': baseline_path,
+                    'baseline_lulc_stats': baseline_stats,
+                },
+            }
+        elif job_type == JOBTYPE_PARCEL_STATS:
+            with _timed('compute'):
+                base_lulc_stats = pixelcounts_under_parcel(
+                    job_args['target_parcel_wkt'],
+                    job_args['lulc_source_url']
+                )
+            data = {
+                'result': {
+                    'lulc_stats': {
+                        'base': base_lulc_stats,
+                    }
+                }
+            }
+        elif job_type == JOBTYPE_INVEST:
+            invest_model = job_args['invest_model']
+            scenario_id = job_args['scenario_id']
+            LOGGER.info(f"Run InVEST model: {job_args['invest_model']}")
+
+            model_meta = INVEST_MODELS[invest_model]
+            lulc_path = job_args['lulc_source_url']
+
+            workspace_dir = os.path.join(
+                model_outputs_dir, f'{invest_model}-{scenario_id}')
+            os.makedirs(workspace_dir, exist_ok=True)
+            with _timed('read'):
+                args_dict = model_meta['build_args'](
+                    lulc_path, workspace_dir, job_args['study_area_wkt'])
+
+                # Scenarios with identical LULC pixels share results,
+                # whichever session or scenario ran the model first.
+                cache_key = result_cache.invest_result_key(
+                    invest_model, _hash_raster(lulc_path),
+                    job_args['study_area_wkt'], args_dict, lulc_path,
+                    workspace_dir)
+                cached_result = result_cache.get_invest_result(
+                    invest_cache_dir, cache_key)
+            if cached_result is not None:
+                model_result_path = cached_result['invest-result']
+                serviceshed = cached_result['serviceshed']
+            else:
                 # Ultimately we may not need prepare_workspace, but it is
                 # convenient for 1) creating the workspace as a location to
-                # write dynamically-created input files like an AOI vector, and
-                # 2) having invest log to a file.
+                # write dynamically-created input files like an AOI vector,
+                # and 2) having invest log to a file.
                 with utils.prepare_workspace(workspace_dir,
                                              name=invest_model,
                                              logging_level=logging.INFO):
-                    args_dict = model_meta['build_args'](
-                        lulc_path, workspace_dir, job_args['study_area_wkt'])
-                    LOGGER.info(f'{invest_model} model arguments: {args_dict}')
-                    model_meta['api'].execute(args_dict)
+                    LOGGER.info(
+                        f'{invest_model} model arguments: {args_dict}')
+                    with _timed('compute'):
+                        model_meta['api'].execute(args_dict)
                     LOGGER.info(f'Post processing {invest_model} model')
-                    model_result_path = model_meta['derive_results'](workspace_dir)
+                    with _timed('post_process'):
+                        model_result_path = model_meta['derive_results'](
+                            workspace_dir)
 
                 if invest_model == URBAN_COOLING:
                     serviceshed = args_dict['aoi_vector_path']
@@ -751,31 +1588,491 @@ def do_work(host, port, outputs_location):
                     serviceshed = args_dict['admin_boundaries_vector_path']
                 else:
                     serviceshed = ''
-                data = {
-                    'result': {
-                        'invest-result': model_result_path,
-                        'model': job_args['invest_model'],
-                        'serviceshed': serviceshed
-                    }
+                with _timed('write'):
+                    result_cache.put_invest_result(
+                        invest_cache_dir, cache_key, {
+                            'invest-result': model_result_path,
+                            'serviceshed': serviceshed,
+                        })
+            data = {
+                'result': {
+                    'invest-result': model_result_path,
+                    'model': job_args['invest_model'],
+                    'serviceshed': serviceshed
                 }
-            else:
-                raise ValueError(f"Invalid job type: {job_type}")
-            status = STATUS_SUCCESS
+            }
+        else:
+            raise ValueError(f"Invalid job type: {job_type}")
+        status = STATUS_SUCCESS
+    except Exception as error:
+        LOGGER.exception(f'{job_type} failed: {error}')
+        status = STATUS_FAILED
+        data = {
+            'result': STATUS_FAILED
+        }  # data must validate against schema even in fail
+    LOGGER.info(f"Job {job_id}: {job_type} finished with {status}")
+    data['server_attrs'] = server_args
+    data['status'] = status
+    data['metrics'] = {
+        'started_at': started_at,
+        'finished_at': time.time(),
+        'timings': dict(_STAGE_TIMINGS),
+        'peak_rss_bytes': _get_peak_rss_bytes(),
+        # GDAL's block cache belongs to this pool process, so the parent
+        # learns how full it is from here.
+        'pid': os.getpid(),
+        'gdal_cache_used_bytes': gdal.GetCacheUsed(),
+    }
+    return data
+
+
+def _parse_job_slots(slot_args):
+    """Parse ``JOBTYPE=N`` strings into a dict of job slots.
+
+    Args:
+        slot_args (list): ``JOBTYPE=N`` strings, each overriding the number
+            of concurrent jobs of that type from ``DEFAULT_JOB_SLOTS``.
+
+    Returns:
+        job_slots (dict): A dict mapping job types to the number of jobs of
+            that type that may run at the same time.
+    """
+    job_slots = DEFAULT_JOB_SLOTS.copy()
+    for slot_arg in slot_args:
+        job_type, n_slots = slot_arg.split('=')
+        if job_type not in DEFAULT_JOB_SLOTS:
+            raise ValueError(f"Invalid job type: {job_type}")
+        job_slots[job_type] = int(n_slots)
+    return job_slots
+
+
+def _format_metric(name, help_text, metric_type, samples):
+    """Format one metric in the Prometheus text exposition format.
+
+    Args:
+        name (str): The metric name.
+        help_text (str): A description of the metric.
+        metric_type (str): ``'gauge'``, ``'counter'`` or ``'summary'``.
+        samples (list): ``(suffix, labels, value)`` tuples, where ``suffix``
+            is appended to the name (e.g. ``'_sum'``) and ``labels`` is a
+            dict.
+
+    Returns:
+        lines (list): The lines of text.
+    """
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    for suffix, labels, value in samples:
+        label_text = ','.join(
+            f'{key}="{value}"' for key, value in labels.items())
+        if label_text:
+            label_text = f'{{{label_text}}}'
+        lines.append(f'{name}{suffix}{label_text} {value}')
+    return lines
+
+
+def _serve_metrics(port, get_metrics_text):
+    """Serve ``get_metrics_text()`` at ``/metrics`` from a daemon thread.
+
+    Args:
+        port (int): The port to listen on.
+        get_metrics_text (callable): Returns the metrics in the Prometheus
+            text exposition format.
+
+    Returns:
+        ``None``
+    """
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = get_metrics_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header(
+                'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            LOGGER.debug(format % args)
+
+    server = http.server.ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    LOGGER.info(f'Serving metrics on port {port}')
+
+
+def _init_pool_process(scenario_cache_max_bytes, lulc_block_cache,
+                       lulc_sidecar_path):
+    """Apply the worker's settings in a newly-started pool process."""
+    global SCENARIO_CACHE_MAX_BYTES, _LULC_BLOCK_CACHE, _LULC_SIDECAR
+    SCENARIO_CACHE_MAX_BYTES = scenario_cache_max_bytes
+    _LULC_BLOCK_CACHE = lulc_block_cache
+    if lulc_sidecar_path is not None:
+        _LULC_SIDECAR = _open_lulc_sidecar(lulc_sidecar_path)
+
+
+def do_work(host, port, outputs_location, job_slots=None,
+            scenario_cache_max_bytes=SCENARIO_CACHE_MAX_BYTES,
+            metrics_port=None, pool_slots=DEFAULT_POOL_SLOTS,
+            interactive_slots=DEFAULT_INTERACTIVE_SLOTS,
+            lulc_block_cache_max_bytes=LULC_BLOCK_CACHE_MAX_BYTES,
+            lulc_sidecar_path=None):
+    """Lease jobs from the queue and run them in a pool of processes.
+
+    Args:
+        host (str): The host of the API.
+        port (str): The port of the API.
+        outputs_location (str): The directory where outputs are written.
+        job_slots (dict): A dict mapping job types to the most jobs of
+            that type that may run at the same time.  If ``None``,
+            ``DEFAULT_JOB_SLOTS`` is used.
+        scenario_cache_max_bytes (int): The upper bound on the size of the
+            cache of scenario LULC rasters.
+        metrics_port (int): If given, serve Prometheus metrics on this port.
+        pool_slots (int): The number of jobs that may run at the same time.
+        interactive_slots (int): How many of the ``pool_slots`` are reserved
+            for interactive jobs (see ``INTERACTIVE_JOB_TYPES``). Interactive
+            jobs may also use the other slots.
+        lulc_block_cache_max_bytes (int): The memory for decoded blocks of
+            the base LULC, shared by the pool processes. If 0, the blocks
+            are not cached.
+        lulc_sidecar_path (str): If given, the pool processes read the base
+            LULC from an uncompressed copy at this path, which is written
+            first if it is missing or out of date. The block cache is then
+            not used.
+
+    Returns:
+        ``None``
+    """
+    if job_slots is None:
+        job_slots = DEFAULT_JOB_SLOTS
+    if not 0 <= interactive_slots < pool_slots:
+        raise ValueError(
+            f'interactive_slots must be at least 0 and less than '
+            f'pool_slots ({pool_slots}), not {interactive_slots}')
+    job_queue_url = f'http://{host}:{port}/jobsqueue/'
+    LOGGER.info(f'Starting worker, queueing {job_queue_url}')
+    LOGGER.info(f'Long-polling the queue for up to {LONG_POLL_S}s at a time')
+    LOGGER.info(f'Job slots: {job_slots}')
+    LOGGER.info(f'{pool_slots} processes, {interactive_slots} of them '
+                'reserved for interactive jobs')
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+
+    # Make sure the appropriate directories are created
+    for dirname in ('scenarios', 'model_outputs'):
+        os.makedirs(os.path.join(outputs_location, dirname), exist_ok=True)
+
+    # 'spawn' because forking a process that is running threads is unsafe.
+    mp_context = multiprocessing.get_context('spawn')
+    # The pool processes read the base LULC from the sidecar, or else
+    # through the shared block cache.
+    lulc_block_cache = None
+    if lulc_sidecar_path is not None:
+        _prepare_lulc_sidecar(lulc_sidecar_path)
+    elif lulc_block_cache_max_bytes:
+        lulc_block_cache = block_cache.SharedBlockCache(
+            LULC_RASTER_PATH, lulc_block_cache_max_bytes, mp_context)
+
+    # Jobs in flight per job type; guarded by the condition, which is
+    # notified whenever a job finishes and frees its slot.
+    jobs_in_flight = collections.Counter()
+    slot_freed = threading.Condition()
+    # Results are posted from a separate thread so that a long poll for new
+    # work never delays reporting a finished job.
+    results_queue = queue.Queue()
+    # Also guarded by the condition: the ids of the jobs this worker holds a
+    # lease on, from when they are leased until their result is posted; the
+    # future of each running job; and the jobs that were cancelled or given
+    # to another worker, whose results are not posted.
+    held_job_ids = set()
+    job_futures = {}
+    dropped_job_ids = set()
+    # Also guarded by the condition: the number of finished jobs and their
+    # total run time by (job type, invest model), and the GDAL cache usage
+    # last reported by each pool process.
+    job_run_counts = collections.Counter()
+    job_run_seconds = collections.Counter()
+    gdal_cache_used = {}
+
+    def _get_metrics_text():
+        with slot_freed:
+            lines = _format_metric(
+                'urban_online_worker_jobs_in_flight',
+                'Jobs running in the pool, by job type.', 'gauge',
+                [('', {'job_type': job_type}, jobs_in_flight[job_type])
+                 for job_type in job_slots])
+            lines += _format_metric(
+                'urban_online_worker_job_slots',
+                'Jobs that may run at the same time, by job type.', 'gauge',
+                [('', {'job_type': job_type}, n_slots)
+                 for job_type, n_slots in job_slots.items()])
+            lines += _format_metric(
+                'urban_online_worker_gdal_cache_used_bytes',
+                'GDAL block cache in use, summed over the pool processes.',
+                'gauge', [('', {}, sum(gdal_cache_used.values()))])
+            lines += _format_metric(
+                'urban_online_worker_gdal_cache_max_bytes',
+                'GDAL block cache limit of each pool process.', 'gauge',
+                [('', {}, gdal.GetCacheMax())])
+            run_samples = []
+            for (job_type, model), count in job_run_counts.items():
+                labels = {'job_type': job_type, 'model': model}
+                run_samples.append(
+                    ('_sum', labels, job_run_seconds[(job_type, model)]))
+                run_samples.append(('_count', labels, count))
+            lines += _format_metric(
+                'urban_online_worker_job_run_seconds',
+                'Time spent running finished jobs, by job type and model.',
+                'summary', run_samples)
+        if lulc_block_cache is not None:
+            block_stats = lulc_block_cache.get_stats()
+            for name, help_text, metric_type, value in (
+                    ('hits_total', 'Base LULC blocks read from the cache.',
+                     'counter', block_stats['hits']),
+                    ('misses_total', 'Base LULC blocks decoded on a miss.',
+                     'counter', block_stats['misses']),
+                    ('evictions_total', 'Blocks evicted to make room.',
+                     'counter', block_stats['evictions']),
+                    ('blocks', 'Blocks in the cache.', 'gauge',
+                     block_stats['blocks']),
+                    ('max_blocks', 'Blocks that fit in the cache.', 'gauge',
+                     block_stats['max_blocks'])):
+                lines += _format_metric(
+                    f'urban_online_worker_lulc_block_cache_{name}',
+                    help_text, metric_type, [('', {}, value)])
+        return '\n'.join(lines) + '\n'
+
+    def _post_results(results_session, batch):
+        # Post until the server has applied or rejected each result. The
+        # server rejects a result that it can never apply, for example the
+        # result of a job whose scenario was deleted, so those are dropped
+        # rather than posted again.
+        while True:
+            try:
+                response = results_session.post(
+                    f'{job_queue_url}results', data=json.dumps(batch),
+                    timeout=LONG_POLL_S)
+                if response.status_code < 400:
+                    result_statuses = response.json()
+                    break
+                if response.status_code < 500:
+                    # The server couldn't read the batch, so post the
+                    # results one at a time to find the ones it can't read.
+                    if len(batch) > 1:
+                        for data in batch:
+                            _post_results(results_session, [data])
+                        return
+                    LOGGER.warning(
+                        f'The server rejected the result of job '
+                        f'{batch[0]["server_attrs"]["job_id"]} (HTTP '
+                        f'{response.status_code}: {response.text})')
+                    return
+                error = f'HTTP {response.status_code}'
+            except (requests.RequestException, ValueError) as request_error:
+                error = request_error
+            LOGGER.warning(
+                f'Posting results failed ({error}); retrying in '
+                f'{RESULT_RETRY_S}s')
+            time.sleep(RESULT_RETRY_S)
+        for result_status in result_statuses:
+            if result_status['status'] != 'applied':
+                LOGGER.warning(
+                    f'The server rejected the result of job '
+                    f'{result_status["job_id"]}: {result_status["detail"]}')
+
+    def _report_results():
+        results_session = requests.Session()
+        while True:
+            # Post every result that finished while the previous post was in
+            # flight together, so a burst of quick jobs costs one request.
+            batch = [results_queue.get()]
+            while True:
+                try:
+                    batch.append(results_queue.get_nowait())
+                except queue.Empty:
+                    break
+            _post_results(results_session, batch)
+            with slot_freed:
+                held_job_ids.difference_update(
+                    data['server_attrs']['job_id'] for data in batch)
+
+    def _send_heartbeats():
+        heartbeat_session = requests.Session()
+        while True:
+            time.sleep(HEARTBEAT_S)
+            with slot_freed:
+                job_ids = list(held_job_ids)
+            if not job_ids:
+                continue
+            try:
+                response = heartbeat_session.post(
+                    f'{job_queue_url}heartbeat',
+                    data=json.dumps({
+                        'worker_id': worker_id,
+                        'job_ids': job_ids,
+                    }),
+                    timeout=HEARTBEAT_S)
+                lost_job_ids = response.json()['lost']
+                cancelled_job_ids = response.json()['cancelled']
+            except (requests.RequestException, ValueError, KeyError) as error:
+                LOGGER.warning(f'Heartbeat failed: {error}')
+                continue
+            if lost_job_ids:
+                LOGGER.warning(f'Lost the leases on jobs {lost_job_ids}')
+            if cancelled_job_ids:
+                LOGGER.info(f'Jobs {cancelled_job_ids} were cancelled')
+            # The server will ignore the results of these jobs, so don't
+            # run them if they haven't started, and don't post their results.
+            with slot_freed:
+                for job_id in lost_job_ids + cancelled_job_ids:
+                    held_job_ids.discard(job_id)
+                    if job_id in job_futures:
+                        dropped_job_ids.add(job_id)
+                        job_futures[job_id].cancel()
+
+    def _job_finished(job_type, server_args, model, future):
+        try:
+            data = future.result()
+        except concurrent.futures.CancelledError:
+            data = {}
         except Exception as error:
+            # _run_job handles its own errors, so this is the pool itself
+            # failing. When a process is killed, every job in the pool fails
+            # here with BrokenProcessPool, and the lease loop starts a new
+            # pool for the next jobs.
             LOGGER.exception(f'{job_type} failed: {error}')
-            status = STATUS_FAILED
-            result_path = None
             data = {
-                'result': STATUS_FAILED
-            }  # data must validate against schema even in fail
-        finally:
-            LOGGER.info(f"Job {job_id}: {job_type} finished with {status}")
-            data['server_attrs'] = server_args
-            data['status'] = status
-            requests.post(
-                f'{job_queue_url}{ENDPOINTS[job_type]}',
-                data=json.dumps(data)
-            )
+                'result': STATUS_FAILED,
+                'server_attrs': server_args,
+                'status': STATUS_FAILED,
+            }
+        data['job_type'] = job_type
+        with slot_freed:
+            job_id = server_args['job_id']
+            del job_futures[job_id]
+            if job_id in dropped_job_ids:
+                dropped_job_ids.remove(job_id)
+                LOGGER.info(f'Dropping the result of job {job_id}')
+            else:
+                results_queue.put(data)
+            jobs_in_flight[job_type] -= 1
+            if 'metrics' in data:
+                metrics = data['metrics']
+                job_run_counts[(job_type, model)] += 1
+                job_run_seconds[(job_type, model)] += (
+                    metrics['finished_at'] - metrics['started_at'])
+                gdal_cache_used[metrics['pid']] = (
+                    metrics['gdal_cache_used_bytes'])
+            slot_freed.notify()
+
+    threading.Thread(target=_report_results, daemon=True).start()
+    threading.Thread(target=_send_heartbeats, daemon=True).start()
+    if metrics_port is not None:
+        _serve_metrics(metrics_port, _get_metrics_text)
+
+    # Reuse one keep-alive connection for every request for work.
+    http_session = requests.Session()
+
+    def _create_executor():
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=pool_slots,
+            mp_context=mp_context,
+            initializer=_init_pool_process,
+            initargs=(scenario_cache_max_bytes, lulc_block_cache,
+                      lulc_sidecar_path))
+
+    executor = _create_executor()
+    lease_retry_s = LEASE_RETRY_S
+    with contextlib.ExitStack() as cleanup:
+        # The pool may be replaced below, so shut down whichever is current.
+        cleanup.callback(lambda: executor.shutdown())
+        if lulc_block_cache is not None:
+            cleanup.callback(lulc_block_cache.close)
+        while True:
+            with slot_freed:
+                n_free = pool_slots - sum(jobs_in_flight.values())
+                n_batch = sum(
+                    n_jobs for job_type, n_jobs in jobs_in_flight.items()
+                    if job_type not in INTERACTIVE_JOB_TYPES)
+                class_capacity = {
+                    JOBCLASS_INTERACTIVE: n_free,
+                    JOBCLASS_BATCH: min(
+                        n_free, pool_slots - interactive_slots - n_batch),
+                }
+                capacity = {}
+                for job_type, n_slots in job_slots.items():
+                    if job_type in INTERACTIVE_JOB_TYPES:
+                        job_class = JOBCLASS_INTERACTIVE
+                    else:
+                        job_class = JOBCLASS_BATCH
+                    n_jobs = min(n_slots - jobs_in_flight[job_type],
+                                 class_capacity[job_class])
+                    if n_jobs > 0:
+                        capacity[job_type] = n_jobs
+                if not capacity:
+                    slot_freed.wait()
+                    continue
+                # Slots of other job types may free up while we wait on the
+                # queue, so don't hold a long poll open while jobs are
+                # running.
+                if sum(jobs_in_flight.values()):
+                    wait_s = BUSY_LONG_POLL_S
+                else:
+                    wait_s = LONG_POLL_S
+
+            # Lease up to one job per free slot; an empty list means there
+            # is no work on the queue.
+            try:
+                response = http_session.post(
+                    f'{job_queue_url}lease',
+                    data=json.dumps({
+                        'worker_id': worker_id,
+                        'capacity': capacity,
+                        'class_capacity': class_capacity,
+                        'max_jobs': n_free,
+                        'wait': wait_s,
+                    }),
+                    timeout=wait_s + LONG_POLL_S)
+                response.raise_for_status()
+                jobs = response.json()
+            except (requests.RequestException, ValueError) as error:
+                LOGGER.warning(
+                    f'Requesting work failed ({error}); retrying in '
+                    f'{lease_retry_s}s')
+                time.sleep(lease_retry_s)
+                lease_retry_s = min(2 * lease_retry_s, LEASE_RETRY_MAX_S)
+                continue
+            lease_retry_s = LEASE_RETRY_S
+            for job in jobs:
+                server_args = job['server_attrs']
+                job_type = job['job_type']
+                job_args = job['job_args']
+
+                with slot_freed:
+                    jobs_in_flight[job_type] += 1
+                    held_job_ids.add(server_args['job_id'])
+                    try:
+                        future = executor.submit(
+                            _run_job, job_type, job_args, server_args,
+                            outputs_location)
+                    except concurrent.futures.process.BrokenProcessPool:
+                        # A pool process died, for example at the hands of
+                        # the OOM killer. The jobs that were in the pool
+                        # have already been reported as failed (see
+                        # _job_finished), so start a new pool for the rest.
+                        LOGGER.error(
+                            'The process pool is broken; starting a new one')
+                        executor.shutdown(wait=False)
+                        executor = _create_executor()
+                        future = executor.submit(
+                            _run_job, job_type, job_args, server_args,
+                            outputs_location)
+                    job_futures[server_args['job_id']] = future
+                future.add_done_callback(
+                    functools.partial(
+                        _job_finished, job_type, server_args,
+                        job_args.get('invest_model', '')))
 
 
 def main():
@@ -784,13 +2081,48 @@ def main():
     parser.add_argument('queue_host')
     parser.add_argument('queue_port')
     parser.add_argument('output_dir')
+    parser.add_argument(
+        '--slots', action='append', default=[], metavar='JOBTYPE=N',
+        help=('The most jobs of JOBTYPE that may run at the same time. '
+              'May be given once per job type.'))
+    parser.add_argument(
+        '--scenario-cache-mb', type=int,
+        default=SCENARIO_CACHE_MAX_BYTES // 2**20,
+        help='The upper bound on the size of the scenario LULC cache, in MB.')
+    parser.add_argument(
+        '--pool-slots', type=int, default=DEFAULT_POOL_SLOTS,
+        help='The number of jobs that may run at the same time.')
+    parser.add_argument(
+        '--interactive-slots', type=int, default=DEFAULT_INTERACTIVE_SLOTS,
+        help=('How many of the pool slots are reserved for quick, '
+              'interactive jobs like parcel stats and crops.'))
+    parser.add_argument(
+        '--lulc-block-cache-mb', type=int,
+        default=LULC_BLOCK_CACHE_MAX_BYTES // 2**20,
+        help=('Memory for decoded blocks of the base LULC, shared by the '
+              'pool processes, in MB. 0 disables the cache.'))
+    parser.add_argument(
+        '--lulc-sidecar', metavar='PATH',
+        help=('Read the base LULC from an uncompressed copy at PATH, '
+              'mapped into memory, instead of decoding it. The copy is '
+              'written at startup if it is missing or out of date.'))
+    parser.add_argument(
+        '--metrics-port', type=int,
+        help='Serve Prometheus metrics at /metrics on this port.')
 
     args = parser.parse_args()
     LOGGER.info(f'parser args: {args}')
     do_work(
         host=args.queue_host,
         port=args.queue_port,
-        outputs_location=args.output_dir
+        outputs_location=args.output_dir,
+        job_slots=_parse_job_slots(args.slots),
+        scenario_cache_max_bytes=args.scenario_cache_mb * 2**20,
+        metrics_port=args.metrics_port,
+        pool_slots=args.pool_slots,
+        interactive_slots=args.interactive_slots,
+        lulc_block_cache_max_bytes=args.lulc_block_cache_mb * 2**20,
+        lulc_sidecar_path=args.lulc_sidecar,
     )
 
 
@@ -207,6 +207,7 @@ export default function EditMenu(props) {
                           ))
                         }
                         scenarios={scenarios}
+                        sessionID={sessionID}
                         setInvestResults={setInvestResults}
                         setActiveTab={setActiveTab}
                       />
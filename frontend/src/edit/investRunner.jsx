@@ -1,19 +1,19 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 
 import {
   Button,
   ProgressBar,
 } from '@blueprintjs/core';
 
-import useInterval from '../hooks/useInterval';
+import useJobEvents from '../hooks/useJobEvents';
 import {
-  getJobStatus,
   runInvest,
 } from '../requests';
 
 export default function InvestRunner(props) {
   const {
     scenarios,
+    sessionID,
     setInvestResults,
     setActiveTab,
     completeResults,
@@ -23,25 +23,28 @@ export default function InvestRunner(props) {
   const [nJobs, setNJobs] = useState(null);
   const [progressState, setProgressState] = useState('success');
 
-  useInterval(async () => {
-    const statuses = await Promise.all(jobIDs.map((id) => getJobStatus(id)));
-    const pendingJobs = [];
-    statuses.forEach((status, idx) => {
-      if (['success', 'failed'].includes(status)) {
-        if (status === 'failed') {
-          setProgressState('warning');
-        }
-      } else {
-        pendingJobs.push(jobIDs[idx]);
-      }
-    });
-    setProgress((nJobs - pendingJobs.length) / nJobs);
-    setJobIDs(pendingJobs);
-    if (!pendingJobs.length) {
+  useJobEvents((id, status) => {
+    if (!jobIDs.includes(id) || ['pending', 'running'].includes(status)) {
+      return;
+    }
+    if (status === 'failed') {
+      setProgressState('warning');
+    }
+    // Several jobs may finish before the next render.
+    setJobIDs((ids) => ids.filter((jid) => jid !== id));
+  }, sessionID, jobIDs.length > 0);
+
+  useEffect(() => {
+    if (!nJobs) {
+      return;
+    }
+    setProgress((nJobs - jobIDs.length) / nJobs);
+    if (!jobIDs.length) {
+      setNJobs(null);
       setInvestResults();
       setActiveTab('results');
     }
-  }, (jobIDs.length) ? 3000 : null);
+  }, [jobIDs]);
 
   const handleClick = async () => {
     setProgressState('success');
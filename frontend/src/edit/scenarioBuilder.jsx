@@ -6,14 +6,14 @@ import {
   Spinner,
 } from '@blueprintjs/core';
 
-import useInterval from '../hooks/useInterval';
+import useJobEvents from '../hooks/useJobEvents';
 import WallpaperingMenu from './wallpaperingMenu';
 import LulcMenu from './lulcMenu';
 import {
   createScenario,
-  getJobStatus,
   lulcFill,
   lulcCrop,
+  lulcCropAndModify,
   lulcWallpaper,
 } from '../requests';
 
@@ -36,34 +36,45 @@ export default function ScenarioBuilder(props) {
   const [selectedPattern, setSelectedPattern] = useState(null);
   const [jobID, setJobID] = useState(null);
 
-  useInterval(async () => {
-    // There are sometimes two jobs submitted concurrently.
-    // They are in a priority queue, so for now monitor the lower priority one.
-    const status = await getJobStatus(jobID);
-    if (status === 'success') {
+  useJobEvents((id, status) => {
+    if (id === jobID && status === 'success') {
       refreshScenarios();
       setJobID(null);
     }
-  }, (jobID && scenarioID) ? 1000 : null);
+  }, sessionID, Boolean(jobID && scenarioID));
 
   const submitScenario = async (event) => {
     event.preventDefault();
+    let modification;
+    if (conversionOption === 'wallpaper' && selectedPattern) {
+      modification = { patternID: selectedPattern.pattern_id };
+    }
+    if (conversionOption === 'fill' && Number.isInteger(singleLULC)) {
+      modification = { lulcCode: singleLULC };
+    }
+    let baselineScenarioID;
     if (!scenarioNames.includes('baseline')) {
-      const sid = await createScenario(activeStudyAreaID, 'baseline', 'crop');
-      await lulcCrop(sid);
+      baselineScenarioID = await createScenario(
+        activeStudyAreaID, 'baseline', 'crop');
+      if (!modification) {
+        await lulcCrop(baselineScenarioID);
+      }
     }
     const currentScenarioID = await createScenario(
       activeStudyAreaID, scenarioName, conversionOption);
     setScenarioID(currentScenarioID);
     let jid;
-    if (conversionOption === 'wallpaper' && selectedPattern) {
+    if (baselineScenarioID && modification) {
+      // Create the baseline and the new scenario from one read of the LULC.
+      jid = await lulcCropAndModify(
+        baselineScenarioID, currentScenarioID, modification);
+    } else if (modification && conversionOption === 'wallpaper') {
       jid = await lulcWallpaper(
-        selectedPattern.pattern_id,
+        modification.patternID,
         currentScenarioID
       );
-    }
-    if (conversionOption === 'fill' && Number.isInteger(singleLULC)) {
-      jid = await lulcFill(singleLULC, currentScenarioID);
+    } else if (modification) {
+      jid = await lulcFill(modification.lulcCode, currentScenarioID);
     }
     setJobID(jid);
   };
@@ -14,9 +14,8 @@ import {
 import {
   getPatterns,
   createPattern,
-  getJobStatus,
 } from '../requests';
-import useInterval from '../hooks/useInterval';
+import useJobEvents from '../hooks/useJobEvents';
 import { publicUrl } from '../utils';
 
 export default function WallpaperingMenu(props) {
@@ -53,17 +52,15 @@ export default function WallpaperingMenu(props) {
     })();
   }, []);
 
-  useInterval(async () => {
-    console.log('checking status for job', jobID);
-    const status = await getJobStatus(jobID);
-    if (status === 'success') {
+  useJobEvents(async (id, status) => {
+    if (id === jobID && status === 'success') {
+      setJobID(null);
       const ptrns = await updatePatterns();
       setSelectedPattern(
         ptrns.filter((pattern) => pattern.pattern_id === patternID)[0],
       );
-      setJobID(null);
     }
-  }, (jobID && patternID) ? 500 : null);
+  }, sessionID, Boolean(jobID && patternID));
 
   const handleSamplePattern = async (event) => {
     event.preventDefault();
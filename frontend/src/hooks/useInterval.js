@@ -1,20 +0,0 @@
-import React, { useEffect, useRef } from 'react';
-
-// https://overreacted.io/making-setinterval-declarative-with-react-hooks/
-export default function useInterval(callback, delay) {
-  const savedCallback = useRef();
-
-  useEffect(() => {
-    savedCallback.current = callback;
-  }, [callback]);
-
-  useEffect(() => {
-    function tick() {
-      savedCallback.current();
-    }
-    if (delay !== null) {
-      let id = setInterval(tick, delay);
-      return () => clearInterval(id);
-    }
-  }, [delay]);
-}
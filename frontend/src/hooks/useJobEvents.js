@@ -0,0 +1,24 @@
+import { useEffect, useRef } from 'react';
+
+import { subscribeJobEvents } from '../requests';
+
+// Call `callback(jobID, status)` each time one of the session's jobs,
+// or one of `jobIDs` from any session, changes status, for as long as
+// `enabled` is true.
+export default function useJobEvents(callback, sessionID, enabled, jobIDs = []) {
+  const savedCallback = useRef();
+
+  useEffect(() => {
+    savedCallback.current = callback;
+  }, [callback]);
+
+  useEffect(() => {
+    if (sessionID && enabled) {
+      return subscribeJobEvents(
+        sessionID,
+        (jobID, status) => savedCallback.current(jobID, status),
+        jobIDs,
+      );
+    }
+  }, [sessionID, enabled, jobIDs.join(',')]);
+}
@@ -4,9 +4,8 @@ import {
   Button,
 } from '@blueprintjs/core';
 
-import useInterval from '../hooks/useInterval';
+import useJobEvents from '../hooks/useJobEvents';
 import {
-  getJobStatus,
   addParcel,
 } from '../requests';
 
@@ -22,16 +21,15 @@ export default function ParcelControl(props) {
 
   const [jobID, setJobID] = useState(null);
 
-  useInterval(async () => {
-    const status = await getJobStatus(jobID);
+  useJobEvents((id, status) => {
     // We don't care about success vs failure, either way stop requesting
     // new study area data. Other components handle the missing data 
     // that comes from failure.
-    if (!['pending', 'running'].includes(status)) {
+    if (id === jobID && !['pending', 'running'].includes(status)) {
       setJobID(null);
       refreshStudyArea();
     }
-  }, (jobID) ? 200 : null); // This server operation should be quick
+  }, sessionID, Boolean(jobID), jobID ? [jobID] : []);
 
   const handleClick = async (parcel) => {
     const jid = await addParcel(
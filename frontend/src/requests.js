@@ -170,6 +170,30 @@ export async function getJobStatus(jobID) {
   );
 }
 
+/**
+ * Follow the status of a session's jobs as the server reports changes.
+ *
+ * When the stream (re)connects, the server first reports the current status
+ * of each of the session's jobs.
+ *
+ * @param  {string} sessionID - id of the session whose jobs to follow
+ * @param  {function} onStatus - called with (jobID, status) on each change
+ * @param  {Array} jobIDs - ids of other jobs to follow, whatever session
+ *                          owns them
+ * @return {function} call to close the stream
+ */
+export function subscribeJobEvents(sessionID, onStatus, jobIDs = []) {
+  const query = jobIDs.map((id) => `job_ids=${id}`).join('&');
+  const source = new EventSource(
+    `${apiBaseURL}/events/${sessionID}${query ? `?${query}` : ''}`
+  );
+  source.addEventListener('job', (event) => {
+    const data = JSON.parse(event.data);
+    onStatus(data.job_id, data.status);
+  });
+  return () => source.close();
+}
+
 /**
  * Apply a wallpaper pattern to a given polygon.
  *
@@ -237,6 +261,37 @@ export async function lulcCrop(scenarioID) {
   );
 }
 
+/**
+ * Crop the LULC to create a 'baseline' scenario, and fill or wallpaper the
+ * same study area to create another scenario, in one job.
+ *
+ * @param  {integer} baselineScenarioID - id of the 'baseline' scenario
+ * @param  {integer} scenarioID - id of the scenario to associate with the
+ *  lulc modification
+ * @param  {object} modification - either {lulcCode} to fill the study area
+ *  or {patternID} to wallpaper it
+ * @return {integer} id of the job that will create both LULC rasters
+ */
+export async function lulcCropAndModify(
+  baselineScenarioID, scenarioID, modification
+) {
+  return (
+    window.fetch(`${apiBaseURL}/lulc_crop_and_modify`, {
+      method: 'post',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        baseline_scenario_id: baselineScenarioID,
+        scenario_id: scenarioID,
+        lulc_class: modification.lulcCode,
+        pattern_id: modification.patternID,
+      }),
+    })
+      .then((response) => response.json())
+      .then((json) => json.job_id)
+      .catch((error) => console.log(error))
+  );
+}
+
 /**
  * Add parcel to a study area.
  */
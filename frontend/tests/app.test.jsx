@@ -24,6 +24,7 @@ vi.mock('../src/requests', () => {
     getStudyAreas: () => [STUDY_AREA],
     getScenarios: () => SCENARIOS,
     getJobStatus: () => 'success',
+    subscribeJobEvents: () => () => {},
     runInvest: () => JOBS,
     getInvestResults: () => INVEST_RESULT,
     getPatterns: () => null,
@@ -1,15 +1,17 @@
 """CRUD: Create, Read, Update, and Delete"""
 import asyncio
+import hashlib
 import json
 import logging
 import sys
 import time
 import uuid
 from collections import Counter
+from datetime import datetime, timedelta
 
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import exc
+from sqlalchemy import and_, case, exc, func, or_
 
 from . import models
 from . import schemas
@@ -25,6 +27,22 @@ LOGGER = logging.getLogger(__name__)
 
 STATUS_SUCCESS = "success"
 STATUS_FAIL = "fail"
+# Job status set when a worker leases the job, and reset when its lease
+# expires.
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_CANCELLED = "cancelled"
+
+# How many times to retry leasing when another process claims the same job
+# between our read and our update.
+LEASE_ATTEMPTS = 5
+# Jobs are either interactive (quick, and someone is waiting on them in the
+# UI) or batch.
+JOB_CLASS_INTERACTIVE = "interactive"
+JOB_CLASS_BATCH = "batch"
+# A job gains one level of priority for each this many seconds it waits, so
+# that low priority jobs are never starved.
+PRIORITY_AGING_S = 5 * 60
 
 # By creating functions that are only dedicated to interacting with the
 # database (get a user or an item) independent of your path operation function,
@@ -128,7 +146,8 @@ def get_scenarios(db: Session, study_area_id: int):
             models.Scenario.study_area_id == study_area_id).all()
 
 
-def update_scenario(db: Session, scenario: schemas.Scenario, scenario_id: int):
+def update_scenario(db: Session, scenario: schemas.Scenario, scenario_id: int,
+                    commit: bool = True):
     """Update a scenario."""
     db_scenario = get_scenario(db, scenario_id)
     if not db_scenario:
@@ -138,8 +157,9 @@ def update_scenario(db: Session, scenario: schemas.Scenario, scenario_id: int):
         setattr(db_scenario, key, value)
 
     db.add(db_scenario)
-    db.commit()
-    db.refresh(db_scenario)
+    if commit:
+        db.commit()
+        db.refresh(db_scenario)
     return STATUS_SUCCESS
 
 def delete_scenario(db: Session, scenario_id: int):
@@ -154,10 +174,12 @@ def delete_scenario(db: Session, scenario_id: int):
     return STATUS_SUCCESS
 
 
-def create_parcel_stats(db: Session, parcel_id: int, parcel_wkt: str, job_id: int):
+def create_parcel_stats(db: Session, parcel_id: int, parcel_wkt: str,
+                        job_id: int, lulc_stats: str = None):
     """Create a stats entry in parcel stats table."""
     db_parcel_stats = models.ParcelStats(
-        parcel_id=parcel_id, target_parcel_wkt=parcel_wkt, job_id=job_id)
+        parcel_id=parcel_id, target_parcel_wkt=parcel_wkt, job_id=job_id,
+        lulc_stats=lulc_stats)
     db.add(db_parcel_stats)
     db.commit()
     db.refresh(db_parcel_stats)
@@ -208,8 +230,28 @@ def get_parcel_stats_by_id(db: Session, id: int):
             models.ParcelStats.parcel_id == id).first()
 
 
+def get_base_parcel_stats(db: Session, parcel_id: int, lulc_version: str):
+    """Read the precomputed stats of a parcel on a version of the base LULC."""
+    return db.query(models.BaseParcelStats).filter(
+            models.BaseParcelStats.parcel_id == parcel_id,
+            models.BaseParcelStats.lulc_version == lulc_version).first()
+
+
+def put_base_parcel_stats(
+        db: Session, parcel_stats: schemas.BaseParcelStatsRequest):
+    """Add or replace precomputed stats of parcels on the base LULC."""
+    for parcel in parcel_stats.parcels:
+        db.merge(models.BaseParcelStats(
+            parcel_id=parcel.parcel_id,
+            lulc_version=parcel_stats.lulc_version,
+            lulc_stats=json.dumps(parcel.lulc_stats)))
+    db.commit()
+    return STATUS_SUCCESS
+
+
 def update_parcel_stats(
-        db: Session, parcel_stats: schemas.ParcelStatsUpdate, stats_id: int):
+        db: Session, parcel_stats: schemas.ParcelStatsUpdate, stats_id: int,
+        commit: bool = True):
     """Update a parcel stats entry."""
     db_stats = get_parcel_stats(db, stats_id)
 
@@ -220,8 +262,9 @@ def update_parcel_stats(
         setattr(db_stats, key, value)
 
     db.add(db_stats)
-    db.commit()
-    db.refresh(db_stats)
+    if commit:
+        db.commit()
+        db.refresh(db_stats)
     return STATUS_SUCCESS
 
 def create_job(db: Session, session_id: str, job: schemas.JobBase):
@@ -240,8 +283,37 @@ def get_jobs(db: Session, skip: int = 0, limit: int = 100):
     """Read multiple jobs from the table."""
     return db.query(models.Job).offset(skip).limit(limit).all()
 
-def update_job(db: Session, job: schemas.Job, job_id: int):
-    """Update job entry in jobs table."""
+def get_jobs_by_id(db: Session, job_ids: list[int]):
+    """Read the jobs with the given ``job_ids``."""
+    return db.query(models.Job).filter(models.Job.job_id.in_(job_ids)).all()
+
+def get_session_job_statuses(db: Session, session_id: str,
+                             job_ids: list[int], after_job_id: int,
+                             watched_job_ids: list[int] = ()):
+    """Read the status of a session's jobs.
+
+    Args:
+        watched_job_ids: jobs to include whichever session owns them.
+
+    Returns:
+        A list of ``(job_id, status)`` for the session's jobs that are in
+        ``job_ids`` or were created after ``after_job_id``, and for the
+        ``watched_job_ids``.
+    """
+    return db.query(models.Job.job_id, models.Job.status).filter(
+        or_(and_(models.Job.owner_id == session_id,
+                 or_(models.Job.job_id.in_(job_ids),
+                     models.Job.job_id > after_job_id)),
+            models.Job.job_id.in_(list(watched_job_ids)))).all()
+
+def update_job(db: Session, job: schemas.Job, job_id: int,
+               commit: bool = True):
+    """Update job entry in jobs table.
+
+    Like the other ``update_*`` functions, pass ``commit=False`` to leave the
+    change in the current transaction so several updates can be committed
+    together.
+    """
     db_job = get_job(db, job_id)
 
     if not db_job:
@@ -251,10 +323,515 @@ def update_job(db: Session, job: schemas.Job, job_id: int):
         setattr(db_job, key, value)
 
     db.add(db_job)
+    if commit:
+        db.commit()
+        db.refresh(db_job)
+    return STATUS_SUCCESS
+
+def record_job_metrics(db: Session, job_id: int, metrics: dict = None,
+                       commit: bool = True):
+    """Store when a finished job ran and what it cost.
+
+    Args:
+        metrics: as reported by the worker, with ``started_at`` and
+            ``finished_at`` as Unix timestamps, ``timings`` in seconds per
+            stage and ``peak_rss_bytes``. Any of these may be missing, in
+            which case the job is recorded as finished now.
+    """
+    db_job = get_job(db, job_id)
+    if not db_job:
+        raise HTTPException(status_code=404, detail="job not found")
+    if metrics is None:
+        metrics = {}
+
+    if metrics.get('started_at') is not None:
+        db_job.started_at = datetime.utcfromtimestamp(metrics['started_at'])
+    if metrics.get('finished_at') is not None:
+        db_job.finished_at = datetime.utcfromtimestamp(
+            metrics['finished_at'])
+    else:
+        db_job.finished_at = datetime.utcnow()
+    if metrics.get('timings') is not None:
+        db_job.timings = json.dumps(metrics['timings'])
+    db_job.peak_rss_bytes = metrics.get('peak_rss_bytes')
+
+    db.add(db_job)
+    if commit:
+        db.commit()
+        db.refresh(db_job)
+    return STATUS_SUCCESS
+
+# The server_attrs of a worker task that say where the worker writes its
+# result; jobs that write to different places are never coalesced.
+RESULT_TARGET_ATTRS = ('scenario_id', 'baseline_scenario_id')
+
+def job_fingerprint(worker_task: dict):
+    """Hash the parts of a worker task that determine its result.
+
+    Scenario jobs write the scenario's LULC to a file of that scenario, so
+    the scenarios are part of the fingerprint: a job coalesced into a job
+    on another scenario would point at a file that a later job on that
+    scenario overwrites. The worker's scenario LULC cache still saves
+    building the same LULC twice.
+    """
+    targets = {
+        key: worker_task['server_attrs'][key]
+        for key in RESULT_TARGET_ATTRS if key in worker_task['server_attrs']}
+    return hashlib.sha256(json.dumps(
+        [worker_task['job_type'], worker_task['job_args'], targets],
+        sort_keys=True).encode('utf-8')).hexdigest()
+
+def enqueue_job(db: Session, job_id: int, priority: int, worker_task: dict,
+                scenario_id: int = None, operation: str = None,
+                blocked_by: int = None, baseline_scenario_id: int = None):
+    """Add a worker task to the job queue table.
+
+    If an identical task is already pending or running, the new job is
+    coalesced into it rather than queued to run a second time.
+
+    Args:
+        scenario_id: the scenario the job works on, if any.
+        operation: what the job does to the scenario. See
+            ``supersede_jobs``.
+        blocked_by: the job that must succeed before this one is leased.
+            See ``unblock_job``.
+        baseline_scenario_id: the other scenario the job builds the LULC
+            of, if any.
+    """
+    fingerprint = job_fingerprint(worker_task)
+    in_flight = db.query(models.QueuedJob).filter(
+        models.QueuedJob.fingerprint == fingerprint,
+        models.QueuedJob.coalesced_into.is_(None)).first()
+    coalesced_into = None
+    if in_flight is not None:
+        LOGGER.info(f'job {job_id} is identical to job {in_flight.job_id}')
+        coalesced_into = in_flight.job_id
+
+    db_queued_job = models.QueuedJob(
+        job_id=job_id,
+        priority=priority,
+        job_type=worker_task['job_type'],
+        owner_id=db.query(models.Job.owner_id).filter(
+            models.Job.job_id == job_id).scalar(),
+        payload=json.dumps(worker_task),
+        fingerprint=fingerprint,
+        coalesced_into=coalesced_into,
+        scenario_id=scenario_id,
+        baseline_scenario_id=baseline_scenario_id,
+        operation=operation,
+        blocked_by=blocked_by)
+    db.add(db_queued_job)
+    db.query(models.Job).filter(models.Job.job_id == job_id).update({
+        models.Job.job_type: worker_task['job_type'],
+        models.Job.enqueued_at: datetime.utcnow(),
+    }, synchronize_session=False)
     db.commit()
-    db.refresh(db_job)
+    db.refresh(db_queued_job)
+    return db_queued_job
+
+def get_coalesced_jobs(db: Session, job_id: int):
+    """Read the queued jobs that are waiting on the result of ``job_id``."""
+    return db.query(models.QueuedJob).filter(
+        models.QueuedJob.coalesced_into == job_id).order_by(
+            models.QueuedJob.job_id).all()
+
+def cancel_job(db: Session, job_id: int, commit: bool = True):
+    """Cancel a job that has not finished.
+
+    The job is taken off the queue. If it is leased, the worker learns
+    from its next heartbeat that the lease is gone, and the job's result is
+    ignored. Jobs that were coalesced into the cancelled job still need its
+    result, so:
+
+    * if it is leased, it keeps running for them, but its result is only
+      applied to them.
+    * if it is not leased yet, the oldest of them takes its place in the
+      queue.
+
+    Returns:
+        ``True`` if the job was cancelled, or ``False`` if it had already
+        finished.
+    """
+    db_job = get_job(db, job_id)
+    if not db_job:
+        raise HTTPException(status_code=404, detail="job not found")
+    if db_job.status not in (JOB_STATUS_PENDING, JOB_STATUS_RUNNING):
+        return False
+
+    queued_job = get_queued_job(db, job_id)
+    if queued_job is not None:
+        followers = get_coalesced_jobs(db, job_id)
+        if not followers:
+            dequeue_job(db, job_id, commit=False)
+        elif queued_job.lease_owner is None:
+            LOGGER.info(
+                f'job {followers[0].job_id} replaces cancelled job {job_id}')
+            dequeue_job(db, job_id, commit=False)
+            db.query(models.QueuedJob).filter(
+                models.QueuedJob.coalesced_into == job_id).update({
+                    models.QueuedJob.coalesced_into: followers[0].job_id,
+                }, synchronize_session=False)
+            db.query(models.QueuedJob).filter(
+                models.QueuedJob.job_id == followers[0].job_id).update({
+                    models.QueuedJob.coalesced_into: None,
+                }, synchronize_session=False)
+
+    db.query(models.Job).filter(models.Job.job_id == job_id).update({
+        models.Job.status: JOB_STATUS_CANCELLED,
+        models.Job.finished_at: datetime.utcnow(),
+    }, synchronize_session=False)
+    # Jobs waiting on this one will never be released.
+    for blocked in get_blocked_jobs(db, [job_id]):
+        cancel_job(db, blocked.job_id, commit=False)
+    if commit:
+        db.commit()
+    return True
+
+def get_scenario_build_job_id(db: Session, scenario_id: int,
+                              job_types: list[str]):
+    """Find the unfinished job that is building a scenario's LULC.
+
+    The scenario may be the job's own scenario or its baseline.
+
+    Args:
+        job_types: the types of job that build a scenario's LULC.
+
+    Returns:
+        The id of the newest such job, or ``None`` if there is none.
+    """
+    return db.query(models.QueuedJob.job_id).join(
+        models.Job, models.Job.job_id == models.QueuedJob.job_id).filter(
+            or_(models.QueuedJob.scenario_id == scenario_id,
+                models.QueuedJob.baseline_scenario_id == scenario_id),
+            models.QueuedJob.job_type.in_(job_types),
+            models.Job.status.in_(
+                [JOB_STATUS_PENDING, JOB_STATUS_RUNNING])).order_by(
+                    models.QueuedJob.job_id.desc()).limit(1).scalar()
+
+def get_blocked_jobs(db: Session, job_ids: list[int]):
+    """Read the queued jobs that are waiting on any of ``job_ids``."""
+    return db.query(models.QueuedJob).filter(
+        models.QueuedJob.blocked_by.in_(job_ids)).order_by(
+            models.QueuedJob.job_id).all()
+
+def unblock_job(db: Session, job_id: int, worker_task: dict,
+                commit: bool = True):
+    """Make a blocked job available to lease.
+
+    Args:
+        worker_task: the task to hand to the worker, which may now include
+            the result of the job it was waiting on.
+    """
+    db.query(models.QueuedJob).filter(
+        models.QueuedJob.job_id == job_id).update({
+            models.QueuedJob.payload: json.dumps(worker_task),
+            models.QueuedJob.fingerprint: job_fingerprint(worker_task),
+            models.QueuedJob.blocked_by: None,
+        }, synchronize_session=False)
+    if commit:
+        db.commit()
+
+def supersede_jobs(db: Session, scenario_ids: list[int], operation: str,
+                   fingerprint: str = None, commit: bool = True):
+    """Cancel the queued or running jobs of an operation on scenarios.
+
+    This is called before queueing a newer job for the same operation on
+    ``scenario_ids``, whose result would overwrite theirs. A job that also
+    builds the LULC of a baseline scenario is only cancelled if the baseline
+    is one of ``scenario_ids`` too, since otherwise the newer job would not
+    rebuild it.
+
+    Args:
+        fingerprint: the ``job_fingerprint`` of the newer job. Jobs with
+            the same fingerprint are not cancelled, since the newer job is
+            coalesced into them (see ``enqueue_job``).
+
+    Returns:
+        The ids of the cancelled jobs.
+    """
+    superseded = db.query(models.QueuedJob.job_id).filter(
+        models.QueuedJob.scenario_id.in_(scenario_ids),
+        or_(models.QueuedJob.baseline_scenario_id.is_(None),
+            models.QueuedJob.baseline_scenario_id.in_(scenario_ids)),
+        models.QueuedJob.operation == operation)
+    if fingerprint is not None:
+        superseded = superseded.filter(
+            models.QueuedJob.fingerprint != fingerprint)
+    cancelled_job_ids = [
+        job_id for job_id, in superseded.all()
+        if cancel_job(db, job_id, commit=False)]
+    if commit:
+        db.commit()
+    return cancelled_job_ids
+
+def cancel_scenario_jobs(db: Session, scenario_ids: list[int],
+                         commit: bool = True):
+    """Cancel every queued or running job on the given scenarios.
+
+    This includes the jobs that build the LULC of one of the scenarios as
+    their baseline.
+
+    Returns:
+        The ids of the cancelled jobs.
+    """
+    queued = db.query(models.QueuedJob.job_id).filter(
+        or_(models.QueuedJob.scenario_id.in_(scenario_ids),
+            models.QueuedJob.baseline_scenario_id.in_(scenario_ids))).all()
+    cancelled_job_ids = [
+        job_id for job_id, in queued if cancel_job(db, job_id, commit=False)]
+    if commit:
+        db.commit()
+    return cancelled_job_ids
+
+def _fair_share_order(queued_job: models.QueuedJob, now: datetime,
+                      leased_by_owner: Counter, job_classes: dict):
+    """Sort key that orders queued jobs by the order they should be leased.
+
+    Jobs go by priority, raised by one level for every ``PRIORITY_AGING_S``
+    they have waited. Within a priority, interactive jobs go before batch
+    jobs, then the job of the session with the fewest jobs already leased
+    goes first, so one session queueing many jobs can't hold up everyone
+    else. Ties go to the oldest job.
+    """
+    waited_s = (now - queued_job.enqueued_at).total_seconds()
+    aged_priority = queued_job.priority - int(waited_s // PRIORITY_AGING_S)
+    is_batch = job_classes.get(queued_job.job_type) != JOB_CLASS_INTERACTIVE
+    return (aged_priority, is_batch, leased_by_owner[queued_job.owner_id],
+            queued_job.job_id)
+
+def _has_lease_capacity(queued_job: models.QueuedJob, capacity: dict,
+                        job_classes: dict, class_capacity: dict):
+    """Whether ``lease_jobs`` has room left for a job of this type."""
+    if capacity is not None and capacity.get(queued_job.job_type, 0) <= 0:
+        return False
+    job_class = job_classes.get(queued_job.job_type, JOB_CLASS_BATCH)
+    if class_capacity is not None and class_capacity.get(job_class, 0) <= 0:
+        return False
+    return True
+
+def lease_jobs(db: Session, worker_id: str, lease_duration_s: float,
+               capacity: dict[str, int] = None, max_jobs: int = 1,
+               job_classes: dict[str, str] = None,
+               class_capacity: dict[str, int] = None):
+    """Lease the next jobs that no worker holds yet, in fair-share order.
+
+    See ``_fair_share_order`` for how the next job is chosen. Each lease
+    is claimed with a conditional UPDATE so that two API processes reading
+    the same candidate can never both hand it out. The leased jobs, and any
+    jobs coalesced into them, are marked as running. All leases are
+    committed together.
+
+    The candidates and the number of jobs leased to each session are read
+    once, then kept up to date as jobs are claimed, so a call costs the
+    same few queries however long the queue is.
+
+    Args:
+        capacity: if given, a dict mapping job types to the most jobs of
+            that type to lease. Jobs of other types are not leased.
+        max_jobs: the most jobs to lease in total.
+        job_classes: a dict mapping job types to ``JOB_CLASS_INTERACTIVE``
+            or ``JOB_CLASS_BATCH``. Types that are not listed are batch.
+        class_capacity: if given, a dict mapping job classes to the most
+            jobs of that class to lease.
+
+    Returns:
+        A list of the leased ``models.QueuedJob``, which may be empty.
+    """
+    if capacity is not None:
+        capacity = dict(capacity)
+    if job_classes is None:
+        job_classes = {}
+    if class_capacity is not None:
+        class_capacity = dict(class_capacity)
+
+    query = db.query(models.QueuedJob).filter(
+        models.QueuedJob.lease_owner.is_(None),
+        models.QueuedJob.coalesced_into.is_(None),
+        models.QueuedJob.blocked_by.is_(None))
+    if capacity is not None:
+        job_types = [
+            job_type for job_type, n_jobs in capacity.items() if n_jobs > 0]
+        query = query.filter(models.QueuedJob.job_type.in_(job_types))
+    candidates = [
+        queued_job for queued_job in query.all() if _has_lease_capacity(
+            queued_job, capacity, job_classes, class_capacity)]
+    leased_by_owner = Counter()
+    if candidates:
+        leased_by_owner.update(dict(db.query(
+            models.QueuedJob.owner_id,
+            func.count(models.QueuedJob.job_id)).filter(
+                models.QueuedJob.lease_owner.isnot(None)).group_by(
+                    models.QueuedJob.owner_id).all()))
+    now = datetime.utcnow()
+    leased = []
+    n_conflicts = 0
+    while len(leased) < max_jobs and n_conflicts < LEASE_ATTEMPTS:
+        candidates = [
+            queued_job for queued_job in candidates if _has_lease_capacity(
+                queued_job, capacity, job_classes, class_capacity)]
+        if not candidates:
+            break
+        candidate = min(candidates, key=lambda queued_job: _fair_share_order(
+            queued_job, now, leased_by_owner, job_classes))
+        candidates.remove(candidate)
+
+        n_claimed = db.query(models.QueuedJob).filter(
+            models.QueuedJob.job_id == candidate.job_id,
+            models.QueuedJob.lease_owner.is_(None)).update({
+                models.QueuedJob.lease_owner: worker_id,
+                models.QueuedJob.lease_expiry: (
+                    datetime.utcnow() + timedelta(seconds=lease_duration_s)),
+                models.QueuedJob.attempts: (
+                    func.coalesce(models.QueuedJob.attempts, 0) + 1),
+            }, synchronize_session=False)
+        if not n_claimed:
+            LOGGER.debug(
+                f'job {candidate.job_id} was leased elsewhere; skipping it')
+            n_conflicts += 1
+            continue
+        leased.append(candidate)
+        leased_by_owner[candidate.owner_id] += 1
+        if capacity is not None:
+            capacity[candidate.job_type] -= 1
+        if class_capacity is not None:
+            class_capacity[job_classes.get(
+                candidate.job_type, JOB_CLASS_BATCH)] -= 1
+    if leased:
+        _update_jobs_and_followers(
+            db, [queued_job.job_id for queued_job in leased], {
+                models.Job.status: JOB_STATUS_RUNNING,
+                models.Job.leased_at: datetime.utcnow(),
+            })
+    db.commit()
+    for queued_job in leased:
+        db.refresh(queued_job)
+    return leased
+
+def _update_jobs_and_followers(db: Session, job_ids: list[int], values: dict):
+    """Update the jobs, and any jobs coalesced into them, without committing.
+
+    Cancelled jobs are left as they are.
+    """
+    follower_job_ids = db.query(models.QueuedJob.job_id).filter(
+        models.QueuedJob.coalesced_into.in_(job_ids))
+    db.query(models.Job).filter(
+        or_(models.Job.job_id.in_(job_ids),
+            models.Job.job_id.in_(follower_job_ids)),
+        models.Job.status != JOB_STATUS_CANCELLED).update(
+            values, synchronize_session=False)
+
+def renew_leases(db: Session, worker_id: str, job_ids: list[int],
+                 lease_duration_s: float):
+    """Extend the leases that a worker holds on jobs.
+
+    Returns:
+        The ids of the jobs whose leases were renewed. The worker no longer
+        holds the others, because they expired and were re-queued or
+        failed, or because they were cancelled.
+    """
+    held = db.query(models.QueuedJob).filter(
+        models.QueuedJob.job_id.in_(job_ids),
+        models.QueuedJob.lease_owner == worker_id)
+    held.update({
+        models.QueuedJob.lease_expiry: (
+            datetime.utcnow() + timedelta(seconds=lease_duration_s)),
+    }, synchronize_session=False)
+    db.commit()
+    return [queued_job.job_id for queued_job in held.all()]
+
+def get_expired_leases(db: Session):
+    """Read the leased jobs whose worker has stopped renewing the lease."""
+    return db.query(models.QueuedJob).filter(
+        models.QueuedJob.lease_expiry < datetime.utcnow()).all()
+
+def release_lease(db: Session, queued_job: models.QueuedJob,
+                  commit: bool = True):
+    """Put a job with an expired lease back on the queue.
+
+    The job, and any jobs coalesced into it, are marked as pending again.
+
+    Returns:
+        ``True`` if the job was released, or ``False`` if another process
+        released or renewed it first.
+    """
+    n_released = db.query(models.QueuedJob).filter(
+        models.QueuedJob.job_id == queued_job.job_id,
+        models.QueuedJob.lease_expiry == queued_job.lease_expiry).update({
+            models.QueuedJob.lease_owner: None,
+            models.QueuedJob.lease_expiry: None,
+        }, synchronize_session=False)
+    if n_released:
+        _update_jobs_and_followers(db, [queued_job.job_id], {
+            models.Job.status: JOB_STATUS_PENDING,
+            models.Job.leased_at: None,
+        })
+    if commit:
+        db.commit()
+    return bool(n_released)
+
+def get_queued_job(db: Session, job_id: int):
+    """Read a job's row in the job queue table, if it is still queued."""
+    return db.query(models.QueuedJob).filter(
+        models.QueuedJob.job_id == job_id).first()
+
+def dequeue_job(db: Session, job_id: int, commit: bool = True):
+    """Remove a finished job from the job queue table."""
+    db.query(models.QueuedJob).filter(
+        models.QueuedJob.job_id == job_id).delete(synchronize_session=False)
+    if commit:
+        db.commit()
     return STATUS_SUCCESS
 
+def get_queue_depths(db: Session):
+    """Count the jobs waiting to be leased, by priority.
+
+    Returns:
+        A list of ``(priority, n_jobs, oldest_enqueued_at)``.
+    """
+    return db.query(
+        models.QueuedJob.priority,
+        func.count(models.QueuedJob.job_id),
+        func.min(models.QueuedJob.enqueued_at)).filter(
+            models.QueuedJob.lease_owner.is_(None),
+            models.QueuedJob.coalesced_into.is_(None),
+            models.QueuedJob.blocked_by.is_(None)).group_by(
+                models.QueuedJob.priority).all()
+
+def get_leased_job_count(db: Session):
+    """Count the jobs that workers are running."""
+    return db.query(func.count(models.QueuedJob.job_id)).filter(
+        models.QueuedJob.lease_owner.isnot(None)).scalar()
+
+def get_job_duration_histograms(db: Session, start_column, end_column,
+                                buckets: list[float]):
+    """Summarize the time between two of each job's timestamps by job type.
+
+    The summary is computed by the db in one pass over the jobs table.
+
+    Args:
+        start_column: the ``models.Job`` column where the interval starts.
+        end_column: the ``models.Job`` column where the interval ends.
+        buckets: upper bounds, in seconds, to count the durations under.
+
+    Returns:
+        A list of ``(job_type, bucket_counts, count, total_seconds)``.
+    """
+    # julianday() is in days and SQLite has no interval type.
+    duration_s = (
+        func.julianday(end_column) - func.julianday(start_column)) * 86400
+    bucket_sums = [
+        func.sum(case((duration_s <= upper_bound, 1), else_=0))
+        for upper_bound in buckets]
+    rows = db.query(
+        models.Job.job_type, func.count(models.Job.job_id),
+        func.sum(duration_s), *bucket_sums).filter(
+            models.Job.job_type.isnot(None),
+            start_column.isnot(None),
+            end_column.isnot(None)).group_by(models.Job.job_type).all()
+    return [
+        (job_type, list(bucket_counts), count, total_seconds)
+        for job_type, count, total_seconds, *bucket_counts in rows]
+
 def create_pattern(db: Session, session_id: str, pattern: schemas.Pattern):
     """Create a pattern."""
     db_pattern = models.Pattern(**pattern.dict(), owner_id=session_id)
@@ -277,7 +854,8 @@ def get_patterns(db: Session):
             models.Pattern.pattern_thumbnail_path.is_not(None)).all()
 
 def update_pattern(
-        db: Session, pattern: schemas.PatternUpdate, pattern_id: int):
+        db: Session, pattern: schemas.PatternUpdate, pattern_id: int,
+        commit: bool = True):
     """Update a patterns entry."""
     db_pattern = get_pattern(db, pattern_id)
 
@@ -288,8 +866,9 @@ def update_pattern(
         setattr(db_pattern, key, value)
 
     db.add(db_pattern)
-    db.commit()
-    db.refresh(db_pattern)
+    if commit:
+        db.commit()
+        db.refresh(db_pattern)
     return STATUS_SUCCESS
 
 def create_invest_result(db: Session, invest_result: schemas.InvestResult):
@@ -306,7 +885,8 @@ def get_invest(db: Session, scenario_id: int):
         models.InvestResult.scenario_id == scenario_id).all()
 
 def update_invest(db: Session, scenario_id: int, job_id: int,
-                  result: str, model_name: str, serviceshed: str):
+                  result: str, model_name: str, serviceshed: str,
+                  commit: bool = True):
     """Update an invest result."""
     db_invest = db.query(models.InvestResult).filter(
         models.InvestResult.job_id == job_id,
@@ -318,8 +898,9 @@ def update_invest(db: Session, scenario_id: int, job_id: int,
     setattr(db_invest, 'serviceshed', serviceshed)
 
     db.add(db_invest)
-    db.commit()
-    db.refresh(db_invest)
+    if commit:
+        db.commit()
+        db.refresh(db_invest)
     return STATUS_SUCCESS
 
 
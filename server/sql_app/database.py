@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -8,8 +9,19 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
 
 # 'connect_args' only used for SQLite.
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 30}
 )
+
+
+# Several API processes share the db (including the job queue), so let
+# readers proceed while another process is writing.
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Will inherit from this class to create each of the database models or
@@ -1,9 +1,13 @@
+import asyncio
+import collections
 import csv
+import hashlib
 import json
 import logging
 import os
-import queue
 import sys
+import time
+from datetime import datetime
 from typing import Optional
 
 import shapely.geometry
@@ -11,14 +15,16 @@ import shapely.wkt
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
-from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 from sqlalchemy.orm import Session
-from sqlalchemy import event
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import OperationalError
 
-from . import crud, models, schemas
+from . import crud, metrics, models, schemas
 from .database import SessionLocal, engine
 
 logging.basicConfig(
@@ -35,13 +41,44 @@ WORKING_ENV = "/opt/appdata"
 BASE_LULC = "lulc_overlay_3857.tif"
 LULC_CSV_PATH = os.path.join(WORKING_ENV, 'lulc_crosswalk.csv')
 
-# Create a queue that we will use to store our "workload".
-QUEUE = queue.PriorityQueue()
+# The base LULC is identified by a hash of its size and of this many bytes
+# at its start and end, as the worker does.
+LULC_VERSION_CHUNK_BYTES = 2**20
+_BASE_LULC_VERSIONS = {}  # (size, mtime) -> version
+
+# Our "workload" is stored in the job_queue table (see models.QueuedJob).
+# A worker holds a job for this long before it is considered abandoned,
+# unless the worker renews the lease with a heartbeat.
+JOB_LEASE_S = 90
+# Workers that lease through the older /jobsqueue/ endpoint don't send
+# heartbeats, so their leases must outlast the longest job.
+UNRENEWED_JOB_LEASE_S = 60 * 60
+# A job whose lease expires this many times (e.g. because the worker was
+# OOM-killed each time) is failed rather than re-queued again.
+MAX_JOB_ATTEMPTS = 3
+# Workers may long-poll the queue; cap how long a request is held open.
+LONG_POLL_MAX_S = 60
+# Jobs enqueued by this process wake long-polling workers immediately.
+# Jobs enqueued by other API processes are noticed by re-checking the
+# queue this often.
+LONG_POLL_RECHECK_S = 1
+# Browsers follow their session's jobs on an event stream. Status changes
+# committed by this process are pushed immediately; changes committed by
+# other API processes are noticed by re-checking the db this often.
+JOB_EVENTS_RECHECK_S = 5
+# Keep the ids of a bulk status request under SQLite's limit on the number
+# of parameters in a query.
+MAX_JOB_STATUS_IDS = 500
+# Upper bounds, in seconds, of the buckets of the job latency histograms.
+JOB_LATENCY_BUCKETS_S = [
+    0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
 # Status constants to use for the DB and to serve to frontend
 STATUS_PENDING = "pending"
 STATUS_RUNNING = "running"
 STATUS_SUCCESS = "success"
 STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+ACTIVE_JOB_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
 # Priority constants to use for jobs
 LOW_PRIORITY = 3
 MEDIUM_PRIORITY = 2
@@ -60,8 +97,36 @@ JOB_TYPES = {
     "wallpaper": "wallpaper",
     "lulc_fill": "lulc_fill",
     "lulc_crop": "lulc_crop",
+    "lulc_crop_and_modify": "lulc_crop_and_modify",
     "stats_under_parcel": "stats_under_parcel",
 }
+# The jobs that build a scenario's LULC.
+SCENARIO_JOB_TYPES = (
+    JOB_TYPES["wallpaper"],
+    JOB_TYPES["lulc_fill"],
+    JOB_TYPES["lulc_crop"],
+    JOB_TYPES["lulc_crop_and_modify"],
+)
+
+# Roughly how long each type of job takes to run, in seconds.
+EXPECTED_JOB_DURATION_S = {
+    JOB_TYPES["invest"]: 5 * 60,
+    JOB_TYPES["pattern_thumbnail"]: 1,
+    JOB_TYPES["wallpaper"]: 20,
+    JOB_TYPES["lulc_fill"]: 5,
+    JOB_TYPES["lulc_crop"]: 1,
+    JOB_TYPES["lulc_crop_and_modify"]: 20,
+    JOB_TYPES["stats_under_parcel"]: 1,
+}
+# Jobs expected to finish within this many seconds are "interactive":
+# someone is waiting on them in the UI. They are dispatched ahead of
+# "batch" jobs of the same priority, and workers reserve slots for them.
+INTERACTIVE_JOB_MAX_S = 2
+JOB_CLASSES = {
+    job_type: (
+        crud.JOB_CLASS_INTERACTIVE if duration_s <= INTERACTIVE_JOB_MAX_S
+        else crud.JOB_CLASS_BATCH)
+    for job_type, duration_s in EXPECTED_JOB_DURATION_S.items()}
 
 
 def insert_lulc_data(target, connection, **kw):
@@ -88,6 +153,36 @@ event.listen(models.LulcCrosswalk.__table__, 'after_create', insert_lulc_data)
 # in the db, add a new column, a new table, etc.
 models.Base.metadata.create_all(bind=engine)
 
+
+def _add_missing_columns():
+    """Add the columns of the models that an existing db does not have yet.
+
+    ``create_all`` only creates missing tables, so a db created before a
+    column was added to a model (``./sql_app.db`` persists across deploys)
+    would otherwise fail every query that touches that column. New columns
+    are nullable, so adding them leaves the existing rows valid. Their
+    indexes (like ``ix_jobs_job_type``, which the job metrics group by) are
+    created along with them.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in models.Base.metadata.sorted_tables:
+            existing = {
+                column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                LOGGER.info(f'adding column {table.name}.{column.name}')
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} '
+                    f'ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+
+
+_add_missing_columns()
+
 app = FastAPI(redirect_slashes=False)
 origins = ["http://localhost", "http://localhost:80", "http://localhost:3000", "http://urbanonline.naturalcapitalproject.org", "https://urbanonline.naturalcapitalproject.org"]
 app.add_middleware(
@@ -110,6 +205,101 @@ async def validation_exception_handler(
         content=content, status_code=HTTP_422_UNPROCESSABLE_ENTITY)
 
 
+# Set on startup; used to wake long-polling workers when a job is enqueued.
+_EVENT_LOOP = None
+_JOB_ENQUEUED = None
+# An asyncio.Queue of job status changes for each open event stream, by
+# session id.
+_JOB_SUBSCRIBERS = collections.defaultdict(set)
+# The same queues, by the id of each job that a stream watches explicitly
+# (see ``job_events``), which may belong to another session.
+_JOB_WATCHERS = collections.defaultdict(set)
+
+
+@app.on_event("startup")
+async def _setup_job_notification():
+    global _EVENT_LOOP, _JOB_ENQUEUED
+    _EVENT_LOOP = asyncio.get_running_loop()
+    _JOB_ENQUEUED = asyncio.Event()
+
+
+def _get_base_lulc_version():
+    """Identify the contents of the base LULC, or None if it's missing."""
+    base_lulc_path = os.path.join(WORKING_ENV, BASE_LULC)
+    try:
+        stat = os.stat(base_lulc_path)
+    except FileNotFoundError:
+        return None
+    stat_key = (stat.st_size, stat.st_mtime)
+    if stat_key not in _BASE_LULC_VERSIONS:
+        digest = hashlib.sha256(str(stat.st_size).encode('utf-8'))
+        with open(base_lulc_path, 'rb') as base_lulc_file:
+            for offset in (
+                    0, max(0, stat.st_size - LULC_VERSION_CHUNK_BYTES)):
+                base_lulc_file.seek(offset)
+                digest.update(base_lulc_file.read(LULC_VERSION_CHUNK_BYTES))
+        _BASE_LULC_VERSIONS[stat_key] = digest.hexdigest()[:16]
+    return _BASE_LULC_VERSIONS[stat_key]
+
+
+def _wake_workers():
+    """Wake any long-polling workers to lease the jobs now on the queue."""
+    # Path operations that enqueue jobs run in a threadpool, so hand the
+    # notification over to the event loop rather than setting it directly.
+    if _EVENT_LOOP is not None:
+        _EVENT_LOOP.call_soon_threadsafe(_JOB_ENQUEUED.set)
+
+
+def _enqueue_job(db, job_id, priority, worker_task, blocked_by=None):
+    """Add a task to the job queue and wake any long-polling workers.
+
+    A task on a scenario supersedes (cancels) any unfinished job doing the
+    same operation on that scenario, since its result would be overwritten,
+    unless that job is identical, in which case the task is coalesced into
+    it. A task that also builds a baseline scenario (lulc_crop_and_modify)
+    is queued as the builder of both scenarios.
+    A task ``blocked_by`` another job waits on the queue until that job
+    succeeds; see ``_release_blocked_jobs``.
+    """
+    scenario_id = worker_task['server_attrs'].get('scenario_id')
+    baseline_scenario_id = worker_task['server_attrs'].get(
+        'baseline_scenario_id')
+    operation = worker_task['job_type']
+    if operation == JOB_TYPES["invest"]:
+        operation = f'{operation}:{worker_task["job_args"]["invest_model"]}'
+    cancelled_job_ids = []
+    if scenario_id is not None:
+        scenario_ids = [scenario_id]
+        if baseline_scenario_id is not None:
+            scenario_ids.append(baseline_scenario_id)
+        cancelled_job_ids = crud.supersede_jobs(
+            db, scenario_ids, operation, crud.job_fingerprint(worker_task),
+            commit=False)
+    queued_job = crud.enqueue_job(
+        db, job_id, priority, worker_task, scenario_id, operation,
+        blocked_by, baseline_scenario_id)
+    _publish_job_statuses(db, cancelled_job_ids)
+    if blocked_by is None:
+        _wake_workers()
+    return queued_job
+
+
+def _deliver_job_status(session_id, job_id, status):
+    subscribers = _JOB_SUBSCRIBERS.get(session_id, set()) | _JOB_WATCHERS.get(
+        job_id, set())
+    for subscriber in subscribers:
+        subscriber.put_nowait((job_id, status))
+
+
+def _publish_job_statuses(db, job_ids):
+    """Push the committed status of jobs to their sessions' event streams."""
+    if _EVENT_LOOP is None or not job_ids:
+        return
+    for job in crud.get_jobs_by_id(db, job_ids):
+        _EVENT_LOOP.call_soon_threadsafe(
+            _deliver_job_status, job.owner_id, job.job_id, job.status)
+
+
 # Dependency
 def get_db():
     # We need to have an independent db session / connection (SessionLocal) per
@@ -238,46 +428,305 @@ def update_scenario(
 
 @app.delete("/scenario/{scenario_id}", status_code=200)
 def delete_scenario(scenario_id: int, db: Session = Depends(get_db)):
-    return crud.delete_scenario(db=db, scenario_id=scenario_id)
+    # The results of the scenario's unfinished jobs have nowhere to go.
+    cancelled_job_ids = crud.cancel_scenario_jobs(
+        db, [scenario_id], commit=False)
+    status = crud.delete_scenario(db=db, scenario_id=scenario_id)
+    _publish_job_statuses(db, cancelled_job_ids)
+    return status
 
 
-@app.get("/jobsqueue/")
-async def worker_job_request(db: Session = Depends(get_db)):
-    """If there's work to be done in the queue send it to the worker."""
+def _fail_queued_job(db, queued_job):
+    """Stage the failure of a queued job, without ever raising.
+
+    This runs for whichever worker asks for work next, so it must not fail
+    because of one stale job: if the failed result can't be applied, for
+    example because the job's scenario was deleted, the job, the jobs
+    coalesced into it and the jobs waiting on it are just marked failed and
+    taken off the queue.
+
+    Returns:
+        The ids of the jobs that were updated.
+    """
+    job_id = queued_job.job_id
+    worker_task = json.loads(queued_job.payload)
+    savepoint = db.begin_nested()
     try:
-        # Get job from queue, ignoring returned priority value
-        _, _, job_details = QUEUE.get_nowait()
-        return json.dumps(job_details)
-    except queue.Empty:
+        job_ids = _apply_result(
+            db, RESULT_HANDLERS[queued_job.job_type],
+            schemas.WorkerResponse(
+                result=STATUS_FAILED, status=STATUS_FAILED,
+                server_attrs=worker_task['server_attrs'],
+                job_type=queued_job.job_type))
+        savepoint.commit()
+        return job_ids
+    except OperationalError:
+        raise
+    except Exception:
+        savepoint.rollback()
+        LOGGER.exception(f'could not apply the failure of job {job_id}; '
+                         'taking it off the queue')
+
+    job_ids = [job_id] + [
+        follower.job_id for follower in crud.get_coalesced_jobs(db, job_id)]
+    for failed_job_id in job_ids:
+        job_db = crud.get_job(db, failed_job_id)
+        crud.update_job(
+            db, schemas.JobBase(
+                status=STATUS_FAILED,
+                name=job_db.name, description=job_db.description),
+            failed_job_id, commit=False)
+        crud.record_job_metrics(db, failed_job_id, commit=False)
+        crud.dequeue_job(db, failed_job_id, commit=False)
+    for blocked in crud.get_blocked_jobs(db, job_ids):
+        job_ids += _fail_queued_job(db, blocked)
+    return job_ids
+
+
+def _reclaim_expired_leases(db):
+    """Re-queue the jobs of workers that stopped sending heartbeats.
+
+    A job that has already been leased ``MAX_JOB_ATTEMPTS`` times is failed
+    instead, so that a job which kills its worker can't take down every
+    worker in turn.
+    """
+    job_ids = []
+    for queued_job in crud.get_expired_leases(db):
+        if queued_job.attempts >= MAX_JOB_ATTEMPTS:
+            LOGGER.warning(
+                f'job {queued_job.job_id} was abandoned '
+                f'{queued_job.attempts} times; failing it')
+            job_ids += _fail_queued_job(db, queued_job)
+        elif crud.release_lease(db, queued_job, commit=False):
+            LOGGER.warning(
+                f'lease on job {queued_job.job_id} held by '
+                f'{queued_job.lease_owner} expired; re-queueing it')
+            job_ids.append(queued_job.job_id)
+            job_ids += [
+                follower.job_id for follower
+                in crud.get_coalesced_jobs(db, queued_job.job_id)]
+    if job_ids:
+        db.commit()
+        _publish_job_statuses(db, job_ids)
+
+
+def _lease_queued_jobs(db, worker_id, lease_duration_s, capacity, max_jobs,
+                      class_capacity):
+    """Make one attempt at leasing jobs; see ``_lease_jobs``.
+
+    This blocks on the db, so it is run in the threadpool.
+
+    Returns:
+        The payloads of the leased jobs.
+    """
+    _reclaim_expired_leases(db)
+    leased = crud.lease_jobs(
+        db, worker_id, lease_duration_s, capacity, max_jobs,
+        JOB_CLASSES, class_capacity)
+    if not leased:
+        # Return the connection to the pool while the caller waits.
+        db.close()
+        return []
+    payloads = []
+    job_ids = []
+    for queued_job in leased:
+        payloads.append(queued_job.payload)
+        job_ids.append(queued_job.job_id)
+        job_ids += [
+            follower.job_id for follower
+            in crud.get_coalesced_jobs(db, queued_job.job_id)]
+    _publish_job_statuses(db, job_ids)
+    return payloads
+
+
+async def _lease_jobs(request, db, worker_id, wait, capacity, max_jobs,
+                      lease_duration_s=JOB_LEASE_S, class_capacity=None):
+    """Lease jobs, holding the request open for up to ``wait`` seconds.
+
+    Returns:
+        A list of the payloads (JSON strings) of the leased jobs, which is
+        empty if no job arrived before the timeout.
+    """
+    if worker_id is None:
+        worker_id = f'{request.client.host}:{request.client.port}'
+    deadline = time.monotonic() + min(wait, LONG_POLL_MAX_S)
+    while True:
+        # Don't lease a job to a worker that has given up on this request.
+        if await request.is_disconnected():
+            return []
+        # Clear before checking the queue so that a job enqueued while we
+        # check is not missed.
+        if _JOB_ENQUEUED is not None:
+            _JOB_ENQUEUED.clear()
+        payloads = await run_in_threadpool(
+            _lease_queued_jobs, db, worker_id, lease_duration_s, capacity,
+            max_jobs, class_capacity)
+        if payloads:
+            return payloads
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or _JOB_ENQUEUED is None:
+            return []
+        try:
+            await asyncio.wait_for(
+                _JOB_ENQUEUED.wait(), min(remaining, LONG_POLL_RECHECK_S))
+        except asyncio.TimeoutError:
+            pass
+
+
+@app.get("/jobsqueue/")
+async def worker_job_request(
+        request: Request, worker_id: Optional[str] = None, wait: float = 0,
+        job_types: Optional[list[str]] = Query(None),
+        db: Session = Depends(get_db)):
+    """If there's work to be done in the queue send it to the worker.
+
+    If the queue is empty, the request is held open for up to ``wait``
+    seconds until a job arrives (long polling). A worker that only has
+    capacity for some kinds of work may restrict the lease to ``job_types``.
+    """
+    capacity = None
+    if job_types is not None:
+        capacity = {job_type: 1 for job_type in job_types}
+    payloads = await _lease_jobs(
+        request, db, worker_id, wait, capacity, 1, UNRENEWED_JOB_LEASE_S)
+    if not payloads:
         return None
+    # The payload is already a JSON string, which is what the worker expects.
+    return payloads[0]
 
 
-@app.post("/jobsqueue/invest")
-def worker_invest_response(
-    invest_result: schemas.WorkerResponse, db: Session = Depends(get_db)):
-    """Update the db given the job details from the worker.
+@app.post("/jobsqueue/lease")
+async def worker_batch_job_request(
+        request: Request, lease_request: schemas.LeaseRequest,
+        db: Session = Depends(get_db)):
+    """Lease up to one job per free slot of the worker in one request.
 
-    Returned URL result will be partial to allow for local vs cloud stored
-    depending on production vs dev environment.
+    Long polls like ``/jobsqueue/`` when the queue is empty. The leases
+    expire after ``JOB_LEASE_S`` unless renewed at ``/jobsqueue/heartbeat``.
+    A worker that reserves slots for interactive jobs limits each class of
+    job (see ``JOB_CLASSES``) with ``class_capacity``.
 
-    Args:
-        invest_result (pydantic model): a pydantic model with the following
-            key/vals
+    Returns:
+        A list of worker tasks, which is empty if there was no work.
+    """
+    max_jobs = sum(lease_request.capacity.values())
+    if lease_request.max_jobs is not None:
+        max_jobs = min(max_jobs, lease_request.max_jobs)
+    payloads = await _lease_jobs(
+        request, db, lease_request.worker_id, lease_request.wait,
+        lease_request.capacity, max_jobs, JOB_LEASE_S,
+        lease_request.class_capacity)
+    return [json.loads(payload) for payload in payloads]
+
+
+@app.post("/jobsqueue/heartbeat")
+def worker_heartbeat(heartbeat: schemas.Heartbeat,
+                     db: Session = Depends(get_db)):
+    """Renew the leases on the jobs a worker is still running.
+
+    Returns:
+        ``{"lost": [job_id, ...], "cancelled": [job_id, ...]}``, the jobs
+        the worker no longer holds, because the lease expired or because
+        the job was cancelled. Their results will be ignored, so the worker
+        may stop working on them.
+    """
+    renewed = set(crud.renew_leases(
+        db, heartbeat.worker_id, heartbeat.job_ids, JOB_LEASE_S))
+    not_renewed = [
+        job_id for job_id in heartbeat.job_ids if job_id not in renewed]
+    cancelled = {
+        job.job_id for job in crud.get_jobs_by_id(db, not_renewed)
+        if job.status == STATUS_CANCELLED}
+    return {
+        "lost": [job_id for job_id in not_renewed if job_id not in cancelled],
+        "cancelled": sorted(cancelled),
+    }
 
-            "result": {
-                "invest-result" (str): path to json file with results,
-                "model": (str): name of the invest model,
-                }
-             "status": "success | failed",
-             "server_attrs": {
-                "job_id": int, "scenario_id": int,
-                }
+
+def _apply_result(db, apply_job_result, worker_response):
+    """Stage the db updates for a finished job and any jobs waiting on it.
+
+    Args:
+        db: the db session.
+        apply_job_result: one of the ``_apply_*_result`` functions.
+        worker_response: the ``schemas.WorkerResponse`` from the worker.
+
+    Returns:
+        The ids of the jobs that were updated. This is empty if the job
+        already has a result, for example when a worker whose lease expired
+        finishes the job after another worker.
+    """
+    job_id = worker_response.server_attrs['job_id']
+    if crud.get_queued_job(db, job_id) is None:
+        LOGGER.info(f'ignoring a duplicate result for job {job_id}')
+        return []
+    followers = crud.get_coalesced_jobs(db, job_id)
+    if crud.get_job(db, job_id).status == STATUS_CANCELLED:
+        # It only kept running because other jobs were waiting on it.
+        crud.dequeue_job(db, job_id, commit=False)
+        job_ids = []
+    else:
+        apply_job_result(db, worker_response)
+        job_ids = [job_id]
+    # Jobs that were coalesced into this one get the same result, applied
+    # to their own job, scenario, etc.
+    for follower in followers:
+        follower_task = json.loads(follower.payload)
+        apply_job_result(db, worker_response.copy(
+            update={'server_attrs': follower_task['server_attrs']}))
+    job_ids += [follower.job_id for follower in followers]
+    # The job ran once however many jobs it stood in for, so the run is
+    # recorded once, and the other jobs are only marked finished.
+    for updated_job_id in job_ids:
+        crud.record_job_metrics(
+            db, updated_job_id,
+            worker_response.metrics if updated_job_id == job_ids[0] else None,
+            commit=False)
+    return job_ids + _release_blocked_jobs(db, job_ids)
+
+
+def _release_blocked_jobs(db, job_ids):
+    """Stage the release of the jobs waiting on ``job_ids``.
+
+    A job waiting on a job that succeeded is put on the queue, with the
+    ``lulc_source_url`` of its task set to the LULC of its scenario, which
+    the finished job has just built. A job waiting on a job that failed
+    fails too.
+
+    Returns:
+        The ids of the jobs that were released or failed.
     """
+    released_job_ids = []
+    for blocked in crud.get_blocked_jobs(db, job_ids):
+        worker_task = json.loads(blocked.payload)
+        if crud.get_job(db, blocked.blocked_by).status == STATUS_SUCCESS:
+            scenario_db = crud.get_scenario(
+                db, worker_task['server_attrs']['scenario_id'])
+            worker_task['job_args']['lulc_source_url'] = (
+                scenario_db.lulc_url_result)
+            LOGGER.info(f'job {blocked.blocked_by} released job '
+                        f'{blocked.job_id}')
+            crud.unblock_job(db, blocked.job_id, worker_task, commit=False)
+            released_job_ids.append(blocked.job_id)
+        else:
+            LOGGER.info(f'job {blocked.job_id} failed because job '
+                        f'{blocked.blocked_by} did')
+            released_job_ids += _apply_result(
+                db, RESULT_HANDLERS[blocked.job_type],
+                schemas.WorkerResponse(
+                    result=STATUS_FAILED, status=STATUS_FAILED,
+                    server_attrs=worker_task['server_attrs'],
+                    job_type=blocked.job_type))
+    if released_job_ids:
+        _wake_workers()
+    return released_job_ids
+
+
+def _apply_invest_result(db, invest_result):
+    """Stage the db updates for a finished invest job without committing."""
     # Update job in db based on status
     job_db = crud.get_job(db, job_id=invest_result.server_attrs['job_id'])
-    # Update Scenario in db with the result
-    scenario_db = crud.get_scenario(
-        db, scenario_id=invest_result.server_attrs['scenario_id'])
 
     job_status = invest_result.status
     if job_status == STATUS_SUCCESS:
@@ -296,7 +745,7 @@ def worker_invest_response(
             job_id=invest_result.server_attrs['job_id'],
             result=invest_result.result['invest-result'],
             model_name=invest_result.result['model'],
-            serviceshed=invest_result.result['serviceshed'])
+            serviceshed=invest_result.result['serviceshed'], commit=False)
     else:
         # Update the job status in the DB to "failed"
         job_update = schemas.JobBase(
@@ -307,38 +756,42 @@ def worker_invest_response(
 
     LOGGER.debug('Update job status')
     _ = crud.update_job(
-        db=db, job=job_update, job_id=invest_result.server_attrs['job_id'])
+        db=db, job=job_update, job_id=invest_result.server_attrs['job_id'],
+        commit=False)
+    _ = crud.dequeue_job(
+        db=db, job_id=invest_result.server_attrs['job_id'], commit=False)
 
 
-@app.post("/jobsqueue/scenario")
-def worker_scenario_response(
-        scenario_job: schemas.WorkerResponse, db: Session = Depends(get_db)):
+@app.post("/jobsqueue/invest")
+def worker_invest_response(
+    invest_result: schemas.WorkerResponse, db: Session = Depends(get_db)):
     """Update the db given the job details from the worker.
 
     Returned URL result will be partial to allow for local vs cloud stored
     depending on production vs dev environment.
 
     Args:
-        scenario_job (pydantic model): a pydantic model with the following
+        invest_result (pydantic model): a pydantic model with the following
             key/vals
 
             "result": {
-                lulc_path: "relative path to file location",
-                lulc_stats: {
-                    lulc-int: lulc-count,
-                    11: 53,
-                  },
+                "invest-result" (str): path to json file with results,
+                "model": (str): name of the invest model,
                 }
              "status": "success | failed",
              "server_attrs": {
-                "job_id": int, "scenario_id": int
+                "job_id": int, "scenario_id": int,
                 }
     """
+    job_ids = _apply_result(db, _apply_invest_result, invest_result)
+    db.commit()
+    _publish_job_statuses(db, job_ids)
+
+
+def _apply_scenario_result(db, scenario_job):
+    """Stage the db updates for a finished scenario job without committing."""
     # Update job in db based on status
     job_db = crud.get_job(db, job_id=scenario_job.server_attrs['job_id'])
-    # Update Scenario in db with the result
-    scenario_db = crud.get_scenario(
-        db, scenario_id=scenario_job.server_attrs['scenario_id'])
 
     job_status = scenario_job.status
     if job_status == STATUS_SUCCESS:
@@ -362,19 +815,69 @@ def worker_scenario_response(
 
     LOGGER.debug('Update job status')
     _ = crud.update_job(
-        db=db, job=job_update, job_id=scenario_job.server_attrs['job_id'])
+        db=db, job=job_update, job_id=scenario_job.server_attrs['job_id'],
+        commit=False)
+    _ = crud.dequeue_job(
+        db=db, job_id=scenario_job.server_attrs['job_id'], commit=False)
     LOGGER.debug('Update scenario result')
     _ = crud.update_scenario(
         db=db, scenario=scenario_update,
-        scenario_id=scenario_job.server_attrs['scenario_id'])
+        scenario_id=scenario_job.server_attrs['scenario_id'], commit=False)
 
 
-@app.post("/jobsqueue/parcel_stats")
-def worker_parcel_stats_response(
-        parcel_stats_job: schemas.WorkerResponse,
-        db: Session = Depends(get_db)):
-    """Update the db given the job details from the worker."""
-    LOGGER.debug("Entering jobsqueue/parcel_stats")
+def _apply_crop_and_modify_result(db, scenario_job):
+    """Stage the db updates for a finished crop and modify job.
+
+    The modified scenario is updated as for a fill or wallpaper job, and the
+    baseline scenario as for a crop job.
+    """
+    _apply_scenario_result(db, scenario_job)
+    if scenario_job.status == STATUS_SUCCESS:
+        lulc_stats = crud.explode_lulc_counts(
+            db, scenario_job.result['baseline_lulc_stats'])
+        baseline_update = schemas.ScenarioUpdate(
+            lulc_url_result=scenario_job.result['baseline_lulc_path'],
+            lulc_stats=json.dumps(lulc_stats))
+    else:
+        baseline_update = schemas.ScenarioUpdate(
+            lulc_url_result=None, lulc_stats=None)
+    _ = crud.update_scenario(
+        db=db, scenario=baseline_update,
+        scenario_id=scenario_job.server_attrs['baseline_scenario_id'],
+        commit=False)
+
+
+@app.post("/jobsqueue/scenario")
+def worker_scenario_response(
+        scenario_job: schemas.WorkerResponse, db: Session = Depends(get_db)):
+    """Update the db given the job details from the worker.
+
+    Returned URL result will be partial to allow for local vs cloud stored
+    depending on production vs dev environment.
+
+    Args:
+        scenario_job (pydantic model): a pydantic model with the following
+            key/vals
+
+            "result": {
+                lulc_path: "relative path to file location",
+                lulc_stats: {
+                    lulc-int: lulc-count,
+                    11: 53,
+                  },
+                }
+             "status": "success | failed",
+             "server_attrs": {
+                "job_id": int, "scenario_id": int
+                }
+    """
+    job_ids = _apply_result(db, _apply_scenario_result, scenario_job)
+    db.commit()
+    _publish_job_statuses(db, job_ids)
+
+
+def _apply_parcel_stats_result(db, parcel_stats_job):
+    """Stage the db updates for a finished stats job without committing."""
     LOGGER.debug(parcel_stats_job)
     # Update job in db based on status
     job_db = crud.get_job(db, job_id=parcel_stats_job.server_attrs['job_id'])
@@ -400,40 +903,31 @@ def worker_parcel_stats_response(
 
     LOGGER.debug('Update job status')
     _ = crud.update_job(
-        db=db, job=job_update, job_id=parcel_stats_job.server_attrs['job_id'])
+        db=db, job=job_update, job_id=parcel_stats_job.server_attrs['job_id'],
+        commit=False)
+    _ = crud.dequeue_job(
+        db=db, job_id=parcel_stats_job.server_attrs['job_id'], commit=False)
     LOGGER.debug('Update stats result')
     _ = crud.update_parcel_stats(
         db=db, parcel_stats=stats_update,
-        stats_id=parcel_stats_job.server_attrs['stats_id'])
+        stats_id=parcel_stats_job.server_attrs['stats_id'], commit=False)
 
 
-@app.post("/jobsqueue/pattern")
-def worker_pattern_response(
-        pattern_job: schemas.WorkerResponse, db: Session = Depends(get_db)):
-    """Update the db given the job details from the worker.
-
-    Returned URL result will be partial to allow for local vs cloud stored
-    depending on production vs dev environment.
+@app.post("/jobsqueue/parcel_stats")
+def worker_parcel_stats_response(
+        parcel_stats_job: schemas.WorkerResponse,
+        db: Session = Depends(get_db)):
+    """Update the db given the job details from the worker."""
+    LOGGER.debug("Entering jobsqueue/parcel_stats")
+    job_ids = _apply_result(db, _apply_parcel_stats_result, parcel_stats_job)
+    db.commit()
+    _publish_job_statuses(db, job_ids)
 
-    Args:
-        pattern_job (pydantic model): a pydantic model with the following
-            key/vals
 
-        {
-            "result": {
-                "pattern_thumbnail_path": "relative path to file location",
-                }
-            "status": "success | failed",
-            "server_attrs": {
-               "job_id": int, "scenario_id": int
-               }
-       }
-    """
+def _apply_pattern_result(db, pattern_job):
+    """Stage the db updates for a finished pattern job without committing."""
     # Update job in db based on status
     job_db = crud.get_job(db, job_id=pattern_job.server_attrs['job_id'])
-    # Update Pattern in db with the result
-    pattern_db = crud.get_pattern(
-        db, pattern_id=pattern_job.server_attrs['pattern_id'])
 
     job_status = pattern_job.status
     if job_status == "success":
@@ -456,11 +950,109 @@ def worker_pattern_response(
 
     LOGGER.debug('Update job status')
     _ = crud.update_job(
-        db=db, job=job_update, job_id=pattern_job.server_attrs['job_id'])
+        db=db, job=job_update, job_id=pattern_job.server_attrs['job_id'],
+        commit=False)
+    _ = crud.dequeue_job(
+        db=db, job_id=pattern_job.server_attrs['job_id'], commit=False)
     LOGGER.debug('Update pattern result')
     _ = crud.update_pattern(
         db=db, pattern=pattern_update,
-        pattern_id=pattern_job.server_attrs['pattern_id'])
+        pattern_id=pattern_job.server_attrs['pattern_id'], commit=False)
+
+
+@app.post("/jobsqueue/pattern")
+def worker_pattern_response(
+        pattern_job: schemas.WorkerResponse, db: Session = Depends(get_db)):
+    """Update the db given the job details from the worker.
+
+    Returned URL result will be partial to allow for local vs cloud stored
+    depending on production vs dev environment.
+
+    Args:
+        pattern_job (pydantic model): a pydantic model with the following
+            key/vals
+
+        {
+            "result": {
+                "pattern_thumbnail_path": "relative path to file location",
+                }
+            "status": "success | failed",
+            "server_attrs": {
+               "job_id": int, "scenario_id": int
+               }
+       }
+    """
+    job_ids = _apply_result(db, _apply_pattern_result, pattern_job)
+    db.commit()
+    _publish_job_statuses(db, job_ids)
+
+
+# How to apply each type of job's result to the db
+RESULT_HANDLERS = {
+    JOB_TYPES["invest"]: _apply_invest_result,
+    JOB_TYPES["pattern_thumbnail"]: _apply_pattern_result,
+    JOB_TYPES["wallpaper"]: _apply_scenario_result,
+    JOB_TYPES["lulc_fill"]: _apply_scenario_result,
+    JOB_TYPES["lulc_crop"]: _apply_scenario_result,
+    JOB_TYPES["lulc_crop_and_modify"]: _apply_crop_and_modify_result,
+    JOB_TYPES["stats_under_parcel"]: _apply_parcel_stats_result,
+}
+
+
+@app.post("/jobsqueue/results")
+def worker_batch_response(
+        worker_responses: list[schemas.WorkerResponse],
+        db: Session = Depends(get_db)):
+    """Update the db given the results of several jobs from the worker.
+
+    Each response must include its ``job_type``. The resulting job,
+    scenario, stats and pattern updates are committed in one transaction,
+    but each result is applied in a savepoint of its own, so that a result
+    that can't be applied (say, because its scenario was deleted) is
+    rejected without holding back the others.
+
+    Returns:
+        A ``{"job_id", "status", "detail"}`` dict for each response, in
+        order, where ``status`` is ``"applied"`` or ``"rejected"``. The
+        worker should not send a rejected result again.
+    """
+    job_ids = []
+    result_statuses = []
+    for worker_response in worker_responses:
+        job_id = worker_response.server_attrs.get('job_id')
+        if worker_response.job_type not in RESULT_HANDLERS:
+            result_statuses.append({
+                "job_id": job_id, "status": "rejected",
+                "detail": f"Invalid job type: {worker_response.job_type}"})
+            continue
+        savepoint = db.begin_nested()
+        try:
+            applied_job_ids = _apply_result(
+                db, RESULT_HANDLERS[worker_response.job_type],
+                worker_response)
+            savepoint.commit()
+        except OperationalError:
+            # The db is busy or broken, which is no fault of this result;
+            # fail the request so that the worker sends the batch again.
+            raise
+        except Exception as error:
+            savepoint.rollback()
+            if isinstance(error, HTTPException):
+                detail = error.detail
+                LOGGER.warning(
+                    f'rejected the result of job {job_id}: {detail}')
+            else:
+                detail = repr(error)
+                LOGGER.exception(f'rejected the result of job {job_id}')
+            result_statuses.append({
+                "job_id": job_id, "status": "rejected", "detail": detail})
+            continue
+        job_ids += applied_job_ids
+        result_statuses.append({
+            "job_id": job_id, "status": "applied", "detail": None})
+    db.commit()
+    _publish_job_statuses(db, job_ids)
+    return result_statuses
 
 
 @app.post("/jobs", response_model=schemas.Job)
@@ -479,12 +1071,182 @@ def read_job(job_id: int, db: Session = Depends(get_db)):
     return db_job
 
 
+def _format_job_event(job_id, status):
+    data = json.dumps({"job_id": job_id, "status": status})
+    return f"event: job\ndata: {data}\n\n"
+
+
+def _read_session_job_statuses(session_id, job_ids, after_job_id,
+                               watched_job_ids):
+    """Read the statuses of a session's jobs in a session of its own.
+
+    This blocks on the db, so ``_job_events`` runs it in the threadpool.
+    See ``crud.get_session_job_statuses`` for the arguments.
+    """
+    db = SessionLocal()
+    try:
+        return crud.get_session_job_statuses(
+            db, session_id, job_ids, after_job_id, watched_job_ids)
+    finally:
+        db.close()
+
+
+async def _job_events(session_id, watched_job_ids=()):
+    """Generate a server-sent event each time one of a session's jobs changes.
+
+    The stream starts with the current status of each of the session's jobs,
+    and of each of the ``watched_job_ids`` whoever owns them, so a client
+    that connects (or reconnects) after a job finished still hears about it.
+    """
+    subscriber = asyncio.Queue()
+    _JOB_SUBSCRIBERS[session_id].add(subscriber)
+    for job_id in watched_job_ids:
+        _JOB_WATCHERS[job_id].add(subscriber)
+    # The last status sent for each job, so that each change is sent once.
+    sent_statuses = {}
+    last_job_id = 0
+    try:
+        while True:
+            active_job_ids = [
+                job_id for job_id, status in sent_statuses.items()
+                if status in ACTIVE_JOB_STATUSES]
+            job_statuses = await run_in_threadpool(
+                _read_session_job_statuses, session_id, active_job_ids,
+                last_job_id, watched_job_ids)
+            for job_id, status in job_statuses:
+                if job_id not in watched_job_ids:
+                    last_job_id = max(last_job_id, job_id)
+                if sent_statuses.get(job_id) != status:
+                    sent_statuses[job_id] = status
+                    yield _format_job_event(job_id, status)
+
+            deadline = time.monotonic() + JOB_EVENTS_RECHECK_S
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job_id, status = await asyncio.wait_for(
+                        subscriber.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if sent_statuses.get(job_id) != status:
+                    sent_statuses[job_id] = status
+                    yield _format_job_event(job_id, status)
+            # A comment line, which also keeps proxies from closing an idle
+            # stream.
+            yield ": keep-alive\n\n"
+    finally:
+        _JOB_SUBSCRIBERS[session_id].discard(subscriber)
+        if not _JOB_SUBSCRIBERS[session_id]:
+            del _JOB_SUBSCRIBERS[session_id]
+        for job_id in watched_job_ids:
+            _JOB_WATCHERS[job_id].discard(subscriber)
+            if not _JOB_WATCHERS[job_id]:
+                del _JOB_WATCHERS[job_id]
+
+
+@app.get("/events/{session_id}")
+async def job_events(session_id: str,
+                     job_ids: Optional[list[int]] = Query(None)):
+    """Stream the status changes of a session's jobs as server-sent events.
+
+    Each event is named ``job`` and its data is a JSON object with the
+    ``job_id`` and ``status``. This replaces polling ``/job/{job_id}``.
+    The stream also follows any ``job_ids`` given, even if another session
+    owns them, like the stats job that ``/add_parcel`` may share between
+    sessions.
+    """
+    if job_ids is not None and len(job_ids) > MAX_JOB_STATUS_IDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Watch at most {MAX_JOB_STATUS_IDS} job ids at once")
+    return StreamingResponse(
+        _job_events(session_id, frozenset(job_ids or ())),
+        media_type="text/event-stream",
+        # Don't let nginx buffer the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/job/{job_id}/cancel", response_model=schemas.JobStatus)
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    """Cancel a job that has not finished.
+
+    A finished job is left as it is; either way its status is returned.
+    """
+    if crud.cancel_job(db, job_id):
+        _publish_job_statuses(db, [job_id])
+    return crud.get_job(db, job_id)
+
+
+@app.get("/jobs/status", response_model=dict[int, str])
+def read_job_statuses(ids: list[int] = Query(...),
+                      db: Session = Depends(get_db)):
+    """Get the status of several jobs in one request.
+
+    For example, ``/jobs/status?ids=1&ids=2`` returns
+    ``{"1": "success", "2": "running"}``. Unknown job ids are left out.
+    """
+    if len(ids) > MAX_JOB_STATUS_IDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Request at most {MAX_JOB_STATUS_IDS} job ids at once")
+    return {job.job_id: job.status for job in crud.get_jobs_by_id(db, ids)}
+
+
 @app.get("/jobs", response_model=list[schemas.Job])
 def read_jobs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     jobs = crud.get_jobs(db, skip=skip, limit=limit)
     return jobs
 
 
+@app.get("/metrics")
+def read_metrics(db: Session = Depends(get_db)):
+    """Report the state of the job queue and job latencies to Prometheus.
+
+    Everything is computed from the db, so any API process gives the same
+    answer.
+    """
+    now = datetime.utcnow()
+    queue_depths = crud.get_queue_depths(db)
+    queue_waits = crud.get_job_duration_histograms(
+        db, models.Job.enqueued_at, models.Job.started_at,
+        JOB_LATENCY_BUCKETS_S)
+    run_times = crud.get_job_duration_histograms(
+        db, models.Job.started_at, models.Job.finished_at,
+        JOB_LATENCY_BUCKETS_S)
+    body = metrics.render(
+        metrics.gauge(
+            "urban_online_queue_depth",
+            "Jobs waiting for a worker, by priority.",
+            [({"priority": priority}, n_jobs)
+             for priority, n_jobs, _ in queue_depths]),
+        metrics.gauge(
+            "urban_online_queue_oldest_job_age_seconds",
+            "Age of the oldest job waiting for a worker, by priority.",
+            [({"priority": priority},
+              (now - oldest_enqueued_at).total_seconds())
+             for priority, _, oldest_enqueued_at in queue_depths]),
+        metrics.gauge(
+            "urban_online_jobs_leased",
+            "Jobs that workers are running.",
+            [({}, crud.get_leased_job_count(db))]),
+        metrics.histogram(
+            "urban_online_job_queue_wait_seconds",
+            "Time from enqueueing a job to a worker starting it.",
+            [({"job_type": job_type}, bucket_counts, count, total)
+             for job_type, bucket_counts, count, total in queue_waits],
+            JOB_LATENCY_BUCKETS_S),
+        metrics.histogram(
+            "urban_online_job_run_seconds",
+            "Time from a worker starting a job to finishing it.",
+            [({"job_type": job_type}, bucket_counts, count, total)
+             for job_type, bucket_counts, count, total in run_times],
+            JOB_LATENCY_BUCKETS_S),
+    )
+    return Response(content=body, media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/pattern/{session_id}", response_model=schemas.PatternResponse)
 def create_pattern(session_id: str, pattern: schemas.PatternBase,
                    db: Session = Depends(get_db)):
@@ -513,7 +1275,7 @@ def create_pattern(session_id: str, pattern: schemas.PatternBase,
         }
     }
 
-    QUEUE.put_nowait((HIGH_PRIORITY, job_db.job_id, worker_task))
+    _enqueue_job(db, job_db.job_id, HIGH_PRIORITY, worker_task)
 
     return {**worker_task['server_attrs'], "label": pattern.label}
 
@@ -571,7 +1333,7 @@ def wallpaper(wallpaper: schemas.Wallpaper, db: Session = Depends(get_db)):
             }
         }
 
-    QUEUE.put_nowait((MEDIUM_PRIORITY, job_db.job_id, worker_task))
+    _enqueue_job(db, job_db.job_id, MEDIUM_PRIORITY, worker_task)
 
     # Return job_id for response
     return job_db
@@ -607,7 +1369,7 @@ def lulc_fill(lulc_fill: schemas.ParcelFill,
             }
         }
 
-    QUEUE.put_nowait((MEDIUM_PRIORITY, job_db.job_id, worker_task))
+    _enqueue_job(db, job_db.job_id, MEDIUM_PRIORITY, worker_task)
 
     # Return job_id for response
     return job_db
@@ -645,7 +1407,66 @@ def lulc_crop(scenario_id: int, db: Session = Depends(get_db)):
     # In practice, this job is queue'd concurrently with
     # a lulc_fill or wallpaper job, so this one should be
     # prioritized.
-    QUEUE.put_nowait((HIGH_PRIORITY, job_db.job_id, worker_task))
+    _enqueue_job(db, job_db.job_id, HIGH_PRIORITY, worker_task)
+
+    # Return job_id for response
+    return job_db
+
+
+@app.post("/lulc_crop_and_modify", response_model=schemas.JobResponse)
+def lulc_crop_and_modify(crop_and_modify: schemas.CropAndModify,
+                         db: Session = Depends(get_db)):
+    """Crop the baseline scenario and fill or wallpaper another in one job.
+
+    This replaces a lulc_crop job and a lulc_fill or wallpaper job on the
+    same study area, which would each read the same window of the LULC.
+    """
+    if (crop_and_modify.lulc_class is None) == (
+            crop_and_modify.pattern_id is None):
+        raise HTTPException(
+            status_code=422,
+            detail="Exactly one of lulc_class or pattern_id is required")
+    scenario_db = crud.get_scenario(db, crop_and_modify.scenario_id)
+    baseline_db = crud.get_scenario(db, crop_and_modify.baseline_scenario_id)
+    if baseline_db.study_area_id != scenario_db.study_area_id:
+        raise HTTPException(
+            status_code=422,
+            detail="The scenarios are not of the same study area")
+    study_area_db = crud.get_study_area(db, scenario_db.study_area_id)
+    study_area_wkt = _get_study_area_geometry(study_area_db)
+    session_id = study_area_db.owner_id
+
+    job_args = {
+        "target_parcel_wkt": study_area_wkt,
+        "lulc_source_url": f'{WORKING_ENV}/{scenario_db.lulc_url_base}',
+    }
+    if crop_and_modify.lulc_class is not None:
+        job_args["modify_job_type"] = JOB_TYPES["lulc_fill"]
+        job_args["lulc_class"] = crop_and_modify.lulc_class
+    else:
+        pattern_db = crud.get_pattern(db, crop_and_modify.pattern_id)
+        job_args["modify_job_type"] = JOB_TYPES["wallpaper"]
+        job_args["pattern_bbox_wkt"] = pattern_db.wkt
+
+    job_schema = schemas.JobBase(
+        **{"name": "lulc_crop_and_modify",
+           "description": "crop lulc and " + job_args["modify_job_type"],
+           "status": STATUS_PENDING})
+    job_db = crud.create_job(
+        db=db, session_id=session_id, job=job_schema)
+
+    # Construct worker job and add to the queue
+    worker_task = {
+        "job_type": JOB_TYPES["lulc_crop_and_modify"],
+        "server_attrs": {
+            "job_id": job_db.job_id,
+            "scenario_id": scenario_db.scenario_id,
+            "baseline_scenario_id": baseline_db.scenario_id,
+        },
+        "job_args": job_args,
+    }
+
+    _enqueue_job(db, job_db.job_id, MEDIUM_PRIORITY, worker_task)
 
     # Return job_id for response
     return job_db
@@ -655,10 +1476,17 @@ def lulc_crop(scenario_id: int, db: Session = Depends(get_db)):
 def remove_parcel(delete_parcel_request: schemas.ParcelDeleteRequest,
                   db: Session = Depends(get_db)):
     status = crud.delete_parcel(db=db, **delete_parcel_request.dict())
+    # The study area has changed, so any unfinished work on its scenarios
+    # is stale.
+    scenarios = crud.get_scenarios(
+        db, delete_parcel_request.study_area_id)
+    cancelled_job_ids = crud.cancel_scenario_jobs(
+        db, [scenario.scenario_id for scenario in scenarios])
+    _publish_job_statuses(db, cancelled_job_ids)
     return status
 
 
-@app.post("/add_parcel", response_model=schemas.JobResponse)
+@app.post("/add_parcel", response_model=schemas.ParcelCreateResponse)
 def add_parcel(create_parcel_request: schemas.ParcelCreateRequest,
                db: Session = Depends(get_db)):
 
@@ -672,15 +1500,38 @@ def add_parcel(create_parcel_request: schemas.ParcelCreateRequest,
     # Check if this parcel has already been computed.
     stats_db = crud.get_parcel_stats_by_id(db, create_parcel_request.parcel_id)
     if stats_db:
-        # This is what the frontend is expecting.
-        # even though we don't need to submit a new job,
-        # the frontend is expecting to need to poll
-        # for the status before requesting the results.
+        # If the stats are still being computed, the frontend waits on the
+        # job, which may belong to another session, so it has to watch it
+        # by id (see job_events). Otherwise there is nothing to wait on.
+        stats_job_db = stats_db.job_id and crud.get_job(db, stats_db.job_id)
+        if stats_job_db and stats_job_db.status in ACTIVE_JOB_STATUSES:
+            job_id = stats_job_db.job_id
+        else:
+            job_id = None
         return {
-            "job_id": stats_db.job_id,
+            "job_id": job_id,
             "stats_id": stats_db.stats_id
         }
 
+    # Answer right away if the stats were precomputed for this base LULC.
+    lulc_version = _get_base_lulc_version()
+    base_stats_db = lulc_version and crud.get_base_parcel_stats(
+        db, create_parcel_request.parcel_id, lulc_version)
+    if base_stats_db:
+        lulc_counts = {
+            int(lucode): count for lucode, count in
+            json.loads(base_stats_db.lulc_stats).items()}
+        parcel_stats_db = crud.create_parcel_stats(
+            db=db, parcel_id=create_parcel_request.parcel_id,
+            parcel_wkt=create_parcel_request.wkt, job_id=None,
+            lulc_stats=json.dumps(
+                crud.explode_lulc_counts(db, lulc_counts)))
+        # There is no job for the frontend to wait on.
+        return {
+            "job_id": None,
+            "stats_id": parcel_stats_db.stats_id
+        }
+
     # NOTE this assumes we're always using baseline LULC
     # Create job entry for wallpapering task
     job_schema = schemas.JobBase(
@@ -706,15 +1557,31 @@ def add_parcel(create_parcel_request: schemas.ParcelCreateRequest,
             }
         }
 
-    QUEUE.put_nowait((HIGH_PRIORITY, job_db.job_id, worker_task))
+    _enqueue_job(db, job_db.job_id, HIGH_PRIORITY, worker_task)
 
     # Return job_id
     return worker_task['server_attrs']
 
 
+@app.post("/base_parcel_stats")
+def add_base_parcel_stats(parcel_stats: schemas.BaseParcelStatsRequest,
+                          db: Session = Depends(get_db)):
+    """Store base LULC stats under parcels, computed offline.
+
+    See ``backend-worker/precompute_parcel_stats.py``.
+    """
+    return crud.put_base_parcel_stats(db, parcel_stats)
+
+
 @app.post("/invest/{scenario_id}")
-def run_invest(scenario_id: int, db: Session = Depends(get_db)):
-    """Add invest job to the queue. This runs all InVEST models."""
+def run_invest(scenario_id: int, after_job_id: Optional[int] = None,
+               db: Session = Depends(get_db)):
+    """Add invest job to the queue. This runs all InVEST models.
+
+    If the scenario's LULC is still being built, by ``after_job_id`` or by
+    a fill, wallpaper or crop job still on the queue for this scenario, the
+    models are queued now and run as soon as that job succeeds.
+    """
     # Results may already exist; no need to re-compute
     invest_results_db = crud.get_invest(db, scenario_id)
     LOGGER.info(invest_results_db)
@@ -725,6 +1592,19 @@ def run_invest(scenario_id: int, db: Session = Depends(get_db)):
     if scenario_db is None:
         raise HTTPException(status_code=404, detail="Scenario not found")
     scenario_lulc = scenario_db.lulc_url_result
+    blocked_by = None
+    if after_job_id is not None:
+        after_job_db = crud.get_job(db, after_job_id)
+        if after_job_db is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if after_job_db.status in ACTIVE_JOB_STATUSES:
+            blocked_by = after_job_id
+    else:
+        blocked_by = crud.get_scenario_build_job_id(
+            db, scenario_id, SCENARIO_JOB_TYPES)
+    if blocked_by is not None:
+        # Filled in when the job that builds it succeeds.
+        scenario_lulc = None
 
     # Get the session_id
     study_area_id = scenario_db.study_area_id
@@ -769,7 +1649,8 @@ def run_invest(scenario_id: int, db: Session = Depends(get_db)):
                 }
             }
 
-            QUEUE.put_nowait((MEDIUM_PRIORITY, job_db.job_id, worker_task))
+            _enqueue_job(db, job_db.job_id, MEDIUM_PRIORITY, worker_task,
+                         blocked_by=blocked_by)
             invest_job_dict[invest_model] = job_db.job_id
 
     # Return dictionary of invest model names mapped to job_ids
@@ -0,0 +1,69 @@
+"""Render metrics in the Prometheus text exposition format.
+
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{key}="{str(value)}"' for key, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def gauge(name, help_text, samples):
+    """Format a gauge.
+
+    Args:
+        name (str): the metric name.
+        help_text (str): a description of the metric.
+        samples (list): ``(labels, value)`` pairs, where ``labels`` is a
+            dict.
+
+    Returns:
+        A list of lines.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+def histogram(name, help_text, samples, buckets):
+    """Format a histogram.
+
+    Args:
+        name (str): the metric name.
+        help_text (str): a description of the metric.
+        samples (list): ``(labels, bucket_counts, count, total)`` tuples,
+            where ``bucket_counts`` has the number of observations less than
+            or equal to each of ``buckets``.
+        buckets (list): the upper bound of each bucket, in increasing order.
+
+    Returns:
+        A list of lines.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, bucket_counts, count, total in samples:
+        for upper_bound, bucket_count in zip(buckets, bucket_counts):
+            bucket_labels = {**labels, "le": _format_value(float(upper_bound))}
+            lines.append(
+                f"{name}_bucket{_format_labels(bucket_labels)} {bucket_count}")
+        inf_labels = {**labels, "le": "+Inf"}
+        lines.append(f"{name}_bucket{_format_labels(inf_labels)} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return lines
+
+
+def render(*metrics):
+    """Join the lines of several metrics into the body of a response."""
+    return "\n".join(line for lines in metrics for line in lines) + "\n"
@@ -1,4 +1,6 @@
 """ Create SQLAlchemy models from the 'Base' class."""
+from datetime import datetime
+
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
@@ -23,6 +25,19 @@ class Job(Base):
     name = Column(String, index=True)
     description = Column(String)
     status = Column(String)
+    # One of the JOB_TYPES in main; set when the job is enqueued.
+    job_type = Column(String, index=True)
+    # When the job was queued, handed to a worker, started running on the
+    # worker and finished, in UTC.
+    enqueued_at = Column(DateTime)
+    leased_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    # JSON object of seconds spent in each stage of the job, as reported by
+    # the worker, e.g. {"read": 0.1, "compute": 2.5, "write": 0.2}
+    timings = Column(String)
+    # The worker process's peak resident set size while running the job.
+    peak_rss_bytes = Column(Integer)
     # each job has an associated session owner
     owner_id = Column(String, ForeignKey("sessions.session_id"))
 
@@ -30,6 +45,48 @@ class Job(Base):
     #jobs = relationship("ParcelStats", back_populates="jobs_id")
 
 
+class QueuedJob(Base):
+    """SQLAlchemy model for jobs waiting in, or leased from, the job queue.
+
+    The queue lives in the db rather than in memory so that pending work
+    survives a restart of the API and so that several API processes can
+    dispatch from the same queue.
+    """
+    __tablename__ = "job_queue"
+
+    job_id = Column(Integer, ForeignKey("jobs.job_id"), primary_key=True)
+    priority = Column(Integer, index=True)
+    job_type = Column(String)
+    # The session that submitted the job, for fair-share dispatch.
+    owner_id = Column(String, index=True)
+    # The scenario the job works on, if any, and the operation, e.g.
+    # "lulc_fill" or "invest:carbon". A newer job for the same scenario and
+    # operation supersedes this one.
+    scenario_id = Column(Integer, index=True)
+    operation = Column(String)
+    # The other scenario the job builds the LULC of, if any: the baseline
+    # that a lulc_crop_and_modify job crops.
+    baseline_scenario_id = Column(Integer, index=True)
+    # The JSON-encoded task exactly as it is handed to the worker.
+    payload = Column(String)
+    enqueued_at = Column(DateTime, default=datetime.utcnow)
+    # Both are NULL until a worker leases the job. The worker renews the
+    # lease with heartbeats; an expired lease is put back on the queue.
+    lease_owner = Column(String, index=True)
+    lease_expiry = Column(DateTime, index=True)
+    # How many times the job has been leased.
+    attempts = Column(Integer, default=0)
+    # A hash of the job type and args; identical jobs have the same one.
+    fingerprint = Column(String, index=True)
+    # If an identical job was already pending or running when this one was
+    # submitted, this job is never leased. It gets the other job's result.
+    coalesced_into = Column(Integer, ForeignKey("jobs.job_id"), index=True)
+    # The job this one needs the result of, e.g. the job that builds the
+    # LULC an InVEST run reads. The job is not leased until that job
+    # succeeds, and fails or is cancelled along with it.
+    blocked_by = Column(Integer, ForeignKey("jobs.job_id"), index=True)
+
+
 class Session(Base):
     """SQLAlchemy model for sessions."""
     __tablename__ = "sessions"
@@ -110,6 +167,19 @@ class ParcelStats(Base):
     job_id = Column(Integer, ForeignKey("jobs.job_id"))
 
 
+class BaseParcelStats(Base):
+    """SQLAlchemy model for lulc stats under parcels, computed offline.
+
+    The counts are of the base LULC identified by ``lulc_version``, so
+    they go stale when the base LULC changes.
+    """
+    __tablename__ = "base_parcel_stats"
+
+    parcel_id = Column(Integer, primary_key=True)
+    lulc_version = Column(String, primary_key=True)
+    lulc_stats = Column(String)
+
+
 class Parcel(Base):
     """SQLAlchemy model for parcels."""
     __tablename__ = "parcel"
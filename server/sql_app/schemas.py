@@ -1,6 +1,6 @@
 """Pydantic models which define more or less a "schema" (valid data shape)."""
 from datetime import datetime
-from typing import Optional, Union, Literal
+from typing import Dict, List, Optional, Union, Literal
 
 from pydantic import BaseModel
 
@@ -77,8 +77,8 @@ class ScenarioCreateResponse(BaseModel):
 
 class ScenarioUpdate(BaseModel):
     """Pydantic model for updating Scenarios in the DB."""
-    lulc_url_result: str
-    lulc_stats: str
+    lulc_url_result: Union[str, None]
+    lulc_stats: Union[str, None]
 
 
 class ParcelStats(BaseModel):
@@ -147,13 +147,20 @@ class JobBase(BaseModel):
     """Pydantic model base for Jobs."""
     name: str
     description: Optional[str] = None
-    status: Literal['success', 'failed', 'pending', 'running']
+    status: Literal['success', 'failed', 'pending', 'running', 'cancelled']
 
 
 class Job(JobBase):
     """Pydantic model used when reading data, when returning it from API."""
     job_id: int
     owner_id: str
+    job_type: Optional[str] = None
+    enqueued_at: Optional[datetime] = None
+    leased_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    timings: Optional[str] = None
+    peak_rss_bytes: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -161,7 +168,7 @@ class Job(JobBase):
 
 class JobStatus(BaseModel):
     """Pydantic model used for returning status response of a job."""
-    status: Literal['success', 'failed', 'pending', 'running']
+    status: Literal['success', 'failed', 'pending', 'running', 'cancelled']
 
     class Config:
         orm_mode = True
@@ -175,6 +182,15 @@ class JobResponse(BaseModel):
         orm_mode = True
 
 
+class ParcelCreateResponse(BaseModel):
+    """Pydantic model for the response after adding a parcel.
+
+    ``job_id`` is None if the parcel's stats were precomputed, since there
+    is no job to wait for.
+    """
+    job_id: Optional[int]
+
+
 class ParcelCreateRequest(BaseModel):
     """Pydantic model for payload of request to create parcel."""
     session_id: str
@@ -192,7 +208,19 @@ class ParcelDeleteRequest(BaseModel):
 
 class ParcelStatsUpdate(BaseModel):
     """Pydantic model used for updating stats."""
-    lulc_stats: str
+    lulc_stats: Union[str, None]
+
+
+class BaseParcelStats(BaseModel):
+    """Pydantic model for the base lulc pixel counts under a parcel."""
+    parcel_id: int
+    lulc_stats: Dict[int, int]
+
+
+class BaseParcelStatsRequest(BaseModel):
+    """Pydantic model for payload of request to store precomputed stats."""
+    lulc_version: str
+    parcels: List[BaseParcelStats]
 
 
 class WorkerResponse(BaseModel):
@@ -200,11 +228,34 @@ class WorkerResponse(BaseModel):
     result: Union[str, dict]
     status: Literal['success', 'failed', 'pending', 'running']
     server_attrs: dict
+    # Only required when posting several results at once.
+    job_type: Optional[str] = None
+    # When the job ran and what it cost: "started_at" and "finished_at" as
+    # Unix timestamps, "timings" in seconds per stage and "peak_rss_bytes".
+    metrics: Optional[dict] = None
 
     class Config:
         orm_mode = True
 
 
+class LeaseRequest(BaseModel):
+    """Pydantic model for a worker's request to lease several jobs."""
+    worker_id: str
+    # Maps job types to the number of jobs of that type the worker can take.
+    capacity: dict[str, int]
+    wait: float = 0
+    # Optionally, the number of jobs of each class ("interactive" or
+    # "batch") and in total that the worker can take.
+    class_capacity: Optional[dict[str, int]] = None
+    max_jobs: Optional[int] = None
+
+
+class Heartbeat(BaseModel):
+    """Pydantic model for a worker renewing the leases on its jobs."""
+    worker_id: str
+    job_ids: list[int]
+
+
 class Wallpaper(BaseModel):
     """Pydantic model for the wallpaper request."""
     scenario_id: int
@@ -223,6 +274,21 @@ class ParcelFill(BaseModel):
         orm_mode = True
 
 
+class CropAndModify(BaseModel):
+    """Pydantic model for the request to crop the baseline and modify it.
+
+    Exactly one of ``lulc_class`` (fill) or ``pattern_id`` (wallpaper) is
+    given.
+    """
+    baseline_scenario_id: int
+    scenario_id: int
+    lulc_class: Optional[int] = None
+    pattern_id: Optional[int] = None
+
+    class Config:
+        orm_mode = True
+
+
 class LulcRequest(BaseModel):
     nlud_tier_2: str
     nlud_tier_3: str